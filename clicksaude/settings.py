@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     'django.contrib.humanize',
     "core",
     "consultas",
@@ -138,6 +139,41 @@ STATICFILES_DIRS = [BASE_DIR / "core" / "static"]
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Motor de cálculo de slots da agenda: "python" (padrão) ou "postgres" (generate_series + tstzrange)
+CONSULTAS_SLOTS_BACKEND = os.environ.get("CONSULTAS_SLOTS_BACKEND", "python")
+
+# Cache compartilhado entre os workers do gunicorn: as versões das agendas e do calendário
+# (consultas.cache, consultas.calendario) precisam ser vistas por todos os processos.
+# Com REDIS_URL usa o Redis (requer o pacote redis); sem ele, a tabela de cache no PostgreSQL
+# (criada por `manage.py createcachetable`).
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "clicksaude_cache",
+        }
+    }
+
+# Permite o cache de slots com um backend local ao processo (LocMemCache), só para desenvolvimento
+CONSULTAS_CACHE_LOCAL_PERMITIDO = os.environ.get("CONSULTAS_CACHE_LOCAL_PERMITIDO", "0") == "1"
+
+# Por quantos minutos o slot escolhido fica reservado enquanto o formulário de agendamento está aberto
+CONSULTAS_RESERVA_MINUTOS = int(os.environ.get("CONSULTAS_RESERVA_MINUTOS", 5))
+
+# Linhas aceitas pela importação de usuários no admin (roda dentro da requisição); acima disso,
+# o comando `importar_usuarios`
+IMPORTACAO_ADMIN_MAX_LINHAS = int(os.environ.get("IMPORTACAO_ADMIN_MAX_LINHAS", 200))
+
+# Até quantas consultas as listagens contam; acima disso o total aparece como "mais de N"
+CONSULTAS_CONTAGEM_MAXIMA = int(os.environ.get("CONSULTAS_CONTAGEM_MAXIMA", 1000))
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _cache_em_memoria(settings):
+    """Os testes rodam num só processo: cache em memória, sem as queries da tabela de cache nas contagens."""
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    settings.CONSULTAS_CACHE_LOCAL_PERMITIDO = True
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Consulta
+from .models import Consulta, FeriadoClinica
 from core.models import Especialidade
 # Importação da timezone para garantir que as datas sejam formatadas corretamente
 from django.utils import timezone 
@@ -53,3 +53,11 @@ class ConsultaAdmin(admin.ModelAdmin):
     
     # Adicionando um campo para facilitar a navegação por data
     date_hierarchy = 'data_hora_inicio'
+
+
+@admin.register(FeriadoClinica)
+class FeriadoClinicaAdmin(admin.ModelAdmin):
+    list_display = ("descricao", "data_inicio", "data_fim")
+    search_fields = ("descricao",)
+    ordering = ("-data_inicio",)
+    date_hierarchy = "data_inicio"
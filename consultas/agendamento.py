@@ -0,0 +1,244 @@
+# agendamento.py
+"""
+Gravação de agendamentos sob trava por médico.
+
+Cada agendamento roda numa transação que segura um advisory lock do PostgreSQL
+(`pg_advisory_xact_lock`) com o id do médico: agendamentos simultâneos do mesmo médico são
+serializados e o conflito é verificado de novo já com a trava, antes do INSERT. O envio do
+formulário carrega uma chave de idempotência (SubmissaoAgendamento); reenvios com a mesma
+chave (duplo clique, retry do navegador) devolvem a consulta criada no primeiro envio. A mesma
+chave identifica a reserva temporária do slot (`consultas.reservas`), removida ao agendar.
+
+O tempo de espera pela trava é acumulado por médico (`estatisticas_travas`) e esperas acima
+de `CONSULTAS_TRAVA_ALERTA_MS` são registradas em log.
+
+Séries de consultas (`agendar_serie`) usam a mesma trava: todas as ocorrências são conferidas
+contra a agenda carregada uma única vez e as livres são gravadas com um só `bulk_create`.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, time as _time
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .cache import invalidar_agenda
+from .materializacao import ocupar_slots
+from .models import Consulta, ReservaSlot, SubmissaoAgendamento
+from .utils import DURACAO_CONSULTA, _make_aware, carregar_agendas, checar_conflito_consulta, periodos_trabalho
+
+logger = logging.getLogger(__name__)
+
+# Primeira metade da chave do advisory lock: separa as travas de agenda de outros usos
+TRAVA_AGENDA_NAMESPACE = 7301
+
+# Esperas pela trava acima deste valor (ms) geram um aviso no log
+CONSULTAS_TRAVA_ALERTA_MS = getattr(settings, "CONSULTAS_TRAVA_ALERTA_MS", 200)
+
+MENSAGEM_CONFLITO = "O horário selecionado acabou de ser ocupado por outro agendamento. Escolha outro horário."
+
+# constraints de Consulta que significam "horário já ocupado"; outras violações não são conflito de agenda
+CONSTRAINTS_DE_CONFLITO = {"consulta_sem_sobreposicao", "consulta_ativa_medico_inicio_uniq"}
+
+
+def _conflito_de_agenda(erro: IntegrityError) -> bool:
+    diagnostico = getattr(erro.__cause__, "diag", None)
+    return getattr(diagnostico, "constraint_name", None) in CONSTRAINTS_DE_CONFLITO
+
+
+class MetricasTrava:
+    """Contadores em memória (por processo) do tempo de espera pela trava de cada médico."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._por_medico = defaultdict(lambda: {"aquisicoes": 0, "espera_total_ms": 0.0, "espera_max_ms": 0.0})
+
+    def registrar(self, medico_id: int, espera_ms: float) -> None:
+        with self._lock:
+            item = self._por_medico[int(medico_id)]
+            item["aquisicoes"] += 1
+            item["espera_total_ms"] += espera_ms
+            item["espera_max_ms"] = max(item["espera_max_ms"], espera_ms)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                medico_id: {
+                    **item,
+                    "espera_media_ms": item["espera_total_ms"] / item["aquisicoes"],
+                }
+                for medico_id, item in self._por_medico.items()
+            }
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._por_medico.clear()
+
+
+metricas_trava = MetricasTrava()
+
+
+def estatisticas_travas() -> dict:
+    """{medico_id: {aquisicoes, espera_total_ms, espera_max_ms, espera_media_ms}} deste processo."""
+    return metricas_trava.estatisticas()
+
+
+def travar_agenda_medico(medico_id: int) -> float:
+    """
+    Segura a trava da agenda do médico até o fim da transação corrente e retorna a espera em ms.
+    Deve ser chamada dentro de `transaction.atomic()`.
+    """
+    inicio = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [TRAVA_AGENDA_NAMESPACE, int(medico_id)])
+    espera_ms = (time.perf_counter() - inicio) * 1000
+
+    metricas_trava.registrar(medico_id, espera_ms)
+    if espera_ms >= CONSULTAS_TRAVA_ALERTA_MS:
+        logger.warning("Espera de %.1f ms pela trava da agenda do médico %s.", espera_ms, medico_id)
+    else:
+        logger.debug("Trava da agenda do médico %s obtida em %.1f ms.", medico_id, espera_ms)
+    return espera_ms
+
+
+def consulta_da_submissao(chave):
+    """Consulta já criada por um envio com esta chave de idempotência (ou None)."""
+    if not chave:
+        return None
+    submissao = SubmissaoAgendamento.objects.select_related("consulta").filter(chave=chave).first()
+    return submissao.consulta if submissao else None
+
+
+def agendar_consulta(form, chave=None):
+    """
+    Salva a consulta de um ConsultaForm válido sob a trava do médico.
+    Retorna (consulta, criada); `criada` é False quando a chave já tinha sido usada.
+    Levanta ValidationError se o horário foi ocupado depois da validação do formulário.
+    """
+    consulta = form.instance
+    try:
+        with transaction.atomic():
+            travar_agenda_medico(consulta.medico_id)
+
+            existente = consulta_da_submissao(chave)
+            if existente is not None:
+                return existente, False
+
+            # a reserva do próprio formulário (mesma chave) não conta como conflito
+            if checar_conflito_consulta(
+                consulta.medico_id, consulta.data_hora_inicio, consulta.data_hora_fim, chave_reserva=chave
+            ):
+                raise ValidationError(MENSAGEM_CONFLITO)
+
+            consulta = form.save()
+            if chave:
+                SubmissaoAgendamento.objects.create(chave=chave, consulta=consulta)
+                # a reserva temporária vira a consulta
+                for reserva in ReservaSlot.objects.filter(chave=chave):
+                    reserva.delete()
+    except IntegrityError as erro:
+        # a constraint do banco segue como última barreira (ex.: escrita fora deste fluxo)
+        if not _conflito_de_agenda(erro):
+            raise
+        raise ValidationError(MENSAGEM_CONFLITO)
+
+    return consulta, True
+
+
+def datas_da_serie(primeiro_inicio: datetime, intervalo_dias: int, ocorrencias: int):
+    """Inícios das ocorrências, mantendo o horário local (a série não muda de hora no horário de verão)."""
+    local = timezone.localtime(_make_aware(primeiro_inicio))
+    return [
+        _make_aware(datetime.combine(local.date() + timedelta(days=intervalo_dias * i), local.time()))
+        for i in range(ocorrencias)
+    ]
+
+
+def _conferir_ocorrencias(agenda, inicios, duracao, agora):
+    """
+    Separa as ocorrências livres das que falham, numa única varredura: as ocorrências e os
+    intervalos ocupados estão em ordem, então o ponteiro sobre `agenda.ocupados` só avança.
+    Retorna ([inicios livres], [(inicio, motivo)]).
+    """
+    livres, falhas = [], []
+    ocupados = agenda.ocupados
+    j = 0
+    for inicio in inicios:
+        fim = inicio + duracao
+        if inicio < agora:
+            falhas.append((inicio, "horário no passado"))
+            continue
+
+        dia = timezone.localtime(inicio).date()
+        if not any(p_inicio <= inicio and fim <= p_fim for p_inicio, p_fim in periodos_trabalho(agenda, dia)):
+            falhas.append((inicio, "fora do horário de trabalho do médico"))
+            continue
+
+        while j < len(ocupados) and ocupados[j][1] <= inicio:
+            j += 1
+        if j < len(ocupados) and ocupados[j][0] < fim:
+            falhas.append((inicio, "conflito com outra consulta ou bloqueio"))
+            continue
+
+        livres.append(inicio)
+    return livres, falhas
+
+
+def agendar_serie(
+    medico_id: int,
+    paciente_id: int,
+    primeiro_inicio: datetime,
+    intervalo_dias: int,
+    ocorrencias: int,
+    retorno: bool = True,
+    sintomas: str = None,
+    chave_reserva=None,
+):
+    """
+    Agenda `ocorrencias` consultas a cada `intervalo_dias` dias (7 = semanal) a partir de `primeiro_inicio`.
+    As ocorrências livres são gravadas juntas, numa transação sob a trava do médico; as demais são
+    devolvidas com o motivo. `chave_reserva` é a reserva do slot feita pelo formulário de agendamento
+    de onde a série partiu: não conta como conflito e é liberada quando a série é gravada.
+    Retorna ([consultas criadas], [(inicio, motivo)]).
+    """
+    inicios = datas_da_serie(primeiro_inicio, intervalo_dias, ocorrencias)
+    inicio_busca = _make_aware(datetime.combine(timezone.localtime(inicios[0]).date(), _time.min))
+    fim_busca = inicios[-1] + DURACAO_CONSULTA
+
+    try:
+        with transaction.atomic():
+            travar_agenda_medico(medico_id)
+            agenda = carregar_agendas([medico_id], inicio_busca, fim_busca, chave_reserva=chave_reserva)[int(medico_id)]
+            livres, falhas = _conferir_ocorrencias(agenda, inicios, DURACAO_CONSULTA, timezone.now())
+
+            criadas = Consulta.objects.bulk_create(
+                Consulta(
+                    medico_id=medico_id,
+                    paciente_id=paciente_id,
+                    data_hora_inicio=inicio,
+                    data_hora_fim=inicio + DURACAO_CONSULTA,
+                    retorno=retorno,
+                    sintomas=sintomas,
+                )
+                for inicio in livres
+            )
+            if criadas and chave_reserva:
+                for reserva in ReservaSlot.objects.filter(chave=chave_reserva):
+                    reserva.delete()
+    except IntegrityError as erro:
+        if not _conflito_de_agenda(erro):
+            raise
+        raise ValidationError(MENSAGEM_CONFLITO)
+
+    if criadas:
+        # bulk_create não dispara os signals: cache e slots materializados são atualizados aqui
+        invalidar_agenda(medico_id)
+        # as sessões só ocupam horários: um DELETE dos slots cobertos, sem recalcular as semanas da série
+        intervalos = [(consulta.data_hora_inicio, consulta.data_hora_fim) for consulta in criadas]
+        transaction.on_commit(lambda: ocupar_slots(medico_id, intervalos))
+
+    return criadas, falhas
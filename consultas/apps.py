@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ConsultasConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "consultas"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,221 @@
+# benchmark.py
+"""
+Benchmark do motor de slots com agendas sintéticas.
+
+Gera médicos com uma quantidade configurável de turnos (HorarioTrabalho), exceções
+(ExcecaoHorario) e consultas por dia, mede `calcular_slots_disponiveis`,
+`checar_conflito_consulta` e `gerar_horarios_disponiveis` em cada horizonte e retorna
+percentis de latência e número de queries por chamada. Os dados sintéticos são criados
+dentro de uma transação desfeita ao final: o banco volta ao estado anterior.
+
+Usado pelo comando `benchmark_slots`, que grava o resultado em JSON para comparar versões.
+"""
+import math
+import random
+import time
+from datetime import datetime, timedelta, time as _time
+from typing import Callable, Dict, List
+
+import django
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import Medico, Paciente, Usuario
+from .calendario import calendario_clinica
+from .models import Consulta, ExcecaoHorario, HorarioTrabalho
+from .utils import (
+    DURACAO_CONSULTA,
+    SLOT_MINUTOS,
+    _backend_slots,
+    _day_to_model_day,
+    _make_aware,
+    calcular_slots_disponiveis,
+    checar_conflito_consulta,
+)
+
+PERCENTIS = (50, 90, 95, 99)
+
+# Turnos sintéticos começam às 07:00 e duram 4h, com 1h de intervalo entre eles
+HORA_PRIMEIRO_TURNO = 7
+HORAS_POR_TURNO = 4
+# quantos turnos cabem até a meia-noite (07-11, 12-16, 17-21)
+MAX_TURNOS_POR_DIA = (24 - HORA_PRIMEIRO_TURNO + 1) // (HORAS_POR_TURNO + 1)
+
+
+def _percentil(valores: List[float], p: int) -> float:
+    """Percentil pelo método nearest-rank (valores já ordenados)."""
+    if not valores:
+        return 0.0
+    posicao = max(math.ceil(p / 100 * len(valores)) - 1, 0)
+    return valores[posicao]
+
+
+def _turnos(turnos_por_dia: int):
+    for i in range(turnos_por_dia):
+        inicio = HORA_PRIMEIRO_TURNO + i * (HORAS_POR_TURNO + 1)
+        yield _time(inicio), _time(inicio + HORAS_POR_TURNO)
+
+
+def gerar_agendas_sinteticas(
+    medicos: int = 20,
+    turnos_por_dia: int = 2,
+    dias_trabalho: int = 5,
+    excecoes: int = 10,
+    consultas_por_dia: int = 4,
+    horizonte_dias: int = 30,
+    semente: int = 42,
+) -> List[int]:
+    """
+    Cria médicos sintéticos (com um paciente compartilhado) e retorna seus ids.
+    - `dias_trabalho`: dias da semana com expediente, a partir de segunda-feira
+    - `excecoes`: exceções por médico dentro do horizonte (~1 em 5 é disponibilidade extra)
+    - `consultas_por_dia`: consultas agendadas por médico em cada dia de expediente
+    Usa bulk_create: nenhum signal é disparado. Deve rodar dentro de uma transação.
+    """
+    if not 1 <= turnos_por_dia <= MAX_TURNOS_POR_DIA:
+        raise ValueError(f"turnos_por_dia deve estar entre 1 e {MAX_TURNOS_POR_DIA}.")
+
+    rnd = random.Random(semente)
+    hoje = timezone.localdate()
+    prefixo = f"b{time.time_ns() % 10**6:06d}"
+    dias_semana = [(d + 1) % 7 for d in range(min(dias_trabalho, 7))]
+    turnos = list(_turnos(turnos_por_dia))
+
+    usuario_paciente = Usuario.objects.create_user(
+        username=f"{prefixo}p", cpf=f"{prefixo}p", nome_completo="Paciente Benchmark", tipo="paciente"
+    )
+    paciente = Paciente.objects.create(usuario=usuario_paciente)
+
+    usuarios = Usuario.objects.bulk_create(
+        Usuario(
+            username=f"{prefixo}m{i:05d}",
+            cpf=f"{prefixo}m{i:05d}",
+            nome_completo=f"Médico Benchmark {i}",
+            tipo="medico",
+        )
+        for i in range(medicos)
+    )
+    lista_medicos = Medico.objects.bulk_create(Medico(usuario=usuario) for usuario in usuarios)
+
+    horarios, bloqueios, consultas = [], [], []
+    for medico in lista_medicos:
+        for dia_semana in dias_semana:
+            for hora_inicio, hora_fim in turnos:
+                horarios.append(
+                    HorarioTrabalho(medico=medico, dia_semana=dia_semana, hora_inicio=hora_inicio, hora_fim=hora_fim)
+                )
+
+        for _ in range(excecoes):
+            dia = hoje + timedelta(days=rnd.randrange(horizonte_dias))
+            inicio = _make_aware(datetime.combine(dia, _time(rnd.randrange(6, 20))))
+            bloqueios.append(
+                ExcecaoHorario(
+                    medico=medico,
+                    data_inicio=inicio,
+                    data_fim=inicio + timedelta(hours=rnd.randint(1, 4)),
+                    esta_bloqueado=rnd.random() >= 0.2,
+                    motivo="Benchmark",
+                )
+            )
+
+        for deslocamento in range(horizonte_dias):
+            dia = hoje + timedelta(days=deslocamento)
+            if _day_to_model_day(dia) not in dias_semana:
+                continue
+            inicios = {
+                datetime.combine(dia, hora_inicio)
+                + rnd.randrange(HORAS_POR_TURNO * 60 // SLOT_MINUTOS) * DURACAO_CONSULTA
+                for hora_inicio, _ in (rnd.choice(turnos) for _ in range(consultas_por_dia))
+            }
+            for inicio in sorted(inicios):
+                inicio = _make_aware(inicio)
+                consultas.append(
+                    Consulta(
+                        medico=medico,
+                        paciente=paciente,
+                        data_hora_inicio=inicio,
+                        data_hora_fim=inicio + DURACAO_CONSULTA,
+                    )
+                )
+
+    HorarioTrabalho.objects.bulk_create(horarios)
+    ExcecaoHorario.objects.bulk_create(bloqueios)
+    Consulta.objects.bulk_create(consultas)
+    return [medico.pk for medico in lista_medicos]
+
+
+def medir(funcao: Callable, argumentos: List[tuple]) -> Dict[str, float]:
+    """Chama `funcao(*args)` para cada item de `argumentos`; retorna percentis (ms) e queries por chamada."""
+    duracoes, queries = [], []
+    for args in argumentos:
+        with CaptureQueriesContext(connection) as capturadas:
+            inicio = time.perf_counter()
+            funcao(*args)
+            duracoes.append((time.perf_counter() - inicio) * 1000)
+        queries.append(len(capturadas))
+
+    duracoes.sort()
+    resultado = {"chamadas": len(duracoes)}
+    resultado.update({f"p{p}_ms": round(_percentil(duracoes, p), 3) for p in PERCENTIS})
+    resultado["max_ms"] = round(duracoes[-1], 3) if duracoes else 0.0
+    resultado["media_ms"] = round(sum(duracoes) / len(duracoes), 3) if duracoes else 0.0
+    resultado["queries_media"] = round(sum(queries) / len(queries), 2) if queries else 0.0
+    resultado["queries_max"] = max(queries, default=0)
+    return resultado
+
+
+def executar_benchmark(horizontes=(7, 30, 90), repeticoes: int = 20, semente: int = 42, **parametros) -> dict:
+    """
+    Gera as agendas sintéticas, mede as três funções em cada horizonte e desfaz tudo.
+    `parametros` são repassados para `gerar_agendas_sinteticas`.
+    """
+    from .views import gerar_horarios_disponiveis
+
+    horizontes = sorted(set(horizontes))
+    rnd = random.Random(semente)
+    resultados = []
+
+    with transaction.atomic():
+        medico_ids = gerar_agendas_sinteticas(horizonte_dias=max(horizontes), semente=semente, **parametros)
+        medicos = list(Medico.objects.filter(pk__in=medico_ids))
+        hoje = timezone.localdate()
+        # o calendário da clínica é carregado uma vez por processo: mede-se o regime permanente
+        calendario_clinica.fechamentos(timezone.now(), timezone.now())
+
+        for horizonte in horizontes:
+            sorteados = [rnd.choice(medicos) for _ in range(repeticoes)]
+            dias = [hoje + timedelta(days=rnd.randrange(horizonte)) for _ in range(repeticoes)]
+            intervalos = [
+                _make_aware(datetime.combine(dia, _time(rnd.randrange(7, 18), rnd.choice((0, 30))))) for dia in dias
+            ]
+
+            casos = {
+                "calcular_slots_disponiveis": (
+                    calcular_slots_disponiveis,
+                    [(medico.pk, horizonte) for medico in sorteados],
+                ),
+                "checar_conflito_consulta": (
+                    checar_conflito_consulta,
+                    [(medico.pk, inicio, inicio + DURACAO_CONSULTA) for medico, inicio in zip(sorteados, intervalos)],
+                ),
+                "gerar_horarios_disponiveis": (
+                    gerar_horarios_disponiveis,
+                    list(zip(sorteados, dias)),
+                ),
+            }
+            for nome, (funcao, argumentos) in casos.items():
+                resultados.append({"funcao": nome, "horizonte_dias": horizonte, **medir(funcao, argumentos)})
+
+        transaction.set_rollback(True)
+
+    return {
+        "gerado_em": timezone.now().isoformat(),
+        "ambiente": {
+            "django": django.get_version(),
+            "banco": connection.vendor,
+            "backend_slots": _backend_slots(),
+        },
+        "parametros": {"horizontes": horizontes, "repeticoes": repeticoes, "semente": semente, **parametros},
+        "resultados": resultados,
+    }
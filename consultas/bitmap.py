@@ -0,0 +1,164 @@
+# bitmap.py
+"""
+Motor vetorizado de disponibilidade com NumPy.
+
+Cada dia de um médico vira uma linha de 1440 posições (uma por minuto). Os horários de trabalho
+e as disponibilidades extras são aplicados como máscaras, bloqueios e consultas viram um vetor de
+ocupação com soma acumulada, e os slots livres saem de operações em arrays em vez de comparações
+slot a slot entre datetimes. O resultado é o mesmo de `calcular_slots_disponiveis` para agendas
+com horários em minutos cheios (intervalos ocupados fora do minuto são arredondados para fora).
+"""
+from datetime import date, datetime, time as _time
+from typing import Dict, List
+
+import numpy as np
+from django.utils import timezone
+
+from .utils import (
+    SLOT_MINUTOS,
+    AgendaMedico,
+    _day_to_model_day,
+    _janela_busca,
+    _make_aware,
+    _proximo_slot,
+    _resolver_medicos,
+    carregar_agendas,
+)
+
+MINUTOS_DIA = 24 * 60
+
+
+def _minuto(dt: datetime, data_inicial: date, arredondar_para_cima: bool = False) -> int:
+    """Posição de `dt` (no fuso corrente) no vetor de minutos que começa em `data_inicial`."""
+    local = timezone.localtime(dt)
+    minuto = (local.date() - data_inicial).days * MINUTOS_DIA + local.hour * 60 + local.minute
+    if arredondar_para_cima and (local.second or local.microsecond):
+        minuto += 1
+    return minuto
+
+
+def _minuto_do_dia(hora: _time, arredondar_para_cima: bool = False) -> int:
+    minuto = hora.hour * 60 + hora.minute
+    if arredondar_para_cima and (hora.second or hora.microsecond):
+        minuto += 1
+    return minuto
+
+
+def _mascara_trabalho(agenda: AgendaMedico, data_inicial: date, dias: int) -> np.ndarray:
+    """Matriz (dias x 1440) com True nos minutos de trabalho (recorrente + extras)."""
+    semana = np.zeros((7, MINUTOS_DIA), dtype=bool)
+    for dia_semana, horarios in agenda.horarios.items():
+        for hora_inicio, hora_fim in horarios:
+            inicio = _minuto_do_dia(hora_inicio, arredondar_para_cima=True)
+            fim = _minuto_do_dia(hora_fim)
+            if fim > inicio:
+                semana[dia_semana, inicio:fim] = True
+
+    dias_semana = np.array(
+        [_day_to_model_day(date.fromordinal(data_inicial.toordinal() + i)) for i in range(dias)], dtype=np.intp
+    )
+    trabalho = semana[dias_semana]
+
+    if agenda.extras:
+        plano = trabalho.reshape(-1)
+        for inicio, fim in agenda.extras:
+            a = max(_minuto(inicio, data_inicial, arredondar_para_cima=True), 0)
+            b = min(_minuto(fim, data_inicial), plano.size)
+            if b > a:
+                plano[a:b] = True
+
+    return trabalho
+
+
+def _ocupacao_acumulada(agenda: AgendaMedico, data_inicial: date, dias: int) -> np.ndarray:
+    """Soma acumulada (tamanho dias*1440 + 1) dos minutos ocupados por bloqueios e consultas."""
+    total = dias * MINUTOS_DIA
+    delta = np.zeros(total + 1, dtype=np.int32)
+    if agenda.ocupados:
+        limites = np.array(
+            [
+                (_minuto(inicio, data_inicial), _minuto(fim, data_inicial, arredondar_para_cima=True))
+                for inicio, fim in agenda.ocupados
+            ],
+            dtype=np.int64,
+        )
+        limites = np.clip(limites, 0, total)
+        np.add.at(delta, limites[:, 0], 1)
+        np.add.at(delta, limites[:, 1], -1)
+    ocupado = np.cumsum(delta[:-1]) > 0
+    return np.concatenate(([0], np.cumsum(ocupado, dtype=np.int32)))
+
+
+def slots_livres_minutos(agenda: AgendaMedico, data_inicial: date, dias: int, agora: datetime) -> np.ndarray:
+    """Minutos (contados a partir de `data_inicial` 00:00) em que começa cada slot livre, em ordem."""
+    trabalho = _mascara_trabalho(agenda, data_inicial, dias)
+
+    # início/fim de cada trecho contínuo de trabalho, sem atravessar a meia-noite
+    bordas = np.diff(np.pad(trabalho.astype(np.int8), ((0, 0), (1, 1))), axis=1)
+    linhas, inicios = np.nonzero(bordas == 1)
+    _, fins = np.nonzero(bordas == -1)
+    inicios = linhas * MINUTOS_DIA + inicios
+    fins = linhas * MINUTOS_DIA + fins
+
+    # trechos que já começaram: recomeçam no próximo slot alinhado ao relógio
+    agora_min = _minuto(agora, data_inicial, arredondar_para_cima=True)
+    proximo_min = _minuto(_proximo_slot(agora), data_inicial)
+    inicios = np.where(inicios < agora_min, np.maximum(inicios, proximo_min), inicios)
+
+    quantidades = np.maximum((fins - inicios) // SLOT_MINUTOS, 0)
+    if not quantidades.any():
+        return np.empty(0, dtype=np.int64)
+    deslocamentos = np.arange(quantidades.sum()) - np.repeat(np.cumsum(quantidades) - quantidades, quantidades)
+    candidatos = np.repeat(inicios, quantidades) + deslocamentos * SLOT_MINUTOS
+
+    ocupacao = _ocupacao_acumulada(agenda, data_inicial, dias)
+    livres = ocupacao[candidatos + SLOT_MINUTOS] == ocupacao[candidatos]
+    return candidatos[livres]
+
+
+def _minutos_para_dict(minutos: np.ndarray, data_inicial: date) -> Dict[str, List[str]]:
+    slots = {}
+    for minuto in minutos.tolist():
+        dia = date.fromordinal(data_inicial.toordinal() + minuto // MINUTOS_DIA)
+        resto = minuto % MINUTOS_DIA
+        slot = _make_aware(datetime.combine(dia, _time(resto // 60, resto % 60)))
+        slots.setdefault(dia.isoformat(), []).append(slot.isoformat())
+    return slots
+
+
+def calcular_slots_disponiveis_bitmap(medico_id: int, dias_a_frente: int = 7) -> Dict[str, List[str]]:
+    """Mesmo contrato e resultado de `calcular_slots_disponiveis`, calculado com máscaras NumPy."""
+    return calcular_slots_lote_bitmap([medico_id], dias_a_frente=dias_a_frente).get(int(medico_id), {})
+
+
+def calcular_slots_lote_bitmap(
+    medico_ids=None, especialidade_id: int = None, dias_a_frente: int = 7
+) -> Dict[int, Dict[str, List[str]]]:
+    """Mesmo contrato de `calcular_slots_disponiveis_lote`."""
+    return {
+        medico_id: _minutos_para_dict(minutos, data_inicial)
+        for medico_id, (minutos, data_inicial) in _minutos_lote(medico_ids, especialidade_id, dias_a_frente).items()
+    }
+
+
+def contar_slots_livres_lote(
+    medico_ids=None, especialidade_id: int = None, dias_a_frente: int = 90
+) -> Dict[int, np.ndarray]:
+    """
+    Quantidade de slots livres por dia ({medico_id: array de tamanho dias_a_frente}), sem montar
+    datetimes — para relatórios e aquecimento de cache em horizontes longos.
+    """
+    return {
+        medico_id: np.bincount(minutos // MINUTOS_DIA, minlength=dias_a_frente)
+        for medico_id, (minutos, _) in _minutos_lote(medico_ids, especialidade_id, dias_a_frente).items()
+    }
+
+
+def _minutos_lote(medico_ids, especialidade_id, dias_a_frente):
+    medico_ids = _resolver_medicos(medico_ids, especialidade_id)
+    agora, hoje_date, period_start, period_end = _janela_busca(dias_a_frente)
+    agendas = carregar_agendas(medico_ids, period_start, period_end)
+    return {
+        medico_id: (slots_livres_minutos(agenda, hoje_date, dias_a_frente, agora), hoje_date)
+        for medico_id, agenda in agendas.items()
+    }
@@ -0,0 +1,160 @@
+# cache.py
+"""
+Cache dos slots disponíveis por médico.
+
+Os resultados de `calcular_slots_disponiveis` ficam num LRU em memória (por processo),
+indexados por (médico, horizonte, dia). Cada médico tem uma versão guardada no cache do
+Django, que precisa ser compartilhado entre os processos (Redis ou o cache em banco, ver
+CACHES); os signals de `consultas.signals` trocam essa versão sempre que uma Consulta,
+HorarioTrabalho ou ExcecaoHorario do médico muda, e entradas com versão antiga são ignoradas.
+A versão é trocada na alteração e de novo no commit: um leitor que, entre os dois, calcular os
+slots sem a alteração ainda não confirmada guarda o resultado sob uma versão que o commit
+descarta. Com um cache local ao processo (LocMemCache) a invalidação não chegaria aos outros
+workers, então o LRU só é usado nesse caso se `CONSULTAS_CACHE_LOCAL_PERMITIDO` (desenvolvimento).
+
+Reservas temporárias de slot (ReservaSlot) ocupam o slot só até `expira_em`, e o vencimento não
+dispara signal: cada entrada vale no máximo até o vencimento da primeira reserva que ela considerou.
+Criar uma reserva não troca a versão (o slot já aparecia livre e o agendamento confere de novo sob a
+trava); a entrada guarda quais reservas considerou, e o formulário dono de uma delas (`chave_reserva`)
+não usa a entrada que mostra o próprio slot como ocupado.
+Alterações de FeriadoClinica mudam a versão do calendário (`consultas.calendario`), que
+invalida as entradas de todos os médicos.
+
+Operações em massa que não disparam signals (`update()`, `bulk_create()`...) precisam chamar
+`invalidar_agenda` explicitamente.
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .calendario import cache_utilizavel, versao_calendario
+from .models import ReservaSlot
+from .utils import calcular_slots_disponiveis
+
+# Quantidade máxima de entradas (médico, horizonte, dia) mantidas por processo
+SLOTS_CACHE_MAX_ITENS = getattr(settings, "SLOTS_CACHE_MAX_ITENS", 1024)
+
+
+def _chave_versao(medico_id: int) -> str:
+    return f"consultas:slots:versao:{int(medico_id)}"
+
+
+def versao_agenda(medico_id: int) -> int:
+    """Versão atual da agenda do médico. Inicializada com um valor único para não colidir após um reset do cache."""
+    chave = _chave_versao(medico_id)
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, time.time_ns(), timeout=None)
+        versao = cache.get(chave)
+    return versao
+
+
+def _trocar_versao(chave: str) -> None:
+    # valor novo em vez de incr(): duas trocas simultâneas nunca resultam na mesma versão,
+    # mesmo em backends sem incremento atômico (DatabaseCache)
+    cache.set(chave, time.time_ns(), timeout=None)
+
+
+def invalidar_agenda(medico_id: int) -> None:
+    """Troca a versão da agenda do médico agora e, dentro de uma transação, também no commit."""
+    chave = _chave_versao(medico_id)
+    _trocar_versao(chave)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _trocar_versao(chave))
+
+
+class CacheSlots:
+    """LRU limitado de slots disponíveis, com contadores de acertos, falhas e descartes."""
+
+    def __init__(self, max_itens: int = SLOTS_CACHE_MAX_ITENS):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def obter(self, medico_id: int, dias_a_frente: int = 7, chave_reserva=None) -> Dict[str, List[str]]:
+        agora = timezone.localtime(timezone.now())
+        # o dia faz parte da chave: na virada do dia as entradas antigas deixam de ser usadas
+        if not cache_utilizavel():
+            # versões locais ao processo: outro worker não veria as invalidações deste
+            with self._lock:
+                self.misses += 1
+            return _sem_slots_passados(calcular_slots_disponiveis(medico_id, dias_a_frente, chave_reserva), agora)
+        chave = (int(medico_id), dias_a_frente, agora.date())
+        # feriados da clínica valem para todos os médicos: a versão do calendário também conta
+        versao = (versao_agenda(medico_id), versao_calendario())
+
+        with self._lock:
+            item = self._itens.get(chave)
+            if (
+                item is not None
+                and item[0] == versao
+                and (item[2] is None or agora < item[2])
+                and chave_reserva not in item[3]
+            ):
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                return _sem_slots_passados(item[1], agora)
+            self.misses += 1
+
+        slots = calcular_slots_disponiveis(medico_id, dias_a_frente, chave_reserva)
+        # quando vence a primeira reserva em vigor, o slot dela volta a ficar livre
+        reservas = dict(
+            ReservaSlot.objects.filter(medico_id=medico_id, expira_em__gt=agora).values_list("chave", "expira_em")
+        )
+        valido_ate = min(reservas.values(), default=None)
+        consideradas = frozenset(reservas) - {chave_reserva}
+
+        with self._lock:
+            self._itens[chave] = (versao, slots, valido_ate, consideradas)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.evictions += 1
+
+        return _sem_slots_passados(slots, agora)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._itens),
+                "max_itens": self.max_itens,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _sem_slots_passados(slots: Dict[str, List[str]], agora: datetime) -> Dict[str, List[str]]:
+    """Copia o resultado removendo os slots de hoje que já começaram desde que ele foi calculado."""
+    hoje = agora.date().isoformat()
+    copia = {dia: list(lista) for dia, lista in slots.items()}
+    if hoje in copia:
+        copia[hoje] = [slot for slot in copia[hoje] if datetime.fromisoformat(slot) >= agora]
+        if not copia[hoje]:
+            del copia[hoje]
+    return copia
+
+
+slots_cache = CacheSlots()
+
+
+def obter_slots_disponiveis(medico_id: int, dias_a_frente: int = 7, chave_reserva=None) -> Dict[str, List[str]]:
+    """Mesmo contrato de `calcular_slots_disponiveis`, servido pelo cache quando possível."""
+    return slots_cache.obter(medico_id, dias_a_frente, chave_reserva)
@@ -0,0 +1,105 @@
+# calendario.py
+"""
+Calendário de fechamentos da clínica (FeriadoClinica) em memória.
+
+A tabela é pequena: cada processo carrega todos os fechamentos uma vez, já ordenados e
+mesclados, e responde às consultas do motor de slots e da checagem de conflito sem ir ao
+banco. Uma versão no cache do Django (compartilhado entre os processos, ver CACHES) é trocada
+pelos signals a cada alteração de FeriadoClinica, na alteração e de novo no commit (mesmo
+esquema de `consultas.cache`); o calendário é recarregado quando a versão muda. Com um cache
+local ao processo, fora do desenvolvimento, os fechamentos são lidos do banco a cada consulta.
+"""
+import time
+from bisect import bisect_right
+from datetime import datetime
+from threading import Lock
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import FeriadoClinica
+
+_CHAVE_VERSAO = "consultas:feriados:versao"
+
+
+def cache_compartilhado() -> bool:
+    """O cache do Django é visto por todos os processos (não é LocMemCache nem DummyCache)?"""
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def cache_utilizavel() -> bool:
+    """As versões no cache valem para todos os workers (ou o cache local foi liberado para desenvolvimento)."""
+    return cache_compartilhado() or getattr(settings, "CONSULTAS_CACHE_LOCAL_PERMITIDO", False)
+
+
+def versao_calendario() -> int:
+    """Versão atual do calendário da clínica (mesmo esquema de `consultas.cache.versao_agenda`)."""
+    versao = cache.get(_CHAVE_VERSAO)
+    if versao is None:
+        cache.add(_CHAVE_VERSAO, time.time_ns(), timeout=None)
+        versao = cache.get(_CHAVE_VERSAO)
+    return versao
+
+
+def _trocar_versao() -> None:
+    cache.set(_CHAVE_VERSAO, time.time_ns(), timeout=None)
+
+
+def invalidar_calendario() -> None:
+    """Troca a versão do calendário (agora e no commit): todos os processos recarregam os fechamentos."""
+    _trocar_versao()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_trocar_versao)
+
+
+class CalendarioClinica:
+    """Fechamentos da clínica ordenados e mesclados, recarregados quando a versão muda."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._versao = None
+        self._fechamentos = []
+        self._fins = []
+
+    def _atual(self):
+        versao = versao_calendario() if cache_utilizavel() else None
+        with self._lock:
+            if versao is not None and self._versao == versao:
+                return self._fechamentos, self._fins
+
+        from .utils import _make_aware, mesclar_intervalos
+
+        fechamentos = mesclar_intervalos(
+            (_make_aware(inicio), _make_aware(fim))
+            for inicio, fim in FeriadoClinica.objects.values_list("data_inicio", "data_fim")
+        )
+        fins = [fim for _, fim in fechamentos]
+        with self._lock:
+            self._versao, self._fechamentos, self._fins = versao, fechamentos, fins
+        return fechamentos, fins
+
+    def fechamentos(self, inicio: datetime, fim: datetime) -> List[Tuple[datetime, datetime]]:
+        """Fechamentos que cruzam [inicio, fim), em ordem."""
+        fechamentos, fins = self._atual()
+        encontrados = []
+        # intervalos mesclados: os fins também estão em ordem crescente
+        for i in range(bisect_right(fins, inicio), len(fechamentos)):
+            if fechamentos[i][0] >= fim:
+                break
+            encontrados.append(fechamentos[i])
+        return encontrados
+
+    def fechado(self, inicio: datetime, fim: datetime) -> bool:
+        return bool(self.fechamentos(inicio, fim))
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._versao = None
+            self._fechamentos, self._fins = [], []
+
+
+calendario_clinica = CalendarioClinica()
@@ -0,0 +1,236 @@
+# consistencia.py
+"""
+Verificação de consistência das agendas direto no banco.
+
+Cada verificação é uma única query sobre a tabela inteira (funções de janela e junções por
+sobreposição de `tstzrange`), sem carregar modelos no Python: só as linhas problemáticas
+voltam, com o total calculado junto (`COUNT(*) OVER ()`) e a amostra limitada a `limite` linhas.
+
+- consultas_sobrepostas: consultas ativas do mesmo médico que se cruzam (o fim máximo das
+  anteriores, por janela, passa do início da seguinte)
+- fora_do_expediente: consultas ativas que não cabem em nenhum turno do dia nem em uma
+  disponibilidade extra
+- em_bloqueio: consultas ativas que cruzam um bloqueio (ExcecaoHorario com esta_bloqueado)
+- turnos_sobrepostos: turnos (HorarioTrabalho) do mesmo médico e dia que se cruzam
+- sem_fim: consultas com data_hora_fim NULL
+
+`corrigir_consistencia` resolve em lote o que tem correção óbvia: preenche o fim das consultas
+sem fim e funde os turnos sobrepostos de cada médico/dia em um só. Os demais problemas pedem
+decisão humana (remarcar, cancelar) e ficam só no relatório.
+"""
+from datetime import date, datetime, timedelta, time as _time
+from functools import partial
+from typing import Dict, Optional
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import invalidar_agenda
+from .materializacao import SLOTS_JANELA_DIAS, recalcular_slots
+from .models import STATUS_OCUPANTES
+from .utils import DURACAO_CONSULTA, _make_aware
+
+# Fim efetivo de uma consulta: sem data_hora_fim ela ocupa um slot
+_FIM_CONSULTA = "COALESCE(c.data_hora_fim, c.data_hora_inicio + %(duracao)s)"
+
+SQL_CONSULTAS_SOBREPOSTAS = f"""
+WITH ordenadas AS (
+    SELECT c.id, c.medico_id, c.data_hora_inicio, {_FIM_CONSULTA} AS fim,
+           LAG(c.id) OVER janela AS anterior_id,
+           MAX({_FIM_CONSULTA}) OVER (janela ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS fim_anteriores
+    FROM consultas_consulta c
+    WHERE c.status = ANY(%(ocupantes)s)
+    WINDOW janela AS (PARTITION BY c.medico_id ORDER BY c.data_hora_inicio, c.id)
+)
+SELECT id AS consulta_id, medico_id, data_hora_inicio, fim AS data_hora_fim, anterior_id,
+       COUNT(*) OVER () AS total
+FROM ordenadas
+WHERE data_hora_inicio < fim_anteriores
+ORDER BY medico_id, data_hora_inicio
+LIMIT %(limite)s
+"""
+
+SQL_FORA_DO_EXPEDIENTE = f"""
+WITH locais AS (
+    SELECT c.id, c.medico_id, c.data_hora_inicio, {_FIM_CONSULTA} AS fim,
+           c.data_hora_inicio AT TIME ZONE %(tz)s AS inicio_local,
+           {_FIM_CONSULTA} AT TIME ZONE %(tz)s AS fim_local
+    FROM consultas_consulta c
+    WHERE c.status = ANY(%(ocupantes)s) AND c.data_hora_inicio >= %(desde)s
+)
+SELECT l.id AS consulta_id, l.medico_id, l.data_hora_inicio, l.fim AS data_hora_fim,
+       COUNT(*) OVER () AS total
+FROM locais l
+WHERE NOT EXISTS (
+    SELECT 1 FROM consultas_horariotrabalho h
+    WHERE h.medico_id = l.medico_id
+      AND h.dia_semana = EXTRACT(DOW FROM l.inicio_local)
+      AND h.hora_inicio <= l.inicio_local::time
+      AND l.fim_local <= l.inicio_local::date + h.hora_fim
+)
+AND NOT EXISTS (
+    SELECT 1 FROM consultas_excecaohorario e
+    WHERE e.medico_id = l.medico_id
+      AND NOT e.esta_bloqueado
+      AND e.data_inicio <= l.data_hora_inicio
+      AND l.fim <= e.data_fim
+)
+ORDER BY l.medico_id, l.data_hora_inicio
+LIMIT %(limite)s
+"""
+
+SQL_EM_BLOQUEIO = f"""
+SELECT c.id AS consulta_id, c.medico_id, c.data_hora_inicio, {_FIM_CONSULTA} AS data_hora_fim,
+       e.id AS excecao_id, COUNT(*) OVER () AS total
+FROM consultas_consulta c
+JOIN consultas_excecaohorario e
+  ON e.medico_id = c.medico_id
+ AND e.esta_bloqueado
+ AND tstzrange(e.data_inicio, e.data_fim) && tstzrange(c.data_hora_inicio, {_FIM_CONSULTA})
+WHERE c.status = ANY(%(ocupantes)s) AND c.data_hora_inicio >= %(desde)s
+ORDER BY c.medico_id, c.data_hora_inicio
+LIMIT %(limite)s
+"""
+
+# Ilhas de turnos sobrepostos por médico/dia (mesma técnica de slots_sql): só ilhas com mais de um turno
+SQL_ILHAS_TURNOS = """
+WITH marcados AS (
+    SELECT id, medico_id, dia_semana, hora_inicio, hora_fim,
+           CASE
+               WHEN hora_inicio < MAX(hora_fim) OVER (
+                   PARTITION BY medico_id, dia_semana ORDER BY hora_inicio, id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ) THEN 0
+               ELSE 1
+           END AS nova_ilha
+    FROM consultas_horariotrabalho
+),
+ilhas AS (
+    SELECT *,
+           SUM(nova_ilha) OVER (
+               PARTITION BY medico_id, dia_semana ORDER BY hora_inicio, id ROWS UNBOUNDED PRECEDING
+           ) AS ilha
+    FROM marcados
+)
+SELECT medico_id, dia_semana,
+       (ARRAY_AGG(id ORDER BY hora_inicio, id))[1] AS manter_id,
+       ARRAY_AGG(id ORDER BY hora_inicio, id) AS ids,
+       MIN(hora_inicio) AS hora_inicio,
+       MAX(hora_fim) AS hora_fim
+FROM ilhas
+GROUP BY medico_id, dia_semana, ilha
+HAVING COUNT(*) > 1
+ORDER BY medico_id, dia_semana, MIN(hora_inicio)
+"""
+
+SQL_TURNOS_SOBREPOSTOS = f"""
+SELECT medico_id, dia_semana, manter_id AS horario_id, ids, hora_inicio, hora_fim, COUNT(*) OVER () AS total
+FROM ({SQL_ILHAS_TURNOS}) ilhas
+ORDER BY medico_id, dia_semana, hora_inicio
+LIMIT %(limite)s
+"""
+
+SQL_SEM_FIM = """
+SELECT id AS consulta_id, medico_id, data_hora_inicio, status, COUNT(*) OVER () AS total
+FROM consultas_consulta
+WHERE data_hora_fim IS NULL
+ORDER BY medico_id, data_hora_inicio
+LIMIT %(limite)s
+"""
+
+VERIFICACOES = {
+    "consultas_sobrepostas": ("Consultas ativas do mesmo médico que se sobrepõem", SQL_CONSULTAS_SOBREPOSTAS),
+    "fora_do_expediente": ("Consultas ativas fora dos turnos e das disponibilidades extras", SQL_FORA_DO_EXPEDIENTE),
+    "em_bloqueio": ("Consultas ativas dentro de um bloqueio da agenda", SQL_EM_BLOQUEIO),
+    "turnos_sobrepostos": ("Turnos do mesmo médico e dia que se sobrepõem", SQL_TURNOS_SOBREPOSTOS),
+    "sem_fim": ("Consultas sem data_hora_fim", SQL_SEM_FIM),
+}
+
+# Verificações resolvidas por `corrigir_consistencia`
+CORRIGIVEIS = ("turnos_sobrepostos", "sem_fim")
+
+
+def _linhas(cursor):
+    colunas = [coluna.name for coluna in cursor.description]
+    return [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
+
+
+def verificar_consistencia(desde: Optional[date] = None, limite: int = 50) -> Dict[str, dict]:
+    """
+    Roda todas as verificações (uma query cada) e retorna {nome: {descricao, total, amostra}}.
+    `desde` limita as verificações de expediente e bloqueio às consultas a partir desse dia
+    (padrão: hoje), já que turnos e bloqueios do passado podem ter mudado depois das consultas.
+    """
+    desde = desde or timezone.localdate()
+    parametros = {
+        "ocupantes": list(STATUS_OCUPANTES),
+        "duracao": DURACAO_CONSULTA,
+        "tz": timezone.get_current_timezone_name(),
+        "desde": _make_aware(datetime.combine(desde, _time.min)),
+        "limite": limite,
+    }
+
+    relatorio = {}
+    with connection.cursor() as cursor:
+        for nome, (descricao, sql) in VERIFICACOES.items():
+            cursor.execute(sql, parametros)
+            amostra = _linhas(cursor)
+            total = amostra[0]["total"] if amostra else 0
+            for linha in amostra:
+                del linha["total"]
+            relatorio[nome] = {"descricao": descricao, "total": total, "amostra": amostra}
+    return relatorio
+
+
+def corrigir_consistencia() -> Dict[str, int]:
+    """
+    Corrige em lote, numa transação:
+    - consultas sem fim recebem data_hora_inicio + DURACAO_CONSULTA (um UPDATE)
+    - cada ilha de turnos sobrepostos vira um turno só: o primeiro é estendido até o maior fim e
+      os demais são removidos (um DELETE e um UPDATE)
+    Retorna {"consultas_com_fim", "turnos_removidos", "turnos_estendidos"}.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE consultas_consulta SET data_hora_fim = data_hora_inicio + %(duracao)s
+            WHERE data_hora_fim IS NULL
+            RETURNING medico_id, data_hora_inicio
+            """,
+            {"duracao": DURACAO_CONSULTA},
+        )
+        consultas = cursor.fetchall()
+
+        cursor.execute(SQL_ILHAS_TURNOS)
+        ilhas = _linhas(cursor)
+        removidos = [horario_id for ilha in ilhas for horario_id in ilha["ids"] if horario_id != ilha["manter_id"]]
+        # remove antes de estender: o turno estendido pode coincidir com um dos removidos
+        cursor.execute("DELETE FROM consultas_horariotrabalho WHERE id = ANY(%s)", [removidos])
+        cursor.execute(
+            """
+            UPDATE consultas_horariotrabalho h SET hora_fim = novo.hora_fim
+            FROM unnest(%s::bigint[], %s::time[]) AS novo(id, hora_fim)
+            WHERE h.id = novo.id
+            """,
+            [[ilha["manter_id"] for ilha in ilhas], [ilha["hora_fim"] for ilha in ilhas]],
+        )
+
+        # SQL direto não dispara os signals: cache e slots materializados são atualizados aqui
+        hoje = timezone.localdate()
+        dias_por_medico = {}
+        for medico_id, inicio in consultas:
+            dia = timezone.localtime(inicio).date()
+            primeiro, ultimo = dias_por_medico.get(medico_id, (dia, dia))
+            dias_por_medico[medico_id] = (min(primeiro, dia), max(ultimo, dia))
+        for ilha in ilhas:
+            dias_por_medico[ilha["medico_id"]] = (hoje, hoje + timedelta(days=SLOTS_JANELA_DIAS))
+
+        for medico_id, (primeiro, ultimo) in dias_por_medico.items():
+            invalidar_agenda(medico_id)
+            transaction.on_commit(partial(recalcular_slots, medico_id, primeiro, ultimo))
+
+    return {
+        "consultas_com_fim": len(consultas),
+        "turnos_removidos": len(removidos),
+        "turnos_estendidos": len(ilhas),
+    }
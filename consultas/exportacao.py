@@ -0,0 +1,82 @@
+# exportacao.py
+"""
+Exportação das consultas em CSV, em streaming.
+
+As linhas saem de um cursor do lado do servidor (`iterator(chunk_size=...)`) sobre uma
+projeção `values_list()`: nenhum objeto Consulta é montado e só um lote fica em memória por
+vez, então o download começa na hora e um milhão de linhas custa o mesmo que mil. O
+StreamingHttpResponse consome o gerador conforme o cliente lê.
+
+O CSV usa ";" e BOM UTF-8, como o Excel em português espera (vírgula é separador decimal e,
+sem o BOM, os acentos viram lixo).
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import STATUS_CONSULTA
+
+EXPORTACAO_LOTE = 2000
+
+# (cabeçalho, campo da projeção)
+COLUNAS = [
+    ("ID", "pk"),
+    ("Início", "data_hora_inicio"),
+    ("Fim", "data_hora_fim"),
+    ("Status", "status"),
+    ("Retorno", "retorno"),
+    ("Paciente", "paciente__usuario__nome_completo"),
+    ("CPF do Paciente", "paciente__usuario__cpf"),
+    ("Médico", "medico__usuario__nome_completo"),
+    ("Especialidade", "medico__especialidade__nome"),
+]
+
+_STATUS = dict(STATUS_CONSULTA)
+
+INICIO_DE_FORMULA = ("=", "+", "-", "@", "\t", "\r")
+
+
+class _Eco:
+    """Buffer do csv.writer que devolve a linha escrita em vez de guardá-la."""
+
+    def write(self, valor):
+        return valor
+
+
+def _data_hora(valor):
+    return timezone.localtime(valor).strftime("%d/%m/%Y %H:%M") if valor else ""
+
+
+def _texto(valor):
+    # texto digitado por usuários (nomes): o Excel interpretaria "=...", "+...", "-..." e "@..." como fórmula
+    if isinstance(valor, str) and valor.startswith(INICIO_DE_FORMULA):
+        return "'" + valor
+    return "" if valor is None else valor
+
+
+def _formatar(linha):
+    pk, inicio, fim, status, retorno, *resto = linha
+    return [
+        pk,
+        _data_hora(inicio),
+        _data_hora(fim),
+        _STATUS.get(status, status),
+        "Sim" if retorno else "Não",
+        *[_texto(valor) for valor in resto],
+    ]
+
+
+def linhas_csv(queryset, lote: int = EXPORTACAO_LOTE):
+    """Gera o CSV linha a linha (cabeçalho primeiro), em ordem (data_hora_inicio, id) decrescente."""
+    escritor = csv.writer(_Eco(), delimiter=";")
+    yield "\ufeff" + escritor.writerow([cabecalho for cabecalho, _ in COLUNAS])
+    linhas = queryset.order_by("-data_hora_inicio", "-pk").values_list(*[campo for _, campo in COLUNAS])
+    for linha in linhas.iterator(chunk_size=lote):
+        yield escritor.writerow(_formatar(linha))
+
+
+def exportar_consultas_csv(queryset, nome_arquivo: str = "consultas.csv") -> StreamingHttpResponse:
+    resposta = StreamingHttpResponse(linhas_csv(queryset), content_type="text/csv; charset=utf-8")
+    resposta["Content-Disposition"] = f'attachment; filename="{nome_arquivo}"'
+    return resposta
@@ -1,6 +1,8 @@
+import uuid
+
 from django import forms
-from .models import Consulta, HorarioTrabalho, ExcecaoHorario
-from core.models import Medico, Paciente
+from .models import STATUS_CONSULTA, Consulta, HorarioTrabalho, ExcecaoHorario
+from core.models import Especialidade, Medico, Paciente
 from .utils import checar_conflito_consulta
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
@@ -93,6 +95,9 @@ class ExcecaoHorarioForm(forms.ModelForm):
         return cleaned_data
 
 class ConsultaForm(forms.ModelForm):
+    # identifica o envio: reenvios do mesmo formulário não criam outra consulta
+    chave_idempotencia = forms.UUIDField(required=False, widget=forms.HiddenInput())
+
     class Meta:
         model = Consulta
         fields = [
@@ -107,7 +112,8 @@ class ConsultaForm(forms.ModelForm):
 
         widgets = {
             "medico": forms.HiddenInput(),
-            "paciente": forms.Select(attrs={"class": "form-control"}),
+            # escolhido pela busca de pacientes (api_pacientes_autocomplete); só o id é enviado
+            "paciente": forms.HiddenInput(),
             "data_hora_inicio": forms.HiddenInput(),
             "data_hora_fim": forms.HiddenInput(),
             "sintomas": forms.Textarea(attrs={"rows": 3, "class": "form-control"}),
@@ -116,7 +122,10 @@ class ConsultaForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields["paciente"].queryset = Paciente.objects.all().order_by("usuario__nome_completo")
+        # nenhuma lista é renderizada: a validação só busca o id enviado
+        self.fields["paciente"].queryset = Paciente.objects.all()
+        if not self.is_bound:
+            self.initial.setdefault('chave_idempotencia', uuid.uuid4())
         if not self.instance.pk:
             self.initial.setdefault('status', 'agendada')
             self.fields['status'].widget = forms.HiddenInput(attrs={"value": "agendada"})
@@ -169,7 +178,10 @@ class ConsultaForm(forms.ModelForm):
                 raise forms.ValidationError("Não é possível agendar consultas no passado.")
 
             consulta_id = getattr(self.instance, 'pk', None)
-            if inicio and fim and checar_conflito_consulta(medico_id=medico.pk, inicio=inicio, fim=fim, consulta_id=consulta_id):
+            chave_reserva = cleaned.get('chave_idempotencia')
+            if inicio and fim and checar_conflito_consulta(
+                medico_id=medico.pk, inicio=inicio, fim=fim, consulta_id=consulta_id, chave_reserva=chave_reserva
+            ):
                 raise forms.ValidationError("O horário selecionado está indisponível ou em conflito com outro agendamento/bloqueio.")
         else:
             raise forms.ValidationError("Médico não foi selecionado. Reinicie o agendamento a partir da lista de médicos.")
@@ -197,9 +209,118 @@ class ConsultaEdicaoForm(forms.ModelForm):
         status = cleaned.get("status")
         diagnostico = cleaned.get("diagnostico")
 
+        if status and self.instance.pk and not self.instance.pode_mudar_para(status):
+            self.add_error(
+                "status",
+                f"Uma consulta {self.instance.get_status_display().lower()} não pode passar para este status.",
+            )
+
         # Exemplo de regra: não permitir concluir sem diagnóstico
         if status == "concluida" and not diagnostico:
             self.add_error("diagnostico", "Para concluir a consulta, escreva o diagnóstico.")
         
         return cleaned
 
+
+class ConsultaSerieForm(forms.Form):
+    FREQUENCIA_CHOICES = [
+        ("semanal", "Semanal"),
+        ("dias", "A cada N dias"),
+    ]
+    MAX_OCORRENCIAS = 52
+
+    paciente = forms.ModelChoiceField(
+        queryset=Paciente.objects.all(),
+        widget=forms.HiddenInput(),
+    )
+    data_hora_inicio = forms.DateTimeField(widget=forms.HiddenInput())
+    frequencia = forms.ChoiceField(
+        choices=FREQUENCIA_CHOICES,
+        initial="semanal",
+        label="Frequência",
+        widget=forms.Select(attrs={"class": "form-control"}),
+    )
+    intervalo_dias = forms.IntegerField(
+        min_value=1,
+        max_value=365,
+        required=False,
+        label="Intervalo (dias)",
+        widget=forms.NumberInput(attrs={"class": "form-control"}),
+    )
+    ocorrencias = forms.IntegerField(
+        min_value=2,
+        max_value=MAX_OCORRENCIAS,
+        initial=4,
+        label="Número de sessões",
+        widget=forms.NumberInput(attrs={"class": "form-control"}),
+    )
+    retorno = forms.BooleanField(required=False, initial=True)
+    sintomas = forms.CharField(required=False, widget=forms.Textarea(attrs={"rows": 3, "class": "form-control"}))
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get("frequencia") == "semanal":
+            cleaned["intervalo_dias"] = 7
+        elif not cleaned.get("intervalo_dias"):
+            self.add_error("intervalo_dias", "Informe de quantos em quantos dias as sessões se repetem.")
+
+        inicio = cleaned.get("data_hora_inicio")
+        if inicio and inicio < timezone.now():
+            raise forms.ValidationError("A primeira sessão não pode ser no passado.")
+        return cleaned
+
+
+class ConsultaFilterForm(forms.Form):
+    """Filtros da listagem de consultas, usados também na exportação (mesma query string)."""
+
+    medico = forms.IntegerField(required=False, widget=forms.HiddenInput())
+    data_inicio = forms.DateField(
+        required=False,
+        label="De",
+        widget=forms.DateInput(attrs={"type": "date", "class": "form-control"}),
+    )
+    data_fim = forms.DateField(
+        required=False,
+        label="Até",
+        widget=forms.DateInput(attrs={"type": "date", "class": "form-control"}),
+    )
+    status = forms.ChoiceField(
+        choices=[("", "Todos os Status")] + STATUS_CONSULTA,
+        required=False,
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+    especialidade = forms.ModelChoiceField(
+        queryset=Especialidade.objects.all().order_by("nome"),
+        required=False,
+        empty_label="Todas as Especialidades",
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+
+    def clean(self):
+        cleaned = super().clean()
+        inicio, fim = cleaned.get("data_inicio"), cleaned.get("data_fim")
+        if inicio and fim and fim < inicio:
+            self.add_error("data_fim", "A data final deve ser igual ou posterior à inicial.")
+        return cleaned
+
+    def filtrar(self, queryset):
+        """Aplica os filtros preenchidos. Deve ser chamado com o formulário já validado."""
+        dados = self.cleaned_data
+        if dados.get("medico"):
+            queryset = queryset.filter(medico__pk=dados["medico"])
+        # intervalo de datas [data_inicio 00:00, data_fim + 1 dia 00:00) no fuso local: usa o índice de início
+        if dados.get("data_inicio"):
+            queryset = queryset.filter(
+                data_hora_inicio__gte=timezone.make_aware(datetime.combine(dados["data_inicio"], datetime.min.time()))
+            )
+        if dados.get("data_fim"):
+            queryset = queryset.filter(
+                data_hora_inicio__lt=timezone.make_aware(
+                    datetime.combine(dados["data_fim"] + timedelta(days=1), datetime.min.time())
+                )
+            )
+        if dados.get("status"):
+            queryset = queryset.filter(status=dados["status"])
+        if dados.get("especialidade"):
+            queryset = queryset.filter(medico__especialidade=dados["especialidade"])
+        return queryset
@@ -0,0 +1,60 @@
+# impacto.py
+"""
+Impacto de uma alteração de HorarioTrabalho nas consultas futuras.
+
+Antes de salvar a edição (ou a exclusão) de um turno, `consultas_orfas` lista as consultas
+ativas que hoje cabem naquele turno e deixariam de caber no expediente do médico. É uma única
+query: o dia da semana e as horas locais de cada consulta são calculados no banco e comparados
+com o turno atual, o turno proposto, os demais turnos do médico e as disponibilidades extras.
+"""
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import ExtractWeekDay, TruncTime
+from django.utils import timezone
+
+from .models import STATUS_OCUPANTES, Consulta, ExcecaoHorario, HorarioTrabalho
+
+
+def _cabe_no_turno(dia_semana, hora_inicio, hora_fim) -> Q:
+    return Q(dia_semana=dia_semana, hora_ini__gte=hora_inicio, hora_fim__lte=hora_fim)
+
+
+def consultas_orfas(horario_atual: HorarioTrabalho, horario_proposto: HorarioTrabalho = None):
+    """
+    Consultas futuras ativas que cabem em `horario_atual` (como está salvo) e ficariam fora do
+    expediente se ele fosse substituído por `horario_proposto` (ainda não salvo) ou removido (None).
+    Consultas cobertas por outro turno do médico ou por uma disponibilidade extra não contam.
+    """
+    outros_turnos = HorarioTrabalho.objects.filter(
+        medico_id=OuterRef("medico_id"),
+        dia_semana=OuterRef("dia_semana"),
+        hora_inicio__lte=OuterRef("hora_ini"),
+        hora_fim__gte=OuterRef("hora_fim"),
+    ).exclude(pk=horario_atual.pk)
+    extras = ExcecaoHorario.objects.filter(
+        medico_id=OuterRef("medico_id"),
+        esta_bloqueado=False,
+        data_inicio__lte=OuterRef("data_hora_inicio"),
+        data_fim__gte=OuterRef("data_hora_fim"),
+    )
+
+    orfas = (
+        Consulta.objects.filter(
+            medico_id=horario_atual.medico_id,
+            status__in=STATUS_OCUPANTES,
+            data_hora_inicio__gte=timezone.now(),
+        )
+        # no fuso corrente; __week_day do Django: 1=Domingo ... 7=Sábado
+        .annotate(
+            dia_semana=ExtractWeekDay("data_hora_inicio") - 1,
+            hora_ini=TruncTime("data_hora_inicio"),
+            hora_fim=TruncTime("data_hora_fim"),
+        )
+        .filter(_cabe_no_turno(horario_atual.dia_semana, horario_atual.hora_inicio, horario_atual.hora_fim))
+        .exclude(Exists(outros_turnos))
+        .exclude(Exists(extras))
+    )
+    if horario_proposto is not None and horario_proposto.medico_id == horario_atual.medico_id:
+        orfas = orfas.exclude(
+            _cabe_no_turno(horario_proposto.dia_semana, horario_proposto.hora_inicio, horario_proposto.hora_fim)
+        )
+    return orfas.select_related("paciente__usuario").order_by("data_hora_inicio")
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from consultas.benchmark import MAX_TURNOS_POR_DIA, executar_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede calcular_slots_disponiveis, checar_conflito_consulta e gerar_horarios_disponiveis com agendas "
+        "sintéticas (percentis de latência e queries por horizonte). Os dados gerados são descartados ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--medicos", type=int, default=20, help="Médicos sintéticos (padrão: 20).")
+        parser.add_argument(
+            "--turnos", type=int, default=2, help=f"Turnos por dia de expediente, 1 a {MAX_TURNOS_POR_DIA} (padrão: 2)."
+        )
+        parser.add_argument("--dias-trabalho", type=int, default=5, help="Dias de expediente por semana (padrão: 5).")
+        parser.add_argument("--excecoes", type=int, default=10, help="Exceções por médico no horizonte (padrão: 10).")
+        parser.add_argument(
+            "--consultas-por-dia",
+            type=int,
+            default=4,
+            help="Consultas por médico em cada dia de expediente (padrão: 4).",
+        )
+        parser.add_argument(
+            "--horizontes", type=int, nargs="+", default=[7, 30, 90], help="Horizontes em dias (padrão: 7 30 90)."
+        )
+        parser.add_argument("--repeticoes", type=int, default=20, help="Chamadas por função e horizonte (padrão: 20).")
+        parser.add_argument("--semente", type=int, default=42, help="Semente dos dados sintéticos (padrão: 42).")
+        parser.add_argument("--saida", help="Arquivo JSON de saída. Sem ele, o JSON é escrito na saída padrão.")
+
+    def handle(self, *args, **options):
+        if not 1 <= options["turnos"] <= MAX_TURNOS_POR_DIA:
+            raise CommandError(f"--turnos deve estar entre 1 e {MAX_TURNOS_POR_DIA}.")
+        resultado = executar_benchmark(
+            horizontes=options["horizontes"],
+            repeticoes=options["repeticoes"],
+            semente=options["semente"],
+            medicos=options["medicos"],
+            turnos_por_dia=options["turnos"],
+            dias_trabalho=options["dias_trabalho"],
+            excecoes=options["excecoes"],
+            consultas_por_dia=options["consultas_por_dia"],
+        )
+        conteudo = json.dumps(resultado, indent=2, ensure_ascii=False)
+
+        if not options["saida"]:
+            self.stdout.write(conteudo)
+            return
+
+        with open(options["saida"], "w", encoding="utf-8") as arquivo:
+            arquivo.write(conteudo)
+        for linha in resultado["resultados"]:
+            self.stdout.write(
+                f"{linha['funcao']:<28} {linha['horizonte_dias']:>4}d  "
+                f"p50={linha['p50_ms']:.2f}ms p95={linha['p95_ms']:.2f}ms queries={linha['queries_media']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Resultados gravados em {options['saida']}."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from consultas.materializacao import SLOTS_JANELA_DIAS, estender_janela
+
+
+class Command(BaseCommand):
+    help = "Remove slots materializados de dias passados e estende a janela de SlotDisponivel (rodar toda noite)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dias",
+            type=int,
+            default=SLOTS_JANELA_DIAS,
+            help=f"Tamanho da janela em dias a partir de hoje (padrão: {SLOTS_JANELA_DIAS}).",
+        )
+
+    def handle(self, *args, **options):
+        resultado = estender_janela(dias=options["dias"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{resultado['criados']} slots criados, {resultado['removidos']} removidos; "
+                f"janela materializada até {resultado['materializado_ate']:%d/%m/%Y}."
+            )
+        )
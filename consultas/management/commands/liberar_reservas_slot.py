@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from consultas.reservas import liberar_reservas_expiradas
+
+
+class Command(BaseCommand):
+    help = "Apaga as reservas temporárias de slot vencidas (rodar a cada minuto, ex.: via cron)."
+
+    def handle(self, *args, **options):
+        removidas = liberar_reservas_expiradas()
+        self.stdout.write(self.style.SUCCESS(f"{removidas} reservas vencidas removidas."))
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date
+
+from consultas.consistencia import CORRIGIVEIS, corrigir_consistencia, verificar_consistencia
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica a consistência das agendas no banco (consultas sobrepostas, fora do expediente ou em bloqueio, "
+        "turnos sobrepostos e consultas sem fim). Com --corrigir, resolve em lote os problemas de correção óbvia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--desde",
+            help="Data (AAAA-MM-DD) a partir da qual conferir expediente e bloqueios (padrão: hoje).",
+        )
+        parser.add_argument("--limite", type=int, default=50, help="Linhas de exemplo por verificação (padrão: 50).")
+        parser.add_argument(
+            "--corrigir",
+            action="store_true",
+            help=f"Corrige em lote: {', '.join(CORRIGIVEIS)}. As demais verificações só entram no relatório.",
+        )
+        parser.add_argument("--saida", help="Arquivo JSON com o relatório completo.")
+
+    def handle(self, *args, **options):
+        desde = None
+        if options["desde"]:
+            desde = parse_date(options["desde"])
+            if desde is None:
+                raise CommandError("--desde deve estar no formato AAAA-MM-DD.")
+
+        relatorio = verificar_consistencia(desde=desde, limite=options["limite"])
+        for nome, item in relatorio.items():
+            estilo = self.style.WARNING if item["total"] else self.style.SUCCESS
+            self.stdout.write(estilo(f"{nome:<24} {item['total']:>8}  {item['descricao']}"))
+
+        if options["saida"]:
+            with open(options["saida"], "w", encoding="utf-8") as arquivo:
+                json.dump(relatorio, arquivo, indent=2, ensure_ascii=False, cls=DjangoJSONEncoder)
+            self.stdout.write(f"Relatório gravado em {options['saida']}.")
+
+        if options["corrigir"]:
+            corrigidos = corrigir_consistencia()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{corrigidos['consultas_com_fim']} consultas receberam fim; "
+                    f"{corrigidos['turnos_estendidos']} turnos estendidos e {corrigidos['turnos_removidos']} removidos."
+                )
+            )
@@ -0,0 +1,205 @@
+# materializacao.py
+"""
+Tabela materializada de slots livres (SlotDisponivel).
+
+Cada médico tem seus slots pré-calculados de hoje até `MaterializacaoSlots.materializado_ate`.
+Alterações de Consulta, HorarioTrabalho, ExcecaoHorario e FeriadoClinica recalculam apenas os dias afetados
+(ver `consultas.signals`), e o comando `estender_janela_slots` remove os dias passados e
+estende a janela toda noite.
+
+Como isso roda no commit da própria requisição, o caso mais comum é o mais barato: uma consulta
+que passa a ocupar a agenda só apaga os slots que ela cobre (`ocupar_slots`, um DELETE), sem
+recalcular o dia; só o horário liberado (cancelamento, remarcação) é recalculado. Um feriado
+recalcula os mesmos dias de todos os médicos num lote, com número fixo de queries.
+"""
+from datetime import date, datetime, timedelta, time as _time
+from typing import Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Medico
+from .models import Consulta, ExcecaoHorario, FeriadoClinica, HorarioTrabalho, MaterializacaoSlots, SlotDisponivel
+from .utils import DURACAO_CONSULTA, _day_to_model_day, _make_aware, carregar_agendas, iterar_slots
+
+# Quantos dias à frente ficam materializados
+SLOTS_JANELA_DIAS = getattr(settings, "SLOTS_JANELA_DIAS", 60)
+
+
+def _inicio_do_dia(dia: date) -> datetime:
+    return _make_aware(datetime.combine(dia, _time.min))
+
+
+def _materializar(medico_ids, data_inicio: date, data_fim: date, dias_semana: Iterable[int] = None) -> int:
+    """
+    Substitui os slots dos médicos entre `data_inicio` e `data_fim` (inclusive), com as mesmas
+    queries para um ou vários médicos. Deve rodar em transação.
+    """
+    if isinstance(medico_ids, int):
+        medico_ids = [medico_ids]
+    inicio = _inicio_do_dia(data_inicio)
+    fim = _inicio_do_dia(data_fim + timedelta(days=1))
+    # reservas temporárias ficam de fora: a tabela não é recalculada quando elas vencem
+    agendas = carregar_agendas(medico_ids, inicio, fim, com_reservas=False)
+    agora = timezone.localtime(timezone.now())
+
+    novos = [
+        SlotDisponivel(medico_id=medico_id, data_hora_inicio=slot, data_hora_fim=slot + DURACAO_CONSULTA)
+        for medico_id, agenda in agendas.items()
+        for dia, slots in iterar_slots(agenda, data_inicio, (data_fim - data_inicio).days + 1, agora)
+        if dias_semana is None or _day_to_model_day(dia) in dias_semana
+        for slot in slots
+    ]
+
+    antigos = SlotDisponivel.objects.filter(
+        medico_id__in=list(agendas),
+        data_hora_inicio__gte=inicio,
+        data_hora_inicio__lt=fim,
+    )
+    if dias_semana is not None:
+        # __week_day do Django: 1=Domingo ... 7=Sábado
+        antigos = antigos.filter(data_hora_inicio__week_day__in=[d + 1 for d in dias_semana])
+    antigos.delete()
+    SlotDisponivel.objects.bulk_create(novos)
+    return len(novos)
+
+
+def recalcular_slots(medico_id: int, data_inicio: date, data_fim: date, dias_semana: Iterable[int] = None) -> int:
+    """
+    Recalcula os slots já materializados do médico no intervalo de dias informado.
+    Dias fora da janela materializada são ignorados (a extensão noturna cuida deles).
+    """
+    hoje = timezone.localdate()
+    with transaction.atomic():
+        # trava por médico: recálculos concorrentes da mesma agenda não se sobrepõem
+        controle = MaterializacaoSlots.objects.select_for_update().filter(medico_id=medico_id).first()
+        if controle is None:
+            return 0
+        data_inicio = max(data_inicio, hoje)
+        data_fim = min(data_fim, controle.materializado_ate)
+        if data_inicio > data_fim:
+            return 0
+        return _materializar(medico_id, data_inicio, data_fim, dias_semana)
+
+
+def recalcular_slots_todos(data_inicio: date, data_fim: date) -> int:
+    """Recalcula os mesmos dias de todos os médicos materializados, em lotes por fim de janela."""
+    hoje = timezone.localdate()
+    data_inicio = max(data_inicio, hoje)
+    criados = 0
+    with transaction.atomic():
+        # mesma trava de `recalcular_slots`, na ordem dos ids (sem deadlock entre recálculos em lote)
+        controles = MaterializacaoSlots.objects.select_for_update().order_by("medico_id")
+        por_fim = {}
+        for medico_id, materializado_ate in controles.values_list("medico_id", "materializado_ate"):
+            por_fim.setdefault(min(data_fim, materializado_ate), []).append(medico_id)
+        # depois da extensão noturna todos os médicos têm a mesma janela: um lote só
+        for fim, medico_ids in por_fim.items():
+            if data_inicio <= fim:
+                criados += _materializar(medico_ids, data_inicio, fim)
+    return criados
+
+
+def _intervalo(consulta):
+    return consulta.data_hora_inicio, consulta.data_hora_fim or consulta.data_hora_inicio + DURACAO_CONSULTA
+
+
+def ocupar_slots(medico_id: int, intervalos) -> int:
+    """
+    Remove os slots materializados do médico que cruzam os intervalos [inicio, fim) recém-ocupados.
+    Consultas novas só tiram slots da tabela: um DELETE em vez de recalcular os dias.
+    """
+    filtro = Q()
+    for inicio, fim in intervalos:
+        # os slots têm duração fixa: a faixa de início limita a busca no índice (médico, início)
+        filtro |= Q(data_hora_inicio__gt=inicio - DURACAO_CONSULTA, data_hora_inicio__lt=fim, data_hora_fim__gt=inicio)
+    if not filtro:
+        return 0
+    with transaction.atomic():
+        # serializa com recálculos do mesmo médico que tenham lido a agenda antes desta consulta
+        if not MaterializacaoSlots.objects.select_for_update().filter(medico_id=medico_id).exists():
+            return 0
+        removidos, _ = SlotDisponivel.objects.filter(filtro, medico_id=medico_id).delete()
+    return removidos
+
+
+def _atualizar_por_consulta(consulta, anterior, removida: bool) -> None:
+    ocupa = not removida and consulta.ocupa_agenda
+    ocupava = anterior.ocupa_agenda if anterior is not None else removida and consulta.ocupa_agenda
+    antes = (anterior.medico_id, *_intervalo(anterior)) if anterior is not None else None
+    agora = (consulta.medico_id, *_intervalo(consulta))
+    if ocupa and ocupava and antes == agora:
+        return  # edição que não mexe na agenda (sintomas, diagnóstico, confirmada...)
+
+    if ocupa:
+        ocupar_slots(consulta.medico_id, [_intervalo(consulta)])
+    if ocupava:
+        # horário liberado: só os dias dele são recalculados
+        liberada = anterior if anterior is not None else consulta
+        inicio, fim = _intervalo(liberada)
+        recalcular_slots(liberada.medico_id, timezone.localtime(inicio).date(), timezone.localtime(fim).date())
+
+
+def atualizar_por_alteracao(registro, anterior=None, removido: bool = False) -> None:
+    """
+    Atualiza os slots materializados após a alteração de uma Consulta, Horário, Exceção ou Feriado.
+    `anterior` é a versão salva antes da alteração (None na criação); `removido` indica exclusão.
+    """
+    if isinstance(registro, Consulta):
+        _atualizar_por_consulta(registro, anterior, removido)
+        return
+
+    hoje = timezone.localdate()
+    for versao in (registro, anterior):
+        if versao is None:
+            continue
+        if isinstance(versao, HorarioTrabalho):
+            recalcular_slots(
+                versao.medico_id, hoje, hoje + timedelta(days=SLOTS_JANELA_DIAS), dias_semana={versao.dia_semana}
+            )
+        elif isinstance(versao, ExcecaoHorario):
+            recalcular_slots(
+                versao.medico_id,
+                timezone.localtime(versao.data_inicio).date(),
+                timezone.localtime(versao.data_fim).date(),
+            )
+        elif isinstance(versao, FeriadoClinica):
+            # fechamento da clínica: os mesmos dias de todos os médicos, num lote
+            recalcular_slots_todos(
+                timezone.localtime(versao.data_inicio).date(),
+                timezone.localtime(versao.data_fim).date(),
+            )
+
+
+def estender_janela(dias: int = SLOTS_JANELA_DIAS) -> dict:
+    """Remove slots de dias passados e materializa, para cada médico, os dias que faltam até hoje + `dias`."""
+    hoje = timezone.localdate()
+    ultimo_dia = hoje + timedelta(days=dias - 1)
+
+    removidos, _ = SlotDisponivel.objects.filter(data_hora_inicio__lt=_inicio_do_dia(hoje)).delete()
+
+    criados = 0
+    for medico_id in Medico.objects.order_by("pk").values_list("pk", flat=True):
+        with transaction.atomic():
+            controle, _ = MaterializacaoSlots.objects.select_for_update().get_or_create(
+                medico_id=medico_id,
+                defaults={"materializado_ate": hoje - timedelta(days=1)},
+            )
+            data_inicio = max(hoje, controle.materializado_ate + timedelta(days=1))
+            if data_inicio > ultimo_dia:
+                continue
+            criados += _materializar(medico_id, data_inicio, ultimo_dia)
+            controle.materializado_ate = ultimo_dia
+            controle.save(update_fields=["materializado_ate"])
+
+    return {"removidos": removidos, "criados": criados, "materializado_ate": ultimo_dia}
+
+
+def medicos_livres(inicio: datetime, especialidade_id: int = None):
+    """Médicos com slot livre começando em `inicio` (ex.: "quem está livre terça 10:00 em Cardiologia")."""
+    medicos = Medico.objects.filter(slots_disponiveis__data_hora_inicio=inicio)
+    if especialidade_id is not None:
+        medicos = medicos.filter(especialidade_id=especialidade_id)
+    return medicos.select_related("usuario", "especialidade").order_by("usuario__nome_completo")
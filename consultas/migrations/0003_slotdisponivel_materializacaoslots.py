@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0002_alter_consulta_options_and_more'),
+        ('core', '0006_usuario_foto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializacaoSlots',
+            fields=[
+                ('medico', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='materializacao_slots', serialize=False, to='core.medico', verbose_name='Médico')),
+                ('materializado_ate', models.DateField(verbose_name='Materializado até')),
+            ],
+            options={
+                'verbose_name': 'Materialização de Slots',
+                'verbose_name_plural': 'Materializações de Slots',
+            },
+        ),
+        migrations.CreateModel(
+            name='SlotDisponivel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_hora_inicio', models.DateTimeField(verbose_name='Início do Slot')),
+                ('data_hora_fim', models.DateTimeField(verbose_name='Fim do Slot')),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots_disponiveis', to='core.medico', verbose_name='Médico')),
+            ],
+            options={
+                'verbose_name': 'Slot Disponível',
+                'verbose_name_plural': 'Slots Disponíveis',
+                'ordering': ['data_hora_inicio'],
+                'indexes': [models.Index(fields=['data_hora_inicio', 'medico'], name='slot_inicio_medico_idx')],
+                'unique_together': {('medico', 'data_hora_inicio')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:52
+
+from datetime import timedelta
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations, models
+
+
+def preencher_fim(apps, schema_editor):
+    """Consultas sem data_hora_fim passam a ocupar um slot (30 min), como o motor de slots já assumia."""
+    Consulta = apps.get_model("consultas", "Consulta")
+    Consulta.objects.filter(data_hora_fim__isnull=True).update(
+        data_hora_fim=models.F("data_hora_inicio") + timedelta(minutes=30)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0003_slotdisponivel_materializacaoslots'),
+        ('core', '0006_usuario_foto'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.RunPython(preencher_fim, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='consulta',
+            name='periodo',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.F('data_hora_inicio'), models.F('data_hora_fim'), function='tstzrange'), output_field=django.contrib.postgres.fields.ranges.DateTimeRangeField()),
+        ),
+        migrations.AddConstraint(
+            model_name='consulta',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('status__in', ['agendada', 'confirmada'])), expressions=[('medico', '='), ('periodo', '&&')], name='consulta_sem_sobreposicao', violation_error_message='O médico já tem uma consulta nesse horário.'),
+        ),
+    ]
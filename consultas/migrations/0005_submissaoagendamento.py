@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0004_consulta_periodo_sem_sobreposicao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissaoAgendamento',
+            fields=[
+                ('chave', models.UUIDField(primary_key=True, serialize=False, verbose_name='Chave de Idempotência')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('consulta', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='submissao', to='consultas.consulta', verbose_name='Consulta')),
+            ],
+            options={
+                'verbose_name': 'Submissão de Agendamento',
+                'verbose_name_plural': 'Submissões de Agendamento',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0005_submissaoagendamento'),
+        ('core', '0006_usuario_foto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['medico', 'status', 'data_hora_inicio', 'data_hora_fim'], name='consulta_medico_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['-data_hora_inicio'], name='consulta_inicio_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['paciente', 'data_hora_inicio'], name='consulta_paciente_inicio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='excecaohorario',
+            index=models.Index(fields=['medico', 'esta_bloqueado', 'data_inicio', 'data_fim'], name='excecao_medico_bloqueio_idx'),
+        ),
+    ]
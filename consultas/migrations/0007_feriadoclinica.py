@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0006_indices_agenda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeriadoClinica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('descricao', models.CharField(max_length=150, verbose_name='Descrição')),
+                ('data_inicio', models.DateTimeField(verbose_name='Início do Fechamento')),
+                ('data_fim', models.DateTimeField(verbose_name='Fim do Fechamento')),
+            ],
+            options={
+                'verbose_name': 'Feriado/Fechamento da Clínica',
+                'verbose_name_plural': 'Feriados/Fechamentos da Clínica',
+                'ordering': ['data_inicio'],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0007_feriadoclinica'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='consulta',
+            name='consulta_medico_status_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='consulta',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='consulta',
+            name='status',
+            field=models.CharField(choices=[('agendada', 'Agendada'), ('confirmada', 'Confirmada'), ('concluida', 'Concluída'), ('cancelada', 'Cancelada'), ('nao_compareceu', 'Não compareceu')], default='agendada', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(condition=models.Q(('status__in', ['agendada', 'confirmada'])), fields=['medico', 'data_hora_inicio', 'data_hora_fim'], name='consulta_ativa_medico_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='consulta',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['agendada', 'confirmada'])), fields=('medico', 'data_hora_inicio'), name='consulta_ativa_medico_inicio_uniq', violation_error_message='O médico já tem uma consulta nesse horário.'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0008_ciclo_status_consulta'),
+        ('core', '0007_usuario_nome_completo_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaSlot',
+            fields=[
+                ('chave', models.UUIDField(primary_key=True, serialize=False, verbose_name='Chave do Formulário')),
+                ('data_hora_inicio', models.DateTimeField(verbose_name='Início do Slot')),
+                ('data_hora_fim', models.DateTimeField(verbose_name='Fim do Slot')),
+                ('expira_em', models.DateTimeField(verbose_name='Expira em')),
+                ('criado_em', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('medico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_slot', to='core.medico', verbose_name='Médico')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Slot',
+                'verbose_name_plural': 'Reservas de Slot',
+                'indexes': [models.Index(fields=['medico', 'data_hora_inicio', 'data_hora_fim'], name='reserva_medico_inicio_idx'), models.Index(fields=['expira_em'], name='reserva_expira_idx')],
+            },
+        ),
+    ]
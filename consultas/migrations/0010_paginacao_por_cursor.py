@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consultas', '0009_reservaslot'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='consulta',
+            name='consulta_inicio_desc_idx',
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['-data_hora_inicio', '-id'], name='consulta_inicio_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['medico', '-data_hora_inicio', '-id'], name='consulta_medico_desc_idx'),
+        ),
+    ]
@@ -1,6 +1,28 @@
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
 from django.db import models
 from core.models import Medico, Paciente
 
+STATUS_CONSULTA = [
+    ('agendada', 'Agendada'),
+    ('confirmada', 'Confirmada'),
+    ('concluida', 'Concluída'),
+    ('cancelada', 'Cancelada'),
+    ('nao_compareceu', 'Não compareceu'),
+]
+
+# Status de consulta que ocupam a agenda do médico
+STATUS_OCUPANTES = ['agendada', 'confirmada']
+
+# Ciclo de vida: para quais status cada status pode mudar (concluída, cancelada e falta são finais)
+TRANSICOES_STATUS = {
+    'agendada': {'confirmada', 'concluida', 'cancelada', 'nao_compareceu'},
+    'confirmada': {'concluida', 'cancelada', 'nao_compareceu'},
+    'concluida': set(),
+    'cancelada': set(),
+    'nao_compareceu': set(),
+}
+
 class HorarioTrabalho(models.Model):
     DIAS_SEMANA = [
         (0, "Domingo"),
@@ -23,6 +45,7 @@ class HorarioTrabalho(models.Model):
     hora_fim = models.TimeField(verbose_name="Hora de Fim")
 
     class Meta:
+        # o índice da unique_together também atende as buscas por (medico, dia_semana)
         unique_together = ("medico", "dia_semana", "hora_inicio", "hora_fim")
         verbose_name = "Horário de Trabalho Recorrente"
         verbose_name_plural = "Horários de Trabalho Recorrentes"
@@ -59,17 +82,53 @@ class Consulta(models.Model):
     receita_virtual = models.FileField(upload_to="receitas/", blank=True, null=True)
     status = models.CharField(
         max_length=20,
-        choices=[
-            ("agendada", "Agendada"),
-            ("concluida", "Concluída"),
-        ],
+        choices=STATUS_CONSULTA,
         default="agendada",
     )
 
     lembrete_enviado = models.BooleanField(default=False)
 
+    # [data_hora_inicio, data_hora_fim) calculado pelo banco; base da constraint de sobreposição
+    periodo = models.GeneratedField(
+        expression=models.Func(
+            models.F("data_hora_inicio"), models.F("data_hora_fim"), function="tstzrange"
+        ),
+        output_field=DateTimeRangeField(),
+        db_persist=True,
+    )
+
     class Meta:
-        unique_together = ("medico", "data_hora_inicio")
+        constraints = [
+            # um horário cancelado pode ser reservado de novo: a unicidade vale só para consultas ativas
+            models.UniqueConstraint(
+                fields=["medico", "data_hora_inicio"],
+                condition=models.Q(status__in=STATUS_OCUPANTES),
+                name="consulta_ativa_medico_inicio_uniq",
+                violation_error_message="O médico já tem uma consulta nesse horário.",
+            ),
+            # duas consultas ativas do mesmo médico nunca se sobrepõem, mesmo com agendamentos simultâneos
+            ExclusionConstraint(
+                name="consulta_sem_sobreposicao",
+                expressions=[("medico", RangeOperators.EQUAL), ("periodo", RangeOperators.OVERLAPS)],
+                condition=models.Q(status__in=STATUS_OCUPANTES),
+                violation_error_message="O médico já tem uma consulta nesse horário.",
+            ),
+        ]
+        indexes = [
+            # carregamento de agendas e checagem de conflito: só as consultas que ocupam a agenda
+            # (canceladas, concluídas e faltas, que só crescem com o tempo, ficam fora do índice)
+            models.Index(
+                fields=["medico", "data_hora_inicio", "data_hora_fim"],
+                condition=models.Q(status__in=STATUS_OCUPANTES),
+                name="consulta_ativa_medico_idx",
+            ),
+            # listagem geral, da mais recente para a mais antiga; o id desempata o cursor da paginação
+            models.Index(fields=["-data_hora_inicio", "-id"], name="consulta_inicio_desc_idx"),
+            # "minhas consultas" do médico, na mesma ordem (todas as situações, não só as ativas)
+            models.Index(fields=["medico", "-data_hora_inicio", "-id"], name="consulta_medico_desc_idx"),
+            # "minhas consultas" do paciente, em ordem cronológica
+            models.Index(fields=["paciente", "data_hora_inicio"], name="consulta_paciente_inicio_idx"),
+        ]
         ordering = ["data_hora_inicio"]
         verbose_name = "Consulta"
         verbose_name_plural = "Consultas"
@@ -80,6 +139,21 @@ class Consulta(models.Model):
         nome_paciente = self.paciente.usuario.nome_completo
         return f"{nome_paciente} - {nome_medico} em {data}"
 
+    @property
+    def ocupa_agenda(self) -> bool:
+        return self.status in STATUS_OCUPANTES
+
+    def pode_mudar_para(self, status: str) -> bool:
+        return status == self.status or status in TRANSICOES_STATUS.get(self.status, set())
+
+    def save(self, *args, **kwargs):
+        # sem fim o período ficaria aberto e bloquearia toda a agenda futura do médico
+        if self.data_hora_inicio and not self.data_hora_fim:
+            from .utils import DURACAO_CONSULTA
+
+            self.data_hora_fim = self.data_hora_inicio + DURACAO_CONSULTA
+        super().save(*args, **kwargs)
+
 
 class ExcecaoHorario(models.Model):
     medico = models.ForeignKey(
@@ -97,6 +171,13 @@ class ExcecaoHorario(models.Model):
     motivo = models.TextField(verbose_name="Motivo")
 
     class Meta:
+        indexes = [
+            # bloqueios e extras de um médico que cruzam uma janela de datas
+            models.Index(
+                fields=["medico", "esta_bloqueado", "data_inicio", "data_fim"],
+                name="excecao_medico_bloqueio_idx",
+            ),
+        ]
         verbose_name = "Exceção de Horário/Ausência"
         verbose_name_plural = "Exceções de Horário/Ausências"
         ordering = ["data_inicio"]
@@ -107,3 +188,122 @@ class ExcecaoHorario(models.Model):
         fim = self.data_fim.strftime("%d/%m %H:%M")
         nome = self.medico.usuario.nome_completo
         return f"{nome} - {status}: {inicio} a {fim}"
+
+
+class FeriadoClinica(models.Model):
+    """Fechamento da clínica inteira (feriado, recesso): bloqueia a agenda de todos os médicos com um só registro."""
+
+    descricao = models.CharField(max_length=150, verbose_name="Descrição")
+    data_inicio = models.DateTimeField(verbose_name="Início do Fechamento")
+    data_fim = models.DateTimeField(verbose_name="Fim do Fechamento")
+
+    class Meta:
+        verbose_name = "Feriado/Fechamento da Clínica"
+        verbose_name_plural = "Feriados/Fechamentos da Clínica"
+        ordering = ["data_inicio"]
+
+    def __str__(self):
+        inicio = self.data_inicio.strftime("%d/%m/%Y %H:%M")
+        fim = self.data_fim.strftime("%d/%m/%Y %H:%M")
+        return f"{self.descricao}: {inicio} a {fim}"
+
+
+class SlotDisponivel(models.Model):
+    """Slot livre pré-calculado, mantido por `consultas.materializacao` dentro de uma janela móvel."""
+
+    medico = models.ForeignKey(
+        Medico,
+        on_delete=models.CASCADE,
+        related_name="slots_disponiveis",
+        verbose_name="Médico",
+    )
+    data_hora_inicio = models.DateTimeField(verbose_name="Início do Slot")
+    data_hora_fim = models.DateTimeField(verbose_name="Fim do Slot")
+
+    class Meta:
+        unique_together = ("medico", "data_hora_inicio")
+        indexes = [
+            # "quem está livre em <horário>": busca por horário primeiro, depois médico
+            models.Index(fields=["data_hora_inicio", "medico"], name="slot_inicio_medico_idx"),
+        ]
+        verbose_name = "Slot Disponível"
+        verbose_name_plural = "Slots Disponíveis"
+        ordering = ["data_hora_inicio"]
+
+    def __str__(self):
+        inicio = self.data_hora_inicio.strftime("%d/%m/%Y %H:%M")
+        return f"{self.medico_id} - {inicio}"
+
+
+class MaterializacaoSlots(models.Model):
+    """Até que dia os slots de cada médico já foram materializados em SlotDisponivel."""
+
+    medico = models.OneToOneField(
+        Medico,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="materializacao_slots",
+        verbose_name="Médico",
+    )
+    materializado_ate = models.DateField(verbose_name="Materializado até")
+
+    class Meta:
+        verbose_name = "Materialização de Slots"
+        verbose_name_plural = "Materializações de Slots"
+
+    def __str__(self):
+        return f"{self.medico_id} até {self.materializado_ate:%d/%m/%Y}"
+
+
+class SubmissaoAgendamento(models.Model):
+    """Chave de idempotência de um envio do formulário de agendamento e a consulta que ele criou."""
+
+    chave = models.UUIDField(primary_key=True, verbose_name="Chave de Idempotência")
+    consulta = models.OneToOneField(
+        Consulta,
+        on_delete=models.CASCADE,
+        related_name="submissao",
+        verbose_name="Consulta",
+    )
+    criado_em = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
+
+    class Meta:
+        verbose_name = "Submissão de Agendamento"
+        verbose_name_plural = "Submissões de Agendamento"
+
+    def __str__(self):
+        return f"{self.chave} -> {self.consulta_id}"
+
+
+class ReservaSlot(models.Model):
+    """
+    Reserva temporária de um slot enquanto o formulário de agendamento está aberto. Até `expira_em`
+    o slot conta como ocupado para os demais; a chave é a de idempotência do formulário, e o
+    agendamento com essa chave converte a reserva em Consulta.
+    """
+
+    chave = models.UUIDField(primary_key=True, verbose_name="Chave do Formulário")
+    medico = models.ForeignKey(
+        Medico,
+        on_delete=models.CASCADE,
+        related_name="reservas_slot",
+        verbose_name="Médico",
+    )
+    data_hora_inicio = models.DateTimeField(verbose_name="Início do Slot")
+    data_hora_fim = models.DateTimeField(verbose_name="Fim do Slot")
+    expira_em = models.DateTimeField(verbose_name="Expira em")
+    criado_em = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
+
+    class Meta:
+        indexes = [
+            # reservas de um médico que cruzam uma janela de datas
+            models.Index(fields=["medico", "data_hora_inicio", "data_hora_fim"], name="reserva_medico_inicio_idx"),
+            # limpeza das reservas vencidas
+            models.Index(fields=["expira_em"], name="reserva_expira_idx"),
+        ]
+        verbose_name = "Reserva de Slot"
+        verbose_name_plural = "Reservas de Slot"
+
+    def __str__(self):
+        inicio = self.data_hora_inicio.strftime("%d/%m/%Y %H:%M")
+        return f"{self.medico_id} - {inicio} (até {self.expira_em:%H:%M})"
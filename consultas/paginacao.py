@@ -0,0 +1,116 @@
+# paginacao.py
+"""
+Paginação por cursor (keyset) das listagens de consultas.
+
+As consultas são listadas da mais recente para a mais antiga, em ordem (data_hora_inicio, id)
+decrescente. Em vez de OFFSET, cada página parte da última linha da anterior
+(`WHERE (inicio, id) < (cursor)`), então a página 500 custa o mesmo que a primeira. O cursor
+é opaco para o template (base64 de "início ISO|id").
+
+O total é contado só até `CONSULTAS_CONTAGEM_MAXIMA` (COUNT sobre um LIMIT): acima disso a
+listagem mostra "mais de N", sem varrer o histórico inteiro.
+"""
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+CONSULTAS_CONTAGEM_MAXIMA = getattr(settings, "CONSULTAS_CONTAGEM_MAXIMA", 1000)
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(consulta) -> str:
+    valor = f"{consulta.data_hora_inicio.isoformat()}|{consulta.pk}"
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str):
+    """(data_hora_inicio, id) de um cursor; CursorInvalido se ele não foi gerado por `codificar_cursor`."""
+    try:
+        valor = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        inicio, pk = valor.split("|")
+        inicio = parse_datetime(inicio)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise CursorInvalido(cursor)
+    if inicio is None:
+        raise CursorInvalido(cursor)
+    return inicio, pk
+
+
+def _antes_de(inicio, pk) -> Q:
+    # o primeiro termo delimita a faixa do índice; o segundo desempata pelo id
+    return Q(data_hora_inicio__lte=inicio) & (Q(data_hora_inicio__lt=inicio) | Q(pk__lt=pk))
+
+
+def _depois_de(inicio, pk) -> Q:
+    return Q(data_hora_inicio__gte=inicio) & (Q(data_hora_inicio__gt=inicio) | Q(pk__gt=pk))
+
+
+class PaginaCursor:
+    """Uma página da listagem e os cursores das vizinhas (None quando não há)."""
+
+    def __init__(self, object_list, cursor_anterior, cursor_proximo, total, total_limitado):
+        self.object_list = object_list
+        self.cursor_anterior = cursor_anterior
+        self.cursor_proximo = cursor_proximo
+        self.total = total
+        # True quando há mais de `total` consultas (contagem interrompida no limite)
+        self.total_limitado = total_limitado
+
+    def has_previous(self) -> bool:
+        return self.cursor_anterior is not None
+
+    def has_next(self) -> bool:
+        return self.cursor_proximo is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_previous() or self.has_next()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def contar_ate(queryset, limite: int = None):
+    """(total, limitado): conta no máximo `limite` linhas; `limitado` indica que há mais."""
+    limite = limite or CONSULTAS_CONTAGEM_MAXIMA
+    total = queryset.order_by()[: limite + 1].count()
+    return min(total, limite), total > limite
+
+
+def paginar_consultas(queryset, por_pagina: int, apos: str = None, antes: str = None) -> PaginaCursor:
+    """
+    Página de `queryset` em ordem (data_hora_inicio, id) decrescente.
+    `apos`: cursor da última linha da página atual (próxima página, mais antigas);
+    `antes`: cursor da primeira linha (página anterior, mais recentes). Sem cursor, a primeira página.
+    """
+    total, total_limitado = contar_ate(queryset)
+
+    if antes:
+        # busca para trás em ordem crescente e inverte: mesma query indexada, no outro sentido
+        anteriores = queryset.filter(_depois_de(*decodificar_cursor(antes))).order_by("data_hora_inicio", "pk")
+        linhas = list(anteriores[: por_pagina + 1])
+        tem_mais = len(linhas) > por_pagina
+        linhas = linhas[:por_pagina][::-1]
+        anterior = codificar_cursor(linhas[0]) if tem_mais and linhas else None
+        # voltando de uma página existente, sempre há a página seguinte (a de onde se veio)
+        proximo = codificar_cursor(linhas[-1]) if linhas else None
+        return PaginaCursor(linhas, anterior, proximo, total, total_limitado)
+
+    ordenado = queryset.order_by("-data_hora_inicio", "-pk")
+    if apos:
+        ordenado = ordenado.filter(_antes_de(*decodificar_cursor(apos)))
+    linhas = list(ordenado[: por_pagina + 1])
+    tem_mais = len(linhas) > por_pagina
+    linhas = linhas[:por_pagina]
+    anterior = codificar_cursor(linhas[0]) if apos and linhas else None
+    proximo = codificar_cursor(linhas[-1]) if tem_mais else None
+    return PaginaCursor(linhas, anterior, proximo, total, total_limitado)
@@ -0,0 +1,101 @@
+# remarcacao.py
+"""
+Remarcação em lote das consultas atingidas por um novo bloqueio (ExcecaoHorario).
+
+As consultas afetadas saem de uma única query (sobreposição com o período do bloqueio). Os
+novos horários vêm de uma só varredura da agenda do médico a partir do fim do bloqueio: os
+slots livres são gerados em ordem e cada consulta, também em ordem, recebe o próximo — nenhum
+slot é entregue duas vezes. A prévia e a aplicação usam o mesmo cálculo; a aplicação o refaz sob
+a trava do médico e só grava (um `bulk_update` numa transação) se o resultado ainda for o da prévia.
+"""
+from datetime import datetime, timedelta, time as _time
+from typing import Dict, List, Optional, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from .agendamento import travar_agenda_medico
+from .cache import invalidar_agenda
+from .materializacao import recalcular_slots
+from .models import STATUS_OCUPANTES, Consulta, ExcecaoHorario
+from .utils import DURACAO_CONSULTA, _make_aware, carregar_agendas, iterar_slots
+
+# Até quantos dias após o fim do bloqueio procurar horários substitutos
+REMARCACAO_JANELA_DIAS = 30
+
+
+def consultas_afetadas(excecao: ExcecaoHorario):
+    """Consultas ativas do médico que se sobrepõem ao período do bloqueio, em ordem cronológica."""
+    return (
+        Consulta.objects.filter(
+            medico_id=excecao.medico_id,
+            status__in=STATUS_OCUPANTES,
+            periodo__overlap=(excecao.data_inicio, excecao.data_fim),
+        )
+        .select_related("paciente__usuario")
+        .order_by("data_hora_inicio", "pk")
+    )
+
+
+def _slots_livres_apos(medico_id: int, apos: datetime, dias: int):
+    """Gera os slots livres do médico a partir de `apos`, em ordem (agenda carregada uma vez)."""
+    data_inicial = timezone.localtime(apos).date()
+    inicio = _make_aware(datetime.combine(data_inicial, _time.min))
+    fim = _make_aware(datetime.combine(data_inicial + timedelta(days=dias), _time.min))
+    agenda = carregar_agendas([medico_id], inicio, fim)[int(medico_id)]
+    for _, slots in iterar_slots(agenda, data_inicial, dias, apos):
+        yield from slots
+
+
+def propor_remarcacoes(
+    excecao: ExcecaoHorario, dias: int = REMARCACAO_JANELA_DIAS
+) -> List[Tuple[Consulta, Optional[datetime]]]:
+    """
+    [(consulta, novo início ou None)] para as consultas afetadas pelo bloqueio. None quando não
+    há slot livre suficiente nos `dias` seguintes ao fim do bloqueio.
+    """
+    afetadas = list(consultas_afetadas(excecao))
+    if not afetadas:
+        return []
+
+    apos = max(_make_aware(excecao.data_fim), timezone.localtime(timezone.now()))
+    livres = _slots_livres_apos(excecao.medico_id, apos, dias)
+    return [(consulta, next(livres, None)) for consulta in afetadas]
+
+
+def _como_prevista(propostas) -> Dict[int, Optional[str]]:
+    return {consulta.pk: (inicio.isoformat() if inicio else None) for consulta, inicio in propostas}
+
+
+def aplicar_remarcacoes(excecao: ExcecaoHorario, prevista: Dict[int, Optional[str]]) -> List[Consulta]:
+    """
+    Recalcula as remarcações sob a trava do médico e grava as que têm novo horário.
+    `prevista` é o resultado mostrado na prévia ({consulta_id: início ISO ou None}); se a agenda
+    mudou desde então, nada é gravado e ValidationError é levantado.
+    """
+    with transaction.atomic():
+        travar_agenda_medico(excecao.medico_id)
+        propostas = propor_remarcacoes(excecao)
+        if _como_prevista(propostas) != prevista:
+            raise ValidationError("A agenda mudou desde a prévia. Revise as remarcações propostas.")
+
+        movidas = []
+        dias_alterados = []
+        for consulta, novo_inicio in propostas:
+            if novo_inicio is None:
+                continue
+            dias_alterados += [consulta.data_hora_inicio, novo_inicio]
+            consulta.data_hora_inicio = novo_inicio
+            consulta.data_hora_fim = novo_inicio + DURACAO_CONSULTA
+            movidas.append(consulta)
+        Consulta.objects.bulk_update(movidas, ["data_hora_inicio", "data_hora_fim"])
+
+    if movidas:
+        # bulk_update não dispara os signals: cache e slots materializados são atualizados aqui
+        invalidar_agenda(excecao.medico_id)
+        primeiro_dia = timezone.localtime(min(dias_alterados)).date()
+        ultimo_dia = timezone.localtime(max(dias_alterados)).date()
+        transaction.on_commit(lambda: recalcular_slots(excecao.medico_id, primeiro_dia, ultimo_dia))
+
+    return movidas
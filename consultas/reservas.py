@@ -0,0 +1,76 @@
+# reservas.py
+"""
+Reservas temporárias de slot durante o agendamento.
+
+Ao abrir o formulário com `?slot=...`, o slot é reservado (ReservaSlot) por
+`CONSULTAS_RESERVA_MINUTOS` sob a trava da agenda do médico: outro atendente que abrir o mesmo
+horário recebe o aviso na hora, em vez de só descobrir o conflito no envio. Enquanto não vence,
+a reserva conta como ocupada no motor de slots e na checagem de conflito, exceto para o
+próprio formulário (mesma chave). O agendamento com a chave converte a reserva em Consulta
+(`agendamento.agendar_consulta`). As vencidas do médico são apagadas a cada nova reserva, e o
+comando `liberar_reservas_slot` apaga as de todos os médicos.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .agendamento import travar_agenda_medico
+from .models import ReservaSlot
+from .utils import DURACAO_CONSULTA, _make_aware, checar_conflito_consulta
+
+CONSULTAS_RESERVA_MINUTOS = getattr(settings, "CONSULTAS_RESERVA_MINUTOS", 5)
+
+
+def reservar_slot(medico_id: int, inicio: datetime, chave: uuid.UUID = None, substituir: uuid.UUID = None):
+    """
+    Reserva [inicio, inicio + DURACAO_CONSULTA) para o formulário `chave` (gerada se omitida).
+    `substituir` é a reserva anterior do mesmo atendente: renovada se for do mesmo slot, ou
+    liberada na mesma transação.
+    Retorna a ReservaSlot, ou None se o horário já está ocupado ou reservado por outro formulário.
+    """
+    inicio = _make_aware(inicio)
+    fim = inicio + DURACAO_CONSULTA
+    chave = chave or uuid.uuid4()
+
+    with transaction.atomic():
+        travar_agenda_medico(medico_id)
+        # limpeza preguiçosa: não depende do comando de limpeza estar agendado
+        ReservaSlot.objects.filter(medico_id=medico_id, expira_em__lte=timezone.now()).delete()
+        if substituir and substituir != chave:
+            mesma = ReservaSlot.objects.filter(chave=substituir, medico_id=medico_id, data_hora_inicio=inicio)
+            if mesma.exists() and not checar_conflito_consulta(medico_id, inicio, fim, chave_reserva=substituir):
+                # o formulário do mesmo slot foi reaberto: renova a reserva em vez de trocá-la
+                # (update() sem signal: o slot segue ocupado pelo mesmo formulário)
+                mesma.update(expira_em=timezone.now() + timedelta(minutes=CONSULTAS_RESERVA_MINUTOS))
+                return mesma.get()
+            liberar_reserva(substituir)
+        if checar_conflito_consulta(medico_id, inicio, fim, chave_reserva=chave):
+            return None
+        reserva, _ = ReservaSlot.objects.update_or_create(
+            chave=chave,
+            defaults={
+                "medico_id": medico_id,
+                "data_hora_inicio": inicio,
+                "data_hora_fim": fim,
+                "expira_em": timezone.now() + timedelta(minutes=CONSULTAS_RESERVA_MINUTOS),
+            },
+        )
+    return reserva
+
+
+def liberar_reserva(chave) -> None:
+    """Remove a reserva do formulário (agendamento concluído ou slot trocado)."""
+    if chave:
+        # delete() por instância: o signal invalida o cache da agenda do médico
+        for reserva in ReservaSlot.objects.filter(chave=chave):
+            reserva.delete()
+
+
+def liberar_reservas_expiradas() -> int:
+    """Apaga as reservas vencidas e retorna quantas foram removidas."""
+    # QuerySet.delete() dispara post_delete por reserva: cada agenda afetada é invalidada
+    removidas, _ = ReservaSlot.objects.filter(expira_em__lte=timezone.now()).delete()
+    return removidas
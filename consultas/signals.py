@@ -0,0 +1,65 @@
+# signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .cache import invalidar_agenda
+from .calendario import invalidar_calendario
+from .materializacao import atualizar_por_alteracao
+from .models import Consulta, ExcecaoHorario, FeriadoClinica, HorarioTrabalho, ReservaSlot
+
+MODELOS_AGENDA = (Consulta, HorarioTrabalho, ExcecaoHorario)
+
+
+def _guardar_estado_anterior(sender, instance, **kwargs):
+    """Guarda a versão salva no banco: a agenda antiga (médico/dias) também precisa ser atualizada."""
+    instance._estado_anterior = None
+    if instance.pk:
+        instance._estado_anterior = sender.objects.filter(pk=instance.pk).first()
+
+
+def _estado_anterior(instance, removido: bool):
+    # consumido no post_save: pre_save não roda na exclusão, e um delete() depois de um save()
+    # da mesma instância leria a versão de antes desse save. Na exclusão vale o estado atual.
+    anterior = instance.__dict__.pop("_estado_anterior", None)
+    return None if removido else anterior
+
+
+def _agenda_alterada(sender, instance, signal, **kwargs):
+    removido = signal is post_delete
+    anterior = _estado_anterior(instance, removido)
+
+    invalidar_agenda(instance.medico_id)
+    if anterior is not None and anterior.medico_id != instance.medico_id:
+        invalidar_agenda(anterior.medico_id)
+
+    transaction.on_commit(lambda: atualizar_por_alteracao(instance, anterior, removido))
+
+
+def _reserva_alterada(sender, instance, created=False, **kwargs):
+    """Reserva alterada/removida: só o cache (os slots materializados ignoram reservas)."""
+    # reserva nova ocupa um slot que as listas em cache mostravam livre: continuam válidas
+    # (ver `consultas.cache`), e trocar a versão aqui faria cada abertura do formulário recalcular a agenda
+    if created:
+        return
+    invalidar_agenda(instance.medico_id)
+
+
+def _calendario_alterado(sender, instance, signal, **kwargs):
+    """Feriado criado/alterado/removido: invalida o calendário (e com ele o cache de todos os médicos)."""
+    removido = signal is post_delete
+    anterior = _estado_anterior(instance, removido)
+    invalidar_calendario()
+    transaction.on_commit(lambda: atualizar_por_alteracao(instance, anterior, removido))
+
+
+for modelo in MODELOS_AGENDA:
+    pre_save.connect(_guardar_estado_anterior, sender=modelo, dispatch_uid=f"agenda_pre_save_{modelo.__name__}")
+    post_save.connect(_agenda_alterada, sender=modelo, dispatch_uid=f"agenda_post_save_{modelo.__name__}")
+    post_delete.connect(_agenda_alterada, sender=modelo, dispatch_uid=f"agenda_post_delete_{modelo.__name__}")
+
+pre_save.connect(_guardar_estado_anterior, sender=FeriadoClinica, dispatch_uid="calendario_pre_save")
+post_save.connect(_calendario_alterado, sender=FeriadoClinica, dispatch_uid="calendario_post_save")
+post_delete.connect(_calendario_alterado, sender=FeriadoClinica, dispatch_uid="calendario_post_delete")
+
+post_save.connect(_reserva_alterada, sender=ReservaSlot, dispatch_uid="reserva_post_save")
+post_delete.connect(_reserva_alterada, sender=ReservaSlot, dispatch_uid="reserva_post_delete")
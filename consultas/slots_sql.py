@@ -0,0 +1,173 @@
+# slots_sql.py
+"""
+Backend de slots executado no PostgreSQL.
+
+Os horários recorrentes são expandidos em dias com `generate_series`, as disponibilidades extras
+são recortadas a cada dia, os períodos sobrepostos são mesclados com funções de janela e os
+slots candidatos são descartados com o operador `&&` de `tstzrange` contra consultas, bloqueios,
+reservas temporárias e fechamentos da clínica (estes vindos do calendário em memória, passados
+como parâmetro).
+Só os slots livres voltam para o Python.
+
+Selecionado com `CONSULTAS_SLOTS_BACKEND = "postgres"` nas settings; o resultado é o mesmo do
+motor em Python (`consultas.utils`).
+"""
+from datetime import date, datetime, timedelta, time as _time
+from typing import Dict, List
+
+from django.db import connection
+from django.utils import timezone
+
+from .calendario import calendario_clinica
+from .utils import DURACAO_CONSULTA, STATUS_OCUPANTES, _janela_busca, _make_aware, _proximo_slot, _resolver_medicos
+
+SQL_SLOTS_LIVRES = """
+WITH dias AS (
+    SELECT d::date AS dia,
+           d::timestamp AT TIME ZONE %(tz)s AS inicio_dia,
+           (d + interval '1 day')::timestamp AT TIME ZONE %(tz)s AS fim_dia
+    FROM generate_series(%(dia_inicial)s::date, %(dia_final)s::date, interval '1 day') AS d
+),
+periodos AS (
+    SELECT h.medico_id,
+           dias.dia,
+           (dias.dia + h.hora_inicio) AT TIME ZONE %(tz)s AS inicio,
+           (dias.dia + h.hora_fim) AT TIME ZONE %(tz)s AS fim
+    FROM consultas_horariotrabalho h
+    JOIN dias ON h.dia_semana = EXTRACT(DOW FROM dias.dia)
+    WHERE h.medico_id = ANY(%(medicos)s)
+
+    UNION ALL
+
+    SELECT e.medico_id,
+           dias.dia,
+           GREATEST(e.data_inicio, dias.inicio_dia),
+           LEAST(e.data_fim, dias.fim_dia)
+    FROM consultas_excecaohorario e
+    JOIN dias ON e.data_inicio < dias.fim_dia AND e.data_fim > dias.inicio_dia
+    WHERE e.medico_id = ANY(%(medicos)s) AND NOT e.esta_bloqueado
+),
+marcados AS (
+    SELECT medico_id, dia, inicio, fim,
+           CASE
+               WHEN inicio <= MAX(fim) OVER (
+                   PARTITION BY medico_id, dia ORDER BY inicio, fim
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ) THEN 0
+               ELSE 1
+           END AS novo_periodo
+    FROM periodos
+    WHERE fim > inicio
+),
+ilhas AS (
+    SELECT medico_id, dia, inicio, fim,
+           SUM(novo_periodo) OVER (
+               PARTITION BY medico_id, dia ORDER BY inicio, fim ROWS UNBOUNDED PRECEDING
+           ) AS ilha
+    FROM marcados
+),
+mesclados AS (
+    SELECT medico_id, dia, MIN(inicio) AS inicio, MAX(fim) AS fim
+    FROM ilhas
+    GROUP BY medico_id, dia, ilha
+),
+candidatos AS (
+    SELECT m.medico_id, m.dia, slot
+    FROM mesclados m,
+         generate_series(
+             CASE WHEN m.inicio < %(agora)s THEN GREATEST(m.inicio, %(proximo)s) ELSE m.inicio END,
+             m.fim - %(duracao)s,
+             %(duracao)s
+         ) AS slot
+),
+ocupados AS (
+    SELECT medico_id, tstzrange(data_inicio, data_fim) AS periodo
+    FROM consultas_excecaohorario
+    WHERE medico_id = ANY(%(medicos)s)
+      AND esta_bloqueado
+      AND data_fim > data_inicio
+      AND data_inicio < %(fim_busca)s AND data_fim > %(inicio_busca)s
+
+    UNION ALL
+
+    SELECT medico_id, tstzrange(data_hora_inicio, COALESCE(data_hora_fim, data_hora_inicio + %(duracao)s))
+    FROM consultas_consulta
+    WHERE medico_id = ANY(%(medicos)s)
+      AND status = ANY(%(status)s)
+      AND COALESCE(data_hora_fim, data_hora_inicio + %(duracao)s) > data_hora_inicio
+      AND data_hora_inicio < %(fim_busca)s
+      AND COALESCE(data_hora_fim, data_hora_inicio + %(duracao)s) > %(inicio_busca)s
+
+    UNION ALL
+
+    -- reservas temporárias de slot ainda válidas
+    SELECT medico_id, tstzrange(data_hora_inicio, data_hora_fim)
+    FROM consultas_reservaslot
+    WHERE medico_id = ANY(%(medicos)s)
+      AND expira_em > %(agora)s
+      AND chave IS DISTINCT FROM %(chave_reserva)s::uuid
+      AND data_hora_inicio < %(fim_busca)s AND data_hora_fim > %(inicio_busca)s
+
+    UNION ALL
+
+    -- fechamentos da clínica, vindos do calendário em memória, valem para todos os médicos
+    SELECT m.medico_id, tstzrange(f.inicio, f.fim)
+    FROM unnest(%(fechamentos_inicio)s::timestamptz[], %(fechamentos_fim)s::timestamptz[]) AS f(inicio, fim)
+    CROSS JOIN unnest(%(medicos)s::bigint[]) AS m(medico_id)
+)
+SELECT c.medico_id, c.dia, c.slot
+FROM candidatos c
+WHERE NOT EXISTS (
+    SELECT 1
+    FROM ocupados o
+    WHERE o.medico_id = c.medico_id
+      AND o.periodo && tstzrange(c.slot, c.slot + %(duracao)s)
+)
+ORDER BY c.medico_id, c.slot
+"""
+
+
+def slots_livres_sql(medico_ids, data_inicial: date, dias: int, agora: datetime, chave_reserva=None):
+    """
+    Executa a consulta e retorna as linhas (medico_id, dia, slot aware) em ordem.
+    A reserva `chave_reserva` (a do próprio formulário) não ocupa o slot.
+    """
+    medico_ids = [int(medico_id) for medico_id in medico_ids]
+    if not medico_ids or dias <= 0:
+        return []
+
+    dia_final = data_inicial + timedelta(days=dias - 1)
+    inicio_busca = _make_aware(datetime.combine(data_inicial, _time.min))
+    fim_busca = _make_aware(datetime.combine(dia_final + timedelta(days=1), _time.min))
+    fechamentos = calendario_clinica.fechamentos(inicio_busca, fim_busca)
+    params = {
+        "tz": timezone.get_current_timezone_name(),
+        "dia_inicial": data_inicial,
+        "dia_final": dia_final,
+        "medicos": medico_ids,
+        "agora": agora,
+        "proximo": _proximo_slot(agora),
+        "duracao": DURACAO_CONSULTA,
+        "status": list(STATUS_OCUPANTES),
+        "inicio_busca": inicio_busca,
+        "fim_busca": fim_busca,
+        "fechamentos_inicio": [inicio for inicio, _ in fechamentos],
+        "fechamentos_fim": [fim for _, fim in fechamentos],
+        "chave_reserva": str(chave_reserva) if chave_reserva else None,
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_SLOTS_LIVRES, params)
+        return cursor.fetchall()
+
+
+def calcular_slots_lote_sql(
+    medico_ids=None, especialidade_id: int = None, dias_a_frente: int = 7, chave_reserva=None
+) -> Dict[int, Dict[str, List[str]]]:
+    """Mesmo contrato de `calcular_slots_disponiveis_lote`, calculado no banco."""
+    medico_ids = _resolver_medicos(medico_ids, especialidade_id)
+    agora, hoje_date, _, _ = _janela_busca(dias_a_frente)
+
+    resultado = {int(medico_id): {} for medico_id in medico_ids}
+    for medico_id, dia, slot in slots_livres_sql(medico_ids, hoje_date, dias_a_frente, agora, chave_reserva):
+        resultado[medico_id].setdefault(dia.isoformat(), []).append(timezone.localtime(slot).isoformat())
+    return resultado
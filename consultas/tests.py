@@ -1,2 +1,1214 @@
+import csv
+import json
+import random
+from datetime import datetime, time, timedelta
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Especialidade, Medico, Paciente, Usuario
+from .agendamento import MENSAGEM_CONFLITO, agendar_consulta, agendar_serie, estatisticas_travas, metricas_trava
+from .benchmark import MAX_TURNOS_POR_DIA
+from .bitmap import calcular_slots_disponiveis_bitmap
+from .cache import CacheSlots, obter_slots_disponiveis, versao_agenda
+from .calendario import calendario_clinica
+from .consistencia import verificar_consistencia
+from .impacto import consultas_orfas
+from .materializacao import estender_janela, medicos_livres
+from .models import (
+    Consulta,
+    ExcecaoHorario,
+    FeriadoClinica,
+    HorarioTrabalho,
+    MaterializacaoSlots,
+    ReservaSlot,
+    SlotDisponivel,
+)
+from .reservas import reservar_slot
+from .utils import (
+    calcular_slots_disponiveis,
+    calcular_slots_disponiveis_lote,
+    checar_conflito_consulta,
+    proximos_slots_livres,
+    slots_do_dia,
+)
+from .views import AgendamentoSemConflitoMixin
+
+# Segunda-feira, 10:10 no fuso corrente
+AGORA = timezone.make_aware(datetime(2030, 1, 7, 10, 10))
+
+
+@pytest.fixture(autouse=True)
+def _calendario_clinica_limpo():
+    """O calendário em memória sobrevive ao rollback do banco entre testes."""
+    calendario_clinica.limpar()
+    yield
+    calendario_clinica.limpar()
+
+
 def test_soma():
     assert 1 + 1 == 2
+
+
+def _aware(dia, hora, minuto=0):
+    return timezone.make_aware(datetime.combine(dia, time(hora, minuto)))
+
+
+def _criar_medico(cpf="11111111111", especialidade=None):
+    usuario = Usuario.objects.create_user(username=cpf, cpf=cpf, nome_completo=f"Médico {cpf}", tipo="medico")
+    return Medico.objects.create(usuario=usuario, especialidade=especialidade)
+
+
+def _criar_paciente(cpf="22222222222"):
+    usuario = Usuario.objects.create_user(username=cpf, cpf=cpf, nome_completo=f"Paciente {cpf}", tipo="paciente")
+    return Paciente.objects.create(usuario=usuario)
+
+
+@pytest.mark.django_db
+def test_calcular_slots_disponiveis_respeita_consultas_bloqueios_e_agora():
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    hoje = AGORA.date()
+    amanha = hoje + timedelta(days=1)
+
+    # Segunda 08:00-12:00 e Terça 08:00-10:00, com turnos sobrepostos na terça
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=1, hora_inicio=time(8), hora_fim=time(12))
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(9))
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8, 30), hora_fim=time(10))
+
+    Consulta.objects.create(
+        medico=medico, paciente=paciente, data_hora_inicio=_aware(hoje, 11), data_hora_fim=_aware(hoje, 11, 30)
+    )
+    # consulta sem data_hora_fim ocupa um slot
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(amanha, 8))
+    ExcecaoHorario.objects.create(
+        medico=medico, data_inicio=_aware(amanha, 9, 10), data_fim=_aware(amanha, 9, 20), motivo="Reunião"
+    )
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        slots = calcular_slots_disponiveis(medico.pk, dias_a_frente=2)
+
+    assert slots == {
+        hoje.isoformat(): [_aware(hoje, 10, 30).isoformat(), _aware(hoje, 11, 30).isoformat()],
+        amanha.isoformat(): [_aware(amanha, 8, 30).isoformat(), _aware(amanha, 9, 30).isoformat()],
+    }
+
+
+@pytest.mark.django_db
+def test_calcular_slots_disponiveis_inclui_disponibilidade_extra_recortada_ao_dia():
+    medico = _criar_medico()
+    hoje = AGORA.date()
+    amanha = hoje + timedelta(days=1)
+    ExcecaoHorario.objects.create(
+        medico=medico,
+        data_inicio=_aware(hoje, 23),
+        data_fim=_aware(amanha, 1),
+        esta_bloqueado=False,
+        motivo="Plantão",
+    )
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        slots = calcular_slots_disponiveis(medico.pk, dias_a_frente=2)
+
+    assert slots[hoje.isoformat()] == [_aware(hoje, 23).isoformat(), _aware(hoje, 23, 30).isoformat()]
+    assert slots[amanha.isoformat()] == [_aware(amanha, 0).isoformat(), _aware(amanha, 0, 30).isoformat()]
+
+
+@pytest.mark.django_db
+def test_calcular_slots_disponiveis_lote_usa_queries_constantes(django_assert_num_queries):
+    especialidade = Especialidade.objects.create(nome="Cardiologia")
+    medicos = [_criar_medico(cpf=f"{i:011d}", especialidade=especialidade) for i in range(1, 6)]
+    for medico in medicos:
+        HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(9))
+    outro = _criar_medico(cpf="99999999999")
+    HorarioTrabalho.objects.create(medico=outro, dia_semana=2, hora_inicio=time(8), hora_fim=time(9))
+
+    calendario_clinica.fechamentos(AGORA, AGORA)  # calendário da clínica já carregado no processo
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        with django_assert_num_queries(4):
+            lote = calcular_slots_disponiveis_lote(especialidade_id=especialidade.pk, dias_a_frente=7)
+        individual = {medico.pk: calcular_slots_disponiveis(medico.pk, dias_a_frente=7) for medico in medicos}
+
+    assert lote == individual
+    assert outro.pk not in lote
+
+
+@pytest.mark.django_db
+def test_cache_slots_invalidado_por_signal_e_limitado_por_lru():
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(9))
+    amanha = AGORA.date() + timedelta(days=1)
+    cache_slots = CacheSlots(max_itens=2)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        primeiro = cache_slots.obter(medico.pk, 7)
+        assert cache_slots.obter(medico.pk, 7) == primeiro
+        assert (cache_slots.hits, cache_slots.misses) == (1, 1)
+
+        Consulta.objects.create(
+            medico=medico, paciente=paciente, data_hora_inicio=_aware(amanha, 8), data_hora_fim=_aware(amanha, 8, 30)
+        )
+        assert cache_slots.obter(medico.pk, 7) == {amanha.isoformat(): [_aware(amanha, 8, 30).isoformat()]}
+        assert cache_slots.misses == 2
+
+        cache_slots.obter(medico.pk, 14)
+        cache_slots.obter(medico.pk, 21)
+        assert cache_slots.estatisticas()["itens"] == 2
+        assert cache_slots.evictions == 1
+
+
+@pytest.mark.django_db
+def test_cache_slots_troca_a_versao_de_novo_no_commit(settings, django_capture_on_commit_callbacks):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(9))
+    amanha = AGORA.date() + timedelta(days=1)
+    cache_slots = CacheSlots()
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        antes = versao_agenda(medico.pk)
+        with django_capture_on_commit_callbacks(execute=False) as no_commit:
+            Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(amanha, 8))
+        durante = versao_agenda(medico.pk)
+        # um leitor concorrente ainda sem a consulta guardaria o resultado sob esta versão
+        cache_slots.obter(medico.pk, 7)
+        for callback in no_commit:
+            callback()
+        assert len({antes, durante, versao_agenda(medico.pk)}) == 3
+        cache_slots.obter(medico.pk, 7)
+        assert (cache_slots.hits, cache_slots.misses) == (0, 2)
+
+        # cache local ao processo fora do desenvolvimento: o LRU não é usado
+        settings.CONSULTAS_CACHE_LOCAL_PERMITIDO = False
+        cache_slots.obter(medico.pk, 7)
+        cache_slots.obter(medico.pk, 7)
+        assert (cache_slots.hits, cache_slots.misses, cache_slots.estatisticas()["itens"]) == (0, 4, 1)
+
+
+@pytest.mark.django_db
+def test_slots_materializados_atualizados_incrementalmente(django_capture_on_commit_callbacks):
+    especialidade = Especialidade.objects.create(nome="Cardiologia")
+    medico = _criar_medico(especialidade=especialidade)
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(10))
+    amanha = AGORA.date() + timedelta(days=1)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        estender_janela(dias=7)
+        assert SlotDisponivel.objects.filter(medico=medico).count() == 4
+        assert list(medicos_livres(_aware(amanha, 9), especialidade_id=especialidade.pk)) == [medico]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            consulta = Consulta.objects.create(
+                medico=medico,
+                paciente=paciente,
+                data_hora_inicio=_aware(amanha, 9),
+                data_hora_fim=_aware(amanha, 9, 30),
+            )
+        assert not medicos_livres(_aware(amanha, 9)).exists()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            consulta.delete()
+        assert medicos_livres(_aware(amanha, 9)).exists()
+
+        slots = SlotDisponivel.objects.filter(medico=medico).values_list("data_hora_inicio", flat=True)
+        esperado = calcular_slots_disponiveis(medico.pk, dias_a_frente=7)[amanha.isoformat()]
+        assert [timezone.localtime(s).isoformat() for s in slots] == esperado
+
+
+@pytest.mark.django_db
+def test_slots_materializados_em_lote_e_so_nos_dias_afetados(django_capture_on_commit_callbacks):
+    paciente = _criar_paciente()
+    medicos = [_criar_medico(cpf=f"{i:011d}") for i in range(1, 4)]
+    for medico in medicos:
+        HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(10))
+    amanha = AGORA.date() + timedelta(days=1)
+
+    def queries_do_feriado():
+        with CaptureQueriesContext(connection) as capturadas:
+            with django_capture_on_commit_callbacks(execute=True):
+                FeriadoClinica.objects.create(
+                    descricao="Feriado", data_inicio=_aware(amanha, 0), data_fim=_aware(amanha, 23, 59)
+                )
+        with django_capture_on_commit_callbacks(execute=True):
+            FeriadoClinica.objects.all().delete()
+        return len(capturadas)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        estender_janela(dias=7)
+        MaterializacaoSlots.objects.exclude(medico=medicos[0]).delete()
+        um_medico = queries_do_feriado()
+        estender_janela(dias=7)
+        assert queries_do_feriado() == um_medico
+        assert SlotDisponivel.objects.count() == 12
+
+        # consulta nova: só apaga o slot coberto, sem recarregar a agenda
+        with mock.patch("consultas.materializacao.carregar_agendas") as carregar:
+            with django_capture_on_commit_callbacks(execute=True):
+                Consulta.objects.create(
+                    medico=medicos[0],
+                    paciente=paciente,
+                    data_hora_inicio=_aware(amanha, 9, 15),
+                    data_hora_fim=_aware(amanha, 9, 45),
+                )
+        carregar.assert_not_called()
+        livres = SlotDisponivel.objects.filter(medico=medicos[0]).values_list("data_hora_inicio", flat=True)
+        assert [timezone.localtime(s).time() for s in livres] == [time(8), time(8, 30)]
+
+        # remarcada para outro dia e excluída pela mesma instância: libera o horário novo, não o antigo
+        quarta = amanha + timedelta(days=1)
+        with django_capture_on_commit_callbacks(execute=True):
+            HorarioTrabalho.objects.create(medico=medicos[1], dia_semana=3, hora_inicio=time(8), hora_fim=time(9))
+            consulta = Consulta.objects.create(
+                medico=medicos[1],
+                paciente=paciente,
+                data_hora_inicio=_aware(quarta, 8),
+                data_hora_fim=_aware(quarta, 8, 30),
+            )
+        with django_capture_on_commit_callbacks(execute=True):
+            consulta.data_hora_inicio, consulta.data_hora_fim = _aware(amanha, 8), _aware(amanha, 8, 30)
+            consulta.save()
+        with django_capture_on_commit_callbacks(execute=True):
+            consulta.delete()
+        assert SlotDisponivel.objects.filter(medico=medicos[1], data_hora_inicio=_aware(amanha, 8)).exists()
+
+
+def _popular_agendas_aleatorias(semente=42, quantidade=4):
+    aleatorio = random.Random(semente)
+    paciente = _criar_paciente()
+    hoje = AGORA.date()
+    medicos = []
+    for i in range(1, quantidade + 1):
+        medico = _criar_medico(cpf=f"{i:011d}")
+        medicos.append(medico)
+        for dia_semana in range(7):
+            for _ in range(aleatorio.randint(0, 2)):
+                inicio = aleatorio.randrange(6 * 60, 18 * 60, 15)
+                fim = min(inicio + aleatorio.randrange(30, 5 * 60, 15), 23 * 60 + 59)
+                HorarioTrabalho.objects.get_or_create(
+                    medico=medico,
+                    dia_semana=dia_semana,
+                    hora_inicio=time(inicio // 60, inicio % 60),
+                    hora_fim=time(fim // 60, fim % 60),
+                )
+        for _ in range(15):
+            dia = hoje + timedelta(days=aleatorio.randrange(14))
+            inicio = _aware(dia, aleatorio.randrange(6, 20), aleatorio.choice([0, 10, 30, 45]))
+            fim = inicio + timedelta(minutes=aleatorio.choice([20, 30, 60]))
+            # a constraint de sobreposição recusaria consultas ativas que se cruzam
+            if not Consulta.objects.filter(medico=medico, periodo__overlap=(inicio, fim)).exists():
+                Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=inicio, data_hora_fim=fim)
+        for _ in range(3):
+            inicio = _aware(hoje + timedelta(days=aleatorio.randrange(14)), aleatorio.randrange(0, 22))
+            ExcecaoHorario.objects.create(
+                medico=medico,
+                data_inicio=inicio,
+                data_fim=inicio + timedelta(minutes=aleatorio.randrange(30, 26 * 60, 15)),
+                esta_bloqueado=aleatorio.random() < 0.5,
+                motivo="Aleatório",
+            )
+    return medicos
+
+
+@pytest.mark.django_db
+def test_motor_bitmap_equivale_ao_calcular_slots_disponiveis():
+    medicos = _popular_agendas_aleatorias()
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        for medico in medicos:
+            assert calcular_slots_disponiveis_bitmap(medico.pk, 14) == calcular_slots_disponiveis(medico.pk, 14)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("semente", [1, 42, 2024])
+def test_backend_postgres_equivale_ao_motor_python(semente, settings):
+    medicos = _popular_agendas_aleatorias(semente)
+    ids = [medico.pk for medico in medicos]
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        settings.CONSULTAS_SLOTS_BACKEND = "python"
+        esperado = calcular_slots_disponiveis_lote(ids, dias_a_frente=14)
+        assert any(esperado.values())
+
+        settings.CONSULTAS_SLOTS_BACKEND = "postgres"
+        assert calcular_slots_disponiveis_lote(ids, dias_a_frente=14) == esperado
+        assert calcular_slots_disponiveis(ids[0], 14) == esperado[ids[0]]
+
+
+@pytest.mark.django_db
+def test_proximos_slots_livres_intercala_medicos_em_ordem(client):
+    medicos = _popular_agendas_aleatorias(semente=7)
+    ids = [medico.pk for medico in medicos]
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        todos = sorted(
+            (datetime.fromisoformat(slot), medico_id)
+            for medico_id, dias in calcular_slots_disponiveis_lote(ids, dias_a_frente=14).items()
+            for slots in dias.values()
+            for slot in slots
+        )
+        assert proximos_slots_livres(10, medico_ids=ids) == [(medico_id, slot) for slot, medico_id in todos[:10]]
+
+        apos = _aware(AGORA.date() + timedelta(days=3), 0)
+        depois = [(medico_id, slot) for slot, medico_id in todos if slot >= apos][:5]
+        assert proximos_slots_livres(5, medico_ids=ids, apos=apos) == depois
+
+    url = reverse("api_proximos_slots")
+    medicos_param = ",".join(map(str, ids))
+    assert client.get(url, {"medicos": medicos_param, "dias_apos": "3"}).status_code == 200
+    assert client.get(url, {"medicos": medicos_param, "dias_apos": "10" * 20}).status_code == 400
+    assert client.get(url, {"medicos": medicos_param, "dias_apos": "-1"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_agenda_paginada_percorre_o_horizonte_com_cursor(client):
+    medico = _criar_medico()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(9))
+    url = reverse("api_agenda_medico_paginada", args=[medico.pk])
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        esperado = calcular_slots_disponiveis(medico.pk, dias_a_frente=180)
+        paginas = {}
+        params = {"dias": 180, "pagina": 4}
+        while True:
+            resposta = client.get(url, params).json()
+            assert len(resposta["dias"]) <= 4
+            paginas.update(resposta["dias"])
+            if not resposta["cursor"]:
+                break
+            params = {"cursor": resposta["cursor"], "ate": resposta["ate"], "pagina": 4}
+
+    assert paginas == esperado
+    assert len(paginas) == 26
+
+
+@pytest.mark.django_db
+def test_ajax_horarios_disponiveis_concorda_com_calcular_slots(client):
+    medicos = _popular_agendas_aleatorias(semente=3, quantidade=2)
+    admin = Usuario.objects.create_user(username="admin", cpf="00000000000", nome_completo="Admin", tipo="admin")
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(admin)
+        for medico in medicos:
+            esperado = calcular_slots_disponiveis(medico.pk, dias_a_frente=7)
+            for i in range(7):
+                dia = AGORA.date() + timedelta(days=i)
+                resposta = client.get(
+                    reverse("ajax_horarios_disponiveis"), {"medico": medico.pk, "data": dia.isoformat()}
+                )
+                slots = [
+                    timezone.make_aware(datetime.fromisoformat(slot)).isoformat() for slot in resposta.json()["slots"]
+                ]
+                assert slots == esperado.get(dia.isoformat(), [])
+
+
+@pytest.mark.django_db
+def test_benchmark_slots_grava_json_e_descarta_dados(tmp_path):
+    saida = tmp_path / "benchmark.json"
+
+    call_command(
+        "benchmark_slots",
+        "--medicos=3",
+        "--excecoes=2",
+        "--horizontes", "7", "14",
+        "--repeticoes=3",
+        f"--saida={saida}",
+        stdout=StringIO(),
+    )
+
+    resultado = json.loads(saida.read_text(encoding="utf-8"))
+    linhas = {(linha["funcao"], linha["horizonte_dias"]): linha for linha in resultado["resultados"]}
+    assert set(linhas) == {
+        (funcao, horizonte)
+        for funcao in ("calcular_slots_disponiveis", "checar_conflito_consulta", "gerar_horarios_disponiveis")
+        for horizonte in (7, 14)
+    }
+    assert all(linha["chamadas"] == 3 and linha["p50_ms"] <= linha["p99_ms"] for linha in linhas.values())
+    assert linhas[("calcular_slots_disponiveis", 7)]["queries_max"] == 3
+    assert not Medico.objects.exists() and not Consulta.objects.exists()
+
+
+@pytest.mark.django_db
+def test_benchmark_slots_aceita_o_maximo_de_turnos(tmp_path):
+    saida = tmp_path / "benchmark.json"
+
+    call_command(
+        "benchmark_slots",
+        "--medicos=1",
+        "--excecoes=0",
+        f"--turnos={MAX_TURNOS_POR_DIA}",
+        "--horizontes", "7",
+        "--repeticoes=1",
+        f"--saida={saida}",
+        stdout=StringIO(),
+    )
+
+    assert json.loads(saida.read_text(encoding="utf-8"))["resultados"]
+    with pytest.raises(CommandError):
+        call_command("benchmark_slots", f"--turnos={MAX_TURNOS_POR_DIA + 1}", stdout=StringIO())
+
+
+@pytest.mark.django_db
+def test_constraint_impede_consultas_ativas_sobrepostas():
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    dia = AGORA.date() + timedelta(days=1)
+    # sem data_hora_fim a consulta ocupa um slot
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 10))
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Consulta.objects.create(
+            medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 10, 15), data_hora_fim=_aware(dia, 10, 45)
+        )
+
+    # consultas concluídas não ocupam a agenda
+    Consulta.objects.create(
+        medico=medico,
+        paciente=paciente,
+        data_hora_inicio=_aware(dia, 10, 15),
+        data_hora_fim=_aware(dia, 10, 45),
+        status="concluida",
+    )
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 10, 30))
+    assert Consulta.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_agendar_consulta_so_traduz_violacoes_de_horario_em_conflito():
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    dia = AGORA.date() + timedelta(days=1)
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 10))
+
+    class Formulario:
+        def __init__(self, hora, salvar):
+            self.instance = Consulta(
+                medico=medico,
+                paciente=paciente,
+                data_hora_inicio=_aware(dia, hora),
+                data_hora_fim=_aware(dia, hora, 30),
+            )
+            self.save = salvar
+
+    # gravação concorrente que passou pela checagem: a constraint vira a mensagem de conflito
+    sobreposta = Formulario(
+        10, lambda: Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 10))
+    )
+    with mock.patch("consultas.agendamento.checar_conflito_consulta", return_value=False):
+        with pytest.raises(ValidationError, match="acabou de ser ocupado"):
+            agendar_consulta(sobreposta)
+
+    # qualquer outra violação é um erro de verdade e não pode ser mascarada
+    duplicado = Formulario(11, lambda: Usuario.objects.create(username=paciente.usuario.username, cpf="33333333333"))
+    with pytest.raises(IntegrityError):
+        agendar_consulta(duplicado)
+
+
+@pytest.mark.django_db
+def test_checar_conflito_consulta_usa_uma_query(django_assert_num_queries):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    dia = AGORA.date() + timedelta(days=1)
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 10))
+    ExcecaoHorario.objects.create(medico=medico, data_inicio=_aware(dia, 14), data_fim=_aware(dia, 15), motivo="Folga")
+    calendario_clinica.fechamentos(AGORA, AGORA)  # calendário da clínica já carregado no processo
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA), django_assert_num_queries(1):
+        assert checar_conflito_consulta(medico.pk, _aware(dia, 10, 15), _aware(dia, 10, 45))
+    with mock.patch("django.utils.timezone.now", return_value=AGORA), django_assert_num_queries(1):
+        assert checar_conflito_consulta(medico.pk, _aware(dia, 14, 30), _aware(dia, 15))
+    with mock.patch("django.utils.timezone.now", return_value=AGORA), django_assert_num_queries(1):
+        assert not checar_conflito_consulta(medico.pk, _aware(dia, 10, 30), _aware(dia, 11))
+
+
+@pytest.mark.django_db
+def test_agendamento_simultaneo_vira_erro_do_formulario(client):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    inicio = _aware(AGORA.date() + timedelta(days=1), 9)
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=inicio - timedelta(minutes=15))
+
+    # simula a corrida: o outro agendamento foi gravado depois da validação do form
+    with mock.patch("django.utils.timezone.now", return_value=AGORA), mock.patch(
+        "consultas.forms.checar_conflito_consulta", return_value=False
+    ):
+        client.force_login(atendente)
+        resposta = client.post(
+            reverse("agendar_consulta_por_medico", args=[medico.pk]),
+            {
+                "paciente": paciente.pk,
+                "medico": medico.pk,
+                "data_hora_inicio": inicio.isoformat(),
+                "status": "agendada",
+            },
+        )
+
+    assert resposta.status_code == 200
+    assert "acabou de ser ocupado" in str(resposta.context["form"].non_field_errors())
+    assert Consulta.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_mixin_sem_conflito_so_trata_violacoes_de_horario():
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    inicio = _aware(AGORA.date() + timedelta(days=1), 9)
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=inicio)
+
+    class Base:
+        def __init__(self, gravar):
+            self.gravar = gravar
+
+        def form_valid(self, form):
+            self.gravar()
+
+        def form_invalid(self, form):
+            return "form_invalid"
+
+    class Visao(AgendamentoSemConflitoMixin, Base):
+        pass
+
+    form = mock.Mock()
+    sobreposta = Visao(lambda: Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=inicio))
+    assert sobreposta.form_valid(form) == "form_invalid"
+    form.add_error.assert_called_once_with(None, MENSAGEM_CONFLITO)
+
+    duplicado = Visao(lambda: Usuario.objects.create(username=paciente.usuario.username, cpf="33333333333"))
+    with pytest.raises(IntegrityError):
+        duplicado.form_valid(form)
+
+
+@pytest.mark.django_db
+def test_reenvio_do_agendamento_devolve_a_consulta_original(client):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    metricas_trava.limpar()
+    dados = {
+        "paciente": paciente.pk,
+        "medico": medico.pk,
+        "data_hora_inicio": _aware(AGORA.date() + timedelta(days=1), 9).isoformat(),
+        "status": "agendada",
+        "chave_idempotencia": "6f1c2a9e-5b7d-4c3e-9a1f-2d8e4b6c0a13",
+    }
+    url = reverse("agendar_consulta_por_medico", args=[medico.pk])
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(atendente)
+        primeira = client.post(url, dados)
+        segunda = client.post(url, dados)
+
+    assert primeira.status_code == segunda.status_code == 302
+    assert primeira["Location"] == segunda["Location"] == reverse("listar_consultas")
+    consulta = Consulta.objects.get()
+    assert str(consulta.submissao.chave) == dados["chave_idempotencia"]
+    assert estatisticas_travas()[medico.pk]["aquisicoes"] == 1
+
+
+def _planos_sem_seq_scan(queries):
+    """Roda EXPLAIN em cada SQL capturado com seq scan desligado; retorna os planos que ainda usam Seq Scan."""
+    com_seq_scan = []
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        for query in queries:
+            cursor.execute(f"EXPLAIN {query['sql']}")
+            plano = "\n".join(linha for (linha,) in cursor.fetchall())
+            if "Seq Scan" in plano:
+                com_seq_scan.append(f"{query['sql']}\n{plano}")
+    return com_seq_scan
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("backend", ["python", "postgres"])
+def test_queries_da_agenda_usam_indices(backend, settings):
+    settings.CONSULTAS_SLOTS_BACKEND = backend
+    medicos = _popular_agendas_aleatorias(semente=7, quantidade=3)
+    paciente = Paciente.objects.get()
+    dia = AGORA.date() + timedelta(days=2)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    # o calendário da clínica é lido inteiro uma vez por processo; fica fora da medição
+    calendario_clinica.fechamentos(AGORA, AGORA)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA), CaptureQueriesContext(connection) as capturadas:
+        calcular_slots_disponiveis(medicos[0].pk, dias_a_frente=14)
+        calcular_slots_disponiveis_lote([medico.pk for medico in medicos], dias_a_frente=7)
+        slots_do_dia(medicos[1].pk, dia)
+        checar_conflito_consulta(medicos[2].pk, _aware(dia, 10), _aware(dia, 10, 30))
+        list(Consulta.objects.order_by("-data_hora_inicio")[:20])
+        list(Consulta.objects.filter(medico=medicos[0]).order_by("-data_hora_inicio")[:20])
+        list(Consulta.objects.filter(paciente=paciente).order_by("data_hora_inicio"))
+        list(HorarioTrabalho.objects.filter(medico=medicos[0]).order_by("dia_semana", "hora_inicio"))
+
+    assert len(capturadas) >= 8
+    assert _planos_sem_seq_scan(capturadas.captured_queries) == []
+
+
+@pytest.mark.django_db
+def test_serie_semanal_agenda_datas_livres_e_informa_falhas(
+    django_assert_max_num_queries, django_capture_on_commit_callbacks
+):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    terca = AGORA.date() + timedelta(days=1)
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca + timedelta(days=7), 9))
+    ExcecaoHorario.objects.create(
+        medico=medico,
+        data_inicio=_aware(terca + timedelta(days=21), 0),
+        data_fim=_aware(terca + timedelta(days=22), 0),
+        motivo="Congresso",
+    )
+    versao = versao_agenda(medico.pk)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        with django_assert_max_num_queries(8), django_capture_on_commit_callbacks(execute=False):
+            criadas, falhas = agendar_serie(medico.pk, paciente.pk, _aware(terca, 9), intervalo_dias=7, ocorrencias=5)
+
+    assert [timezone.localtime(c.data_hora_inicio).date() for c in criadas] == [
+        terca, terca + timedelta(days=14), terca + timedelta(days=28)
+    ]
+    assert [(timezone.localtime(inicio).date(), motivo) for inicio, motivo in falhas] == [
+        (terca + timedelta(days=7), "conflito com outra consulta ou bloqueio"),
+        (terca + timedelta(days=21), "conflito com outra consulta ou bloqueio"),
+    ]
+    assert Consulta.objects.filter(retorno=True).count() == 3
+    assert versao_agenda(medico.pk) != versao
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("backend", ["python", "postgres"])
+def test_feriado_da_clinica_fecha_a_agenda_de_todos_os_medicos(backend, settings, django_capture_on_commit_callbacks):
+    settings.CONSULTAS_SLOTS_BACKEND = backend
+    medicos = [_criar_medico(cpf=f"{i:011d}") for i in range(1, 3)]
+    for medico in medicos:
+        HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(10))
+        HorarioTrabalho.objects.create(medico=medico, dia_semana=3, hora_inicio=time(8), hora_fim=time(10))
+    terca = AGORA.date() + timedelta(days=1)
+    quarta = terca + timedelta(days=1)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        assert terca.isoformat() in obter_slots_disponiveis(medicos[0].pk)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            feriado = FeriadoClinica.objects.create(
+                descricao="Feriado municipal", data_inicio=_aware(terca, 0), data_fim=_aware(quarta, 9)
+            )
+        assert FeriadoClinica.objects.count() == 1
+
+        for medico in medicos:
+            # o cache em memória foi invalidado pela versão do calendário
+            slots = obter_slots_disponiveis(medico.pk)
+            assert terca.isoformat() not in slots
+            assert slots[quarta.isoformat()] == [_aware(quarta, 9).isoformat(), _aware(quarta, 9, 30).isoformat()]
+        assert checar_conflito_consulta(medicos[1].pk, _aware(terca, 8), _aware(terca, 8, 30))
+        assert not checar_conflito_consulta(medicos[1].pk, _aware(quarta, 9), _aware(quarta, 9, 30))
+
+        feriado.delete()
+        assert terca.isoformat() in obter_slots_disponiveis(medicos[0].pk)
+
+
+@pytest.mark.django_db
+def test_bloqueio_novo_remarca_consultas_afetadas_com_previa(client, django_capture_on_commit_callbacks):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    terca = AGORA.date() + timedelta(days=1)
+    afetadas = [
+        Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, hora, minuto))
+        for hora, minuto in [(8, 0), (8, 30), (10, 0)]
+    ]
+    Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, 11, 30))
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(medico.usuario)
+        resposta = client.post(
+            reverse("adicionar_excecao"),
+            {
+                "data_inicio": f"{terca}T07:00",
+                "data_fim": f"{terca}T11:00",
+                "esta_bloqueado": "True",
+                "motivo": "Cirurgia",
+            },
+        )
+        excecao = ExcecaoHorario.objects.get()
+        assert resposta["Location"] == reverse("remarcar_consultas", args=[excecao.pk])
+
+        previa = client.get(resposta["Location"])
+        propostas = previa.context["propostas"]
+        # um só slot livre depois do bloqueio no mesmo dia; o resto vai para a semana seguinte
+        assert [inicio for _, inicio in propostas] == [
+            _aware(terca, 11), _aware(terca + timedelta(days=7), 8), _aware(terca + timedelta(days=7), 8, 30)
+        ]
+        assert [consulta.pk for consulta, _ in propostas] == [consulta.pk for consulta in afetadas]
+
+        dados = {f"consulta_{consulta.pk}": inicio.isoformat() for consulta, inicio in propostas}
+        for campo, valor in dados.items():
+            assert f'name="{campo}" value="{valor}"' in previa.content.decode()
+        adulterado = client.post(resposta["Location"], {**dados, "consulta_abc": ""})
+        assert adulterado.status_code == 400
+        assert adulterado.context["propostas"] == propostas
+        with django_capture_on_commit_callbacks(execute=True):
+            confirmacao = client.post(resposta["Location"], dados)
+
+    assert confirmacao["Location"] == reverse("gerenciar_agenda")
+    remarcadas = Consulta.objects.filter(pk__in=[consulta.pk for consulta in afetadas]).order_by("data_hora_inicio")
+    assert [consulta.data_hora_inicio for consulta in remarcadas] == [inicio for _, inicio in propostas]
+
+
+@pytest.mark.django_db
+def test_alteracao_de_horario_mostra_consultas_orfas_antes_de_salvar(client, django_assert_num_queries):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    manha = HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    tarde = HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(14), hora_fim=time(16))
+    terca = AGORA.date() + timedelta(days=1)
+    for hora, minuto in [(9, 0), (11, 0), (11, 30), (14, 30)]:
+        Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, hora, minuto))
+    Consulta.objects.create(
+        medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, 10, 30), status="concluida"
+    )
+    # 11:00-11:30 continua coberta por uma disponibilidade extra
+    ExcecaoHorario.objects.create(
+        medico=medico,
+        data_inicio=_aware(terca, 11),
+        data_fim=_aware(terca, 11, 30),
+        esta_bloqueado=False,
+        motivo="Extra",
+    )
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        proposto = HorarioTrabalho(pk=manha.pk, medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(11))
+        with django_assert_num_queries(1):
+            orfas = list(consultas_orfas(manha, proposto))
+        assert [timezone.localtime(c.data_hora_inicio).time() for c in orfas] == [time(11, 30)]
+        assert [timezone.localtime(c.data_hora_inicio).time() for c in consultas_orfas(tarde)] == [time(14, 30)]
+
+        client.force_login(medico.usuario)
+        url = reverse("editar_horario", args=[manha.pk])
+        dados = {"medico": medico.pk, "dia_semana": 2, "hora_inicio": "08:00", "hora_fim": "11:00"}
+        previa = client.post(url, dados)
+        assert previa.status_code == 200
+        assert [c.pk for c in previa.context["consultas_orfas"]] == [c.pk for c in orfas]
+        manha.refresh_from_db()
+        assert manha.hora_fim == time(12)
+
+        assert 'name="confirmar_impacto" value="2|08:00|11:00"' in previa.content.decode()
+
+        # confirmação de outra versão do formulário: o impacto é checado de novo
+        alterado = {**dados, "hora_fim": "09:00", "confirmar_impacto": "2|08:00|11:00"}
+        segunda_previa = client.post(url, alterado)
+        assert segunda_previa.status_code == 200
+        assert len(segunda_previa.context["consultas_orfas"]) == 2
+        manha.refresh_from_db()
+        assert manha.hora_fim == time(12)
+
+        confirmacao = client.post(url, {**dados, "confirmar_impacto": "2|08:00|11:00"})
+        assert confirmacao["Location"] == reverse("gerenciar_agenda")
+        manha.refresh_from_db()
+        assert manha.hora_fim == time(11)
+
+
+@pytest.mark.django_db
+def test_cancelamento_libera_o_horario_e_mantem_o_registro(client):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    terca = AGORA.date() + timedelta(days=1)
+    consulta = Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, 9))
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        livres = calcular_slots_disponiveis(medico.pk, dias_a_frente=2)[terca.isoformat()]
+        assert _aware(terca, 9).isoformat() not in livres
+        client.force_login(paciente.usuario)
+        resposta = client.post(reverse("cancelar_consulta", args=[consulta.pk]))
+        assert resposta["Location"] == reverse("minhas_consultas_paciente")
+        consulta.refresh_from_db()
+        assert consulta.status == "cancelada"
+        assert _aware(terca, 9).isoformat() in calcular_slots_disponiveis(medico.pk, dias_a_frente=2)[terca.isoformat()]
+        assert not checar_conflito_consulta(medico.pk, _aware(terca, 9), _aware(terca, 9, 30))
+
+    # a unicidade (médico, início) vale só para consultas ativas: o horário cancelado é reservado de novo
+    nova = Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, 9))
+    with pytest.raises(IntegrityError), transaction.atomic():
+        Consulta.objects.create(
+            medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, 9), status="confirmada"
+        )
+
+    # estados finais não voltam atrás; confirmada pode ser concluída
+    assert not consulta.pode_mudar_para("agendada")
+    nova.status = "confirmada"
+    nova.save()
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(medico.usuario)
+        client.post(reverse("marcar_concluida", args=[nova.pk]))
+        client.post(reverse("cancelar_consulta", args=[nova.pk]))
+    nova.refresh_from_db()
+    assert nova.status == "concluida"
+    assert Consulta.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_indice_parcial_cobre_so_consultas_ativas():
+    medicos = _popular_agendas_aleatorias(semente=11, quantidade=2)
+    canceladas = list(Consulta.objects.order_by("pk").values_list("pk", flat=True))[::2]
+    Consulta.objects.filter(pk__in=canceladas).update(status="cancelada")
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    ocupadas = Consulta.objects.filter(
+        medico=medicos[0], status__in=["agendada", "confirmada"], data_hora_inicio__lt=AGORA + timedelta(days=7)
+    ).values_list("data_hora_inicio", "data_hora_fim")
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        sql, params = ocupadas.query.sql_with_params()
+        cursor.execute(f"EXPLAIN {sql}", params)
+        plano = "\n".join(linha for (linha,) in cursor.fetchall())
+    # consulta_ativa_medico_idx ou o índice da unicidade parcial: ambos só têm consultas ativas
+    assert "consulta_ativa_medico" in plano
+
+
+@pytest.mark.django_db
+def test_verificar_agendas_relata_e_corrige_inconsistencias(tmp_path):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    terca = AGORA.date() + timedelta(days=1)
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(11), hora_fim=time(14))
+    ExcecaoHorario.objects.create(
+        medico=medico, data_inicio=_aware(terca, 10), data_fim=_aware(terca, 11), motivo="Reunião"
+    )
+    with connection.cursor() as cursor:
+        # dados anteriores à constraint de sobreposição
+        cursor.execute("ALTER TABLE consultas_consulta DROP CONSTRAINT consulta_sem_sobreposicao")
+    for hora, minuto in [(9, 0), (9, 15), (10, 30), (12, 30), (15, 0)]:
+        Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, hora, minuto))
+    Consulta.objects.filter(data_hora_inicio=_aware(terca, 12, 30)).update(data_hora_fim=None)
+
+    saida = tmp_path / "consistencia.json"
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        call_command("verificar_agendas", "--corrigir", "--saida", str(saida), stdout=StringIO())
+        depois = verificar_consistencia()
+
+    relatorio = json.loads(saida.read_text(encoding="utf-8"))
+    assert {nome: item["total"] for nome, item in relatorio.items()} == {
+        "consultas_sobrepostas": 1,
+        "fora_do_expediente": 1,
+        "em_bloqueio": 1,
+        "turnos_sobrepostos": 1,
+        "sem_fim": 1,
+    }
+    sobreposta = relatorio["consultas_sobrepostas"]["amostra"][0]
+    assert sobreposta["anterior_id"] == Consulta.objects.get(data_hora_inicio=_aware(terca, 9)).pk
+
+    # só o que tem correção óbvia é resolvido
+    assert {nome: item["total"] for nome, item in depois.items() if item["total"]} == {
+        "consultas_sobrepostas": 1,
+        "fora_do_expediente": 1,
+        "em_bloqueio": 1,
+    }
+    assert list(HorarioTrabalho.objects.values_list("hora_inicio", "hora_fim")) == [(time(8), time(14))]
+    assert Consulta.objects.get(data_hora_inicio=_aware(terca, 12, 30)).data_hora_fim == _aware(terca, 13)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("backend", ["python", "postgres"])
+def test_reserva_temporaria_segura_o_slot_ate_agendar_ou_vencer(backend, settings, client):
+    settings.CONSULTAS_SLOTS_BACKEND = backend
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    atendentes = [
+        Usuario.objects.create_user(
+            username=f"atendente{i}", cpf=f"3333333333{i}", nome_completo="Atendente", tipo="atendente"
+        )
+        for i in range(2)
+    ]
+    terca = AGORA.date() + timedelta(days=1)
+    inicio = _aware(terca, 9)
+    url = reverse("agendar_consulta_por_medico", args=[medico.pk])
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(atendentes[0])
+        primeira = client.get(url, {"slot": inicio.isoformat()})
+        reserva = ReservaSlot.objects.get()
+        assert primeira.context["form"].initial["chave_idempotencia"] == reserva.chave
+        assert inicio.isoformat() not in calcular_slots_disponiveis(medico.pk, dias_a_frente=2)[terca.isoformat()]
+        # para o próprio formulário o slot reservado continua livre
+        assert inicio.isoformat() in primeira.context["slots_disponiveis"][terca.isoformat()]
+        livres = calcular_slots_disponiveis(medico.pk, dias_a_frente=2, chave_reserva=reserva.chave)
+        assert inicio.isoformat() in livres[terca.isoformat()]
+
+        client.force_login(atendentes[1])
+        segunda = client.get(url, {"slot": inicio.isoformat()})
+        assert segunda.context["reserva"] is None
+        assert ReservaSlot.objects.count() == 1
+
+        # o formulário dono da reserva agenda normalmente e a reserva vira a consulta
+        client.force_login(atendentes[0])
+        resposta = client.post(
+            url,
+            {
+                "paciente": paciente.pk,
+                "medico": medico.pk,
+                "data_hora_inicio": inicio.isoformat(),
+                "status": "agendada",
+                "chave_idempotencia": str(reserva.chave),
+            },
+        )
+    assert resposta.status_code == 302
+    assert Consulta.objects.get().data_hora_inicio == inicio
+    assert not ReservaSlot.objects.exists()
+
+    # reserva vencida não ocupa o slot e é apagada pelo comando de limpeza
+    outro = _aware(terca, 10)
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        assert reservar_slot(medico.pk, outro) is not None
+        assert outro.isoformat() not in calcular_slots_disponiveis(medico.pk, dias_a_frente=2)[terca.isoformat()]
+    depois = AGORA + timedelta(minutes=settings.CONSULTAS_RESERVA_MINUTOS + 1)
+    with mock.patch("django.utils.timezone.now", return_value=depois):
+        assert not checar_conflito_consulta(medico.pk, outro, outro + timedelta(minutes=30))
+        call_command("liberar_reservas_slot", stdout=StringIO())
+        assert outro.isoformat() in calcular_slots_disponiveis(medico.pk, dias_a_frente=2)[terca.isoformat()]
+    assert not ReservaSlot.objects.exists()
+
+
+@pytest.mark.django_db
+def test_pagina_de_agendamento_com_reserva_usa_o_cache(client):
+    medico = _criar_medico()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    terca = AGORA.date() + timedelta(days=1)
+    inicio = _aware(terca, 9)
+    url = reverse("agendar_consulta_por_medico", args=[medico.pk])
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(atendente)
+        # sem cache: calcula ignorando a reserva do próprio formulário
+        primeira = client.get(url, {"slot": inicio.isoformat()})
+        reserva = ReservaSlot.objects.get()
+        assert inicio.isoformat() in primeira.context["slots_disponiveis"][terca.isoformat()]
+
+        with mock.patch("consultas.cache.calcular_slots_disponiveis", wraps=calcular_slots_disponiveis) as calcular:
+            # reabrir o mesmo slot renova a reserva e não invalida a agenda
+            recarregada = client.get(url, {"slot": inicio.isoformat()})
+            # outro slot: a reserva anterior é liberada, mas a nova não troca a versão de novo
+            client.get(url, {"slot": _aware(terca, 10).isoformat()})
+            client.get(url, {"slot": _aware(terca, 10).isoformat()})
+        assert calcular.call_count == 1
+        assert recarregada.context["reserva"].chave == reserva.chave
+        assert inicio.isoformat() in recarregada.context["slots_disponiveis"][terca.isoformat()]
+        assert list(ReservaSlot.objects.values_list("data_hora_inicio", flat=True)) == [_aware(terca, 10)]
+
+
+@pytest.mark.django_db
+def test_slot_reservado_volta_ao_cache_quando_a_reserva_vence(settings):
+    medico = _criar_medico()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    terca = AGORA.date() + timedelta(days=1)
+    inicio = _aware(terca, 9)
+    cache_slots = CacheSlots()
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        reserva = reservar_slot(medico.pk, inicio)
+        assert inicio.isoformat() not in cache_slots.obter(medico.pk, 2)[terca.isoformat()]
+    depois = AGORA + timedelta(minutes=settings.CONSULTAS_RESERVA_MINUTOS + 1)
+    with mock.patch("django.utils.timezone.now", return_value=depois):
+        # sem o comando de limpeza: a entrada do cache vence junto com a reserva
+        assert inicio.isoformat() in cache_slots.obter(medico.pk, 2)[terca.isoformat()]
+        # a próxima reserva do médico apaga as vencidas
+        reservar_slot(medico.pk, _aware(terca, 10))
+    assert list(ReservaSlot.objects.values_list("data_hora_inicio", flat=True)) == [_aware(terca, 10)]
+    assert not ReservaSlot.objects.filter(chave=reserva.chave).exists()
+
+
+@pytest.mark.django_db
+def test_serie_aberta_a_partir_do_agendamento_usa_a_propria_reserva(client):
+    medico = _criar_medico()
+    paciente = _criar_paciente()
+    HorarioTrabalho.objects.create(medico=medico, dia_semana=2, hora_inicio=time(8), hora_fim=time(12))
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    terca = AGORA.date() + timedelta(days=1)
+    inicio = _aware(terca, 9)
+
+    with mock.patch("django.utils.timezone.now", return_value=AGORA):
+        client.force_login(atendente)
+        client.get(reverse("agendar_consulta_por_medico", args=[medico.pk]), {"slot": inicio.isoformat()})
+        assert ReservaSlot.objects.count() == 1
+        resposta = client.post(
+            reverse("agendar_serie_consultas", args=[medico.pk]),
+            {
+                "paciente": paciente.pk,
+                "data_hora_inicio": inicio.isoformat(),
+                "frequencia": "semanal",
+                "ocorrencias": 2,
+                "retorno": "on",
+            },
+        )
+    assert resposta.status_code == 302
+    assert list(Consulta.objects.order_by("data_hora_inicio").values_list("data_hora_inicio", flat=True)) == [
+        inicio, inicio + timedelta(days=7)
+    ]
+    assert not ReservaSlot.objects.exists()
+    assert "reserva_slot" not in client.session
+
+
+@pytest.mark.django_db
+def test_busca_de_pacientes_paginada_por_nome_ou_cpf(client):
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    for i in range(25):
+        usuario = Usuario.objects.create_user(
+            username=f"ana{i}", cpf=f"123{i:08d}", nome_completo=f"Ana Paciente {i:02d}", tipo="paciente"
+        )
+        Paciente.objects.create(usuario=usuario)
+    _criar_paciente(cpf="98765432100")
+    # cadastro manual grava o CPF como digitado
+    _criar_paciente(cpf="456.789.123-00")
+    url = reverse("api_pacientes_autocomplete")
+
+    assert client.get(url, {"q": "an"}).status_code == 302  # sem login
+    client.force_login(atendente)
+    primeira = client.get(url, {"q": "aNA p"}).json()
+    segunda = client.get(url, {"q": "aNA p", "pagina": 2}).json()
+    assert len(primeira["resultados"]) == 20 and primeira["tem_mais"]
+    assert [p["nome"] for p in segunda["resultados"]] == [f"Ana Paciente {i:02d}" for i in range(20, 25)]
+    assert not segunda["tem_mais"]
+    assert [p["cpf"] for p in client.get(url, {"q": "987.654"}).json()["resultados"]] == ["98765432100"]
+    assert [p["cpf"] for p in client.get(url, {"q": "4567891"}).json()["resultados"]] == ["456.789.123-00"]
+    assert client.get(url, {"q": "a"}).json()["resultados"] == []
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    with CaptureQueriesContext(connection) as capturadas:
+        client.get(url, {"q": "ana"})
+        client.get(url, {"q": "1230000"})
+    buscas = [query for query in capturadas.captured_queries if "LIKE" in query["sql"]]
+    assert len(buscas) == 2
+    assert _planos_sem_seq_scan(buscas) == []
+
+
+@pytest.mark.django_db
+def test_pagina_de_agendamento_nao_lista_pacientes(client):
+    medico = _criar_medico()
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    url = reverse("agendar_consulta_por_medico", args=[medico.pk])
+
+    def queries_da_pagina():
+        with mock.patch("django.utils.timezone.now", return_value=AGORA):
+            client.force_login(atendente)
+            with CaptureQueriesContext(connection) as capturadas:
+                assert client.get(url).status_code == 200
+        return len(capturadas)
+
+    _criar_paciente()
+    queries_da_pagina()  # slots do médico já em cache nas duas medições
+    com_um = queries_da_pagina()
+    for i in range(30):
+        _criar_paciente(cpf=f"5{i:010d}")
+    assert queries_da_pagina() == com_um
+
+
+@pytest.mark.django_db
+def test_listagem_pagina_por_cursor_sem_repetir_consultas(client):
+    admin = Usuario.objects.create_user(username="admin", cpf="00000000000", nome_completo="Admin", tipo="admin")
+    medicos = [_criar_medico(cpf=f"1111111111{i}") for i in range(3)]
+    paciente = _criar_paciente()
+    terca = AGORA.date() + timedelta(days=1)
+    # os três médicos atendem nos mesmos horários: o id desempata o cursor
+    for hora in range(8, 17):
+        for medico in medicos:
+            Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(terca, hora))
+    esperado = list(Consulta.objects.order_by("-data_hora_inicio", "-pk").values_list("pk", flat=True))
+
+    client.force_login(admin)
+    url = reverse("listar_consultas")
+    vistos, paginas, params = [], [], {}
+    with mock.patch("consultas.paginacao.CONSULTAS_CONTAGEM_MAXIMA", 20):
+        while True:
+            pagina = client.get(url, params).context["page_obj"]
+            paginas.append(pagina)
+            vistos += [consulta.pk for consulta in pagina]
+            if not pagina.has_next():
+                break
+            params = {"apos": pagina.cursor_proximo}
+    assert vistos == esperado
+    assert len(paginas) == 3 and not paginas[0].has_previous()
+    assert (paginas[0].total, paginas[0].total_limitado) == (20, True)
+
+    # voltando da última página chega-se à do meio, com os mesmos itens
+    anterior = client.get(url, {"antes": paginas[-1].cursor_anterior}).context["page_obj"]
+    assert [c.pk for c in anterior] == [c.pk for c in paginas[1]]
+    assert anterior.has_previous() and anterior.has_next()
+    # filtro por médico e cursor inválido (volta à primeira página)
+    filtradas = client.get(url, {"medico": medicos[1].pk, "apos": "lixo"}).context["page_obj"]
+    assert [c.medico_id for c in filtradas] == [medicos[1].pk] * 9 and not filtradas.has_next()
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    with CaptureQueriesContext(connection) as capturadas:
+        client.get(url, {"apos": paginas[1].cursor_proximo})
+    assert "OFFSET" not in " ".join(query["sql"] for query in capturadas.captured_queries)
+    listagem = [query for query in capturadas.captured_queries if "ORDER BY" in query["sql"]]
+    assert _planos_sem_seq_scan(listagem) == []
+
+
+@pytest.mark.django_db
+def test_exportacao_csv_usa_os_filtros_da_listagem(client):
+    admin = Usuario.objects.create_user(username="admin", cpf="00000000000", nome_completo="Admin", tipo="admin")
+    cardiologia = Especialidade.objects.create(nome="Cardiologia")
+    cardiologista = _criar_medico(cpf="11111111110", especialidade=cardiologia)
+    clinico = _criar_medico(cpf="11111111111")
+    paciente = _criar_paciente()
+    terca = AGORA.date() + timedelta(days=1)
+    for dia in (terca, terca + timedelta(days=7)):
+        for medico in (cardiologista, clinico):
+            Consulta.objects.create(medico=medico, paciente=paciente, data_hora_inicio=_aware(dia, 9))
+    Consulta.objects.filter(medico=clinico, data_hora_inicio=_aware(terca, 9)).update(status="cancelada")
+
+    client.force_login(admin)
+    url = reverse("exportar_consultas")
+
+    def exportar(**filtros):
+        resposta = client.get(url, filtros)
+        assert resposta.streaming and resposta["Content-Type"].startswith("text/csv")
+        conteudo = b"".join(resposta.streaming_content).decode("utf-8-sig")
+        cabecalho, *linhas = list(csv.reader(StringIO(conteudo), delimiter=";"))
+        assert cabecalho[:4] == ["ID", "Início", "Fim", "Status"]
+        return linhas
+
+    todas = exportar()
+    assert len(todas) == 4
+    assert todas[-1][1:9] == [
+        f"{terca:%d/%m/%Y} 09:00", f"{terca:%d/%m/%Y} 09:30", "Agendada", "Não",
+        paciente.usuario.nome_completo, paciente.usuario.cpf, cardiologista.usuario.nome_completo, "Cardiologia",
+    ]
+    assert [linha[8] for linha in exportar(especialidade=cardiologia.pk)] == ["Cardiologia", "Cardiologia"]
+    assert [linha[3] for linha in exportar(status="cancelada")] == ["Cancelada"]
+    semana = exportar(data_inicio=terca.isoformat(), data_fim=terca.isoformat())
+    assert len(semana) == 2 and all(linha[1].startswith(f"{terca:%d/%m/%Y}") for linha in semana)
+    assert len(exportar(medico=clinico.pk, data_inicio=terca.isoformat())) == 2
+
+    # nomes digitados que o Excel leria como fórmula saem como texto
+    Usuario.objects.filter(pk=paciente.usuario_id).update(nome_completo='=HYPERLINK("http://x","y")')
+    assert {linha[5] for linha in exportar()} == {'\'=HYPERLINK("http://x","y")'}
@@ -2,6 +2,7 @@
 from django.urls import path
 from .views import (
     ConsultaListView,
+    ConsultaExportView,
     ConsultaDeleteView,
     GerenciarAgendaView,
     HorarioTrabalhoUpdateView,
@@ -9,14 +10,21 @@ from .views import (
     ExcecaoHorarioCreateView,
     ExcecaoHorarioUpdateView,
     ExcecaoHorarioDeleteView,
+    RemarcarConsultasView,
     MedicoAgendaJsonView,
+    MedicoAgendaPaginadaJsonView,
+    AgendaLoteJsonView,
+    ProximosSlotsJsonView,
+    PacienteAutocompleteJsonView,
     ConsultaCreateByMedicoView,
+    ConsultaSerieCreateView,
     HorariosDisponiveisAjaxView, 
     MedicoSlotsView,
     ConsultaEditarView,
     minhas_consultas_paciente,
     detalhes_consulta,
     marcar_concluida,
+    cancelar_consulta,
 )
 
 urlpatterns = [
@@ -25,14 +33,26 @@ urlpatterns = [
         ConsultaCreateByMedicoView.as_view(),
         name='agendar_consulta_por_medico'
     ),
+    # série de sessões (semanal ou a cada N dias) a partir do slot escolhido (?slot=<ISO>)
+    path(
+        'agendar/medico/<int:medico_id>/serie/',
+        ConsultaSerieCreateView.as_view(),
+        name='agendar_serie_consultas'
+    ),
+
+    # busca de pacientes do formulário de agendamento (GET ?q=<nome ou CPF>&pagina=N)
+    path('api/pacientes/', PacienteAutocompleteJsonView.as_view(), name='api_pacientes_autocomplete'),
 
     # endpoint AJAX para retornar slots disponíveis (GET ?medico=<id>&data=YYYY-MM-DD)
     path('ajax/horarios/', HorariosDisponiveisAjaxView.as_view(), name='ajax_horarios_disponiveis'),
     path('medico/<int:medico_id>/slots/', MedicoSlotsView.as_view(), name='slots_medico'),
 
     path("consultas/", ConsultaListView.as_view(), name="listar_consultas"),
+    path("consultas/exportar/", ConsultaExportView.as_view(), name="exportar_consultas"),
     path("consultas/<int:pk>/deletar/", ConsultaDeleteView.as_view(), name="deletar_consulta"),
     path('consulta/<int:pk>/concluir/', marcar_concluida, name='marcar_concluida'), 
+    # cancelamento mantém o registro (status 'cancelada') e libera o horário
+    path('consulta/<int:pk>/cancelar/', cancelar_consulta, name='cancelar_consulta'),
     path("consultas/<int:pk>/editar/", ConsultaEditarView.as_view(), name="editar_consulta"),
     path("consulta/<int:pk>/", detalhes_consulta, name="detalhes_consulta"),
 
@@ -46,7 +66,19 @@ urlpatterns = [
     path('agenda/excecao/adicionar/', ExcecaoHorarioCreateView.as_view(), name='adicionar_excecao'),
     path('agenda/excecao/editar/<int:pk>/', ExcecaoHorarioUpdateView.as_view(), name='editar_excecao'),
     path('agenda/excecao/deletar/<int:pk>/', ExcecaoHorarioDeleteView.as_view(), name='deletar_excecao'),
+    # prévia e aplicação da remarcação das consultas atingidas por um bloqueio
+    path('agenda/excecao/<int:pk>/remarcar/', RemarcarConsultasView.as_view(), name='remarcar_consultas'),
 
     # API/JSON com agenda (você já tinha)
     path('api/agenda/<int:medico_id>/', MedicoAgendaJsonView.as_view(), name='api_agenda_medico'),
+    # agenda em páginas para horizontes longos (GET ?dias=180&pagina=7[&cursor=YYYY-MM-DD&ate=YYYY-MM-DD])
+    path(
+        'api/agenda/<int:medico_id>/paginas/',
+        MedicoAgendaPaginadaJsonView.as_view(),
+        name='api_agenda_medico_paginada',
+    ),
+    # agenda de vários médicos (GET ?medicos=1,2,3 ou ?especialidade=<id>)
+    path('api/agenda/lote/', AgendaLoteJsonView.as_view(), name='api_agenda_lote'),
+    # primeiros horários livres (GET ?especialidade=<id>&n=5[&apos=YYYY-MM-DD|&dias_apos=N])
+    path('api/agenda/proximos/', ProximosSlotsJsonView.as_view(), name='api_proximos_slots'),
 ]
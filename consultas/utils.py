@@ -1,16 +1,28 @@
 # utils.py
 from datetime import datetime, timedelta, time as _time, date as _date
-from typing import Dict, List
+import heapq
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Exists, Q
 
-from .models import HorarioTrabalho, ExcecaoHorario, Consulta
+from .calendario import calendario_clinica
+from .models import STATUS_OCUPANTES, HorarioTrabalho, ExcecaoHorario, Consulta, ReservaSlot
 from core.models import Medico
 
 # Ajuste se quiser outro intervalo de slot
 SLOT_MINUTOS = 30
 DURACAO_CONSULTA = timedelta(minutes=SLOT_MINUTOS)
 
+# Busca do próximo horário livre: tamanho de cada janela carregada e horizonte máximo
+PROXIMOS_JANELA_DIAS = 7
+PROXIMOS_MAX_DIAS = 90
+
+# Motores de cálculo de slots selecionáveis por settings.CONSULTAS_SLOTS_BACKEND
+BACKENDS_SLOTS = ("python", "postgres")
+
 
 def _make_aware(dt: datetime) -> datetime:
     """Retorna datetime aware no timezone corrente. Se já for aware, normaliza para timezone local."""
@@ -29,157 +41,357 @@ def _day_to_model_day(d: _date) -> int:
     return (d.weekday() + 1) % 7
 
 
-def calcular_slots_disponiveis(medico_id: int, dias_a_frente: int = 7) -> Dict[str, List[str]]:
+def _proximo_slot(agora: datetime) -> datetime:
+    """Primeiro início de slot (alinhado ao relógio) que não está no passado em relação a `agora`."""
+    mins = (agora.minute // SLOT_MINUTOS) * SLOT_MINUTOS
+    proximo = agora.replace(minute=mins, second=0, microsecond=0)
+    if proximo < agora:
+        proximo = proximo + timedelta(minutes=SLOT_MINUTOS)
+    return proximo
+
+
+def mesclar_intervalos(intervalos) -> List[Tuple[datetime, datetime]]:
+    """Ordena os intervalos (inicio, fim) e funde os que se sobrepõem ou se tocam."""
+    mesclados = []
+    for inicio, fim in sorted(intervalos):
+        if fim <= inicio:
+            continue
+        if mesclados and inicio <= mesclados[-1][1]:
+            if fim > mesclados[-1][1]:
+                mesclados[-1] = (mesclados[-1][0], fim)
+        else:
+            mesclados.append((inicio, fim))
+    return mesclados
+
+
+class AgendaMedico:
+    """Horários, exceções e consultas de um médico carregados de uma só vez para um período."""
+
+    def __init__(self, medico_id: int):
+        self.medico_id = medico_id
+        # dia_semana do model (0=Domingo) -> [(hora_inicio, hora_fim)]
+        self.horarios = defaultdict(list)
+        # exceções de disponibilidade extra (esta_bloqueado=False), aware
+        self.extras = []
+        # bloqueios, consultas e fechamentos da clínica que ocupam a agenda, ordenados e mesclados
+        self.ocupados = []
+
+
+def carregar_agendas(
+    medico_ids,
+    period_start: datetime,
+    period_end: datetime,
+    dias_semana=None,
+    com_reservas: bool = True,
+    chave_reserva=None,
+) -> Dict[int, AgendaMedico]:
     """
-    Retorna um dicionário { 'YYYY-MM-DD': ['ISO_SLOT1', 'ISO_SLOT2', ...'], ... }
-    para os próximos `dias_a_frente` dias (a partir de hoje).
+    Carrega a agenda de vários médicos com um número fixo de queries (uma por tabela),
+    independente da quantidade de médicos e de dias do período.
+    `dias_semana` restringe os horários recorrentes carregados (ex.: consulta de um único dia).
+    `com_reservas=False` ignora as reservas temporárias de slot (ex.: slots materializados,
+    que não são recalculados quando uma reserva vence); `chave_reserva` é a reserva do próprio
+    formulário, que não ocupa o slot para quem a fez.
     """
-    try:
-        medico = Medico.objects.get(pk=medico_id)
-    except Medico.DoesNotExist:
-        return {}
+    agendas = {int(medico_id): AgendaMedico(int(medico_id)) for medico_id in medico_ids}
+    if not agendas:
+        return agendas
+
+    ids = list(agendas)
+    ocupados = defaultdict(list)
+
+    horarios = HorarioTrabalho.objects.filter(medico_id__in=ids)
+    if dias_semana is not None:
+        horarios = horarios.filter(dia_semana__in=dias_semana)
+    horarios = horarios.values_list("medico_id", "dia_semana", "hora_inicio", "hora_fim")
+    for medico_id, dia_semana, hora_inicio, hora_fim in horarios:
+        agendas[medico_id].horarios[dia_semana].append((hora_inicio, hora_fim))
 
+    excecoes = ExcecaoHorario.objects.filter(
+        medico_id__in=ids,
+        data_fim__gte=period_start,
+        data_inicio__lte=period_end,
+    ).values_list("medico_id", "data_inicio", "data_fim", "esta_bloqueado")
+    for medico_id, data_inicio, data_fim, esta_bloqueado in excecoes:
+        intervalo = (_make_aware(data_inicio), _make_aware(data_fim))
+        if esta_bloqueado:
+            ocupados[medico_id].append(intervalo)
+        else:
+            agendas[medico_id].extras.append(intervalo)
+
+    # Consultas sem data_hora_fim ocupam DURACAO_CONSULTA a partir do início
+    consultas = Consulta.objects.filter(
+        medico_id__in=ids,
+        status__in=STATUS_OCUPANTES,
+        data_hora_inicio__lte=period_end,
+    ).filter(
+        Q(data_hora_fim__gte=period_start)
+        | Q(data_hora_fim__isnull=True, data_hora_inicio__gte=period_start - DURACAO_CONSULTA)
+    ).values_list("medico_id", "data_hora_inicio", "data_hora_fim").order_by()
+    if com_reservas:
+        # reservas ainda válidas ocupam o slot; vêm na mesma query das consultas
+        reservas = ReservaSlot.objects.filter(
+            medico_id__in=ids,
+            expira_em__gt=timezone.now(),
+            data_hora_inicio__lt=period_end,
+            data_hora_fim__gt=period_start,
+        )
+        if chave_reserva:
+            reservas = reservas.exclude(chave=chave_reserva)
+        reservas = reservas.values_list("medico_id", "data_hora_inicio", "data_hora_fim").order_by()
+        consultas = consultas.union(reservas, all=True)
+    for medico_id, data_hora_inicio, data_hora_fim in consultas:
+        inicio = _make_aware(data_hora_inicio)
+        fim = _make_aware(data_hora_fim) if data_hora_fim else inicio + DURACAO_CONSULTA
+        ocupados[medico_id].append((inicio, fim))
+
+    # fechamentos da clínica vêm do calendário em memória, sem query por médico
+    fechamentos = calendario_clinica.fechamentos(period_start, period_end)
+    for medico_id in ids:
+        agendas[medico_id].ocupados = mesclar_intervalos(ocupados[medico_id] + fechamentos)
+
+    return agendas
+
+
+def periodos_trabalho(agenda: AgendaMedico, dia: _date) -> List[Tuple[datetime, datetime]]:
+    """Períodos de trabalho (recorrentes + extras recortados ao dia) já ordenados e mesclados."""
+    periodos = []
+    for hora_inicio, hora_fim in agenda.horarios.get(_day_to_model_day(dia), ()):
+        periodos.append((
+            _make_aware(datetime.combine(dia, hora_inicio)),
+            _make_aware(datetime.combine(dia, hora_fim)),
+        ))
+
+    if agenda.extras:
+        inicio_dia = _make_aware(datetime.combine(dia, _time.min))
+        fim_dia = _make_aware(datetime.combine(dia + timedelta(days=1), _time.min))
+        for inicio, fim in agenda.extras:
+            if inicio < fim_dia and fim > inicio_dia:
+                periodos.append((max(inicio, inicio_dia), min(fim, fim_dia)))
+
+    return mesclar_intervalos(periodos)
+
+
+def iterar_slots(agenda: AgendaMedico, data_inicial: _date, dias: int, agora: datetime):
+    """
+    Gera `(data, [slots aware])` em ordem cronológica, apenas para os dias com slots livres.
+
+    Os slots de todos os dias crescem monotonicamente, então uma única varredura sobre
+    `agenda.ocupados` (ordenados e mesclados) basta: o ponteiro nunca volta, e um slot
+    que cai num intervalo ocupado salta direto para o fim dele.
+    """
+    ocupados = agenda.ocupados
+    total = len(ocupados)
+    j = 0
+    proximo = _proximo_slot(agora)
+
+    for i in range(dias):
+        dia = data_inicial + timedelta(days=i)
+        slots_dia = []
+
+        for inicio_periodo, fim_periodo in periodos_trabalho(agenda, dia):
+            slot_inicio = inicio_periodo
+            if slot_inicio < agora:
+                slot_inicio = max(slot_inicio, proximo)
+
+            while slot_inicio + DURACAO_CONSULTA <= fim_periodo:
+                while j < total and ocupados[j][1] <= slot_inicio:
+                    j += 1
+                if j < total and ocupados[j][0] < slot_inicio + DURACAO_CONSULTA:
+                    # avança no grid do período até o primeiro slot após o fim do ocupado
+                    passos = -(-(ocupados[j][1] - slot_inicio) // DURACAO_CONSULTA)
+                    slot_inicio = slot_inicio + passos * DURACAO_CONSULTA
+                    continue
+                slots_dia.append(slot_inicio)
+                slot_inicio = slot_inicio + DURACAO_CONSULTA
+
+        if slots_dia:
+            yield dia, slots_dia
+
+
+def _backend_slots() -> str:
+    backend = getattr(settings, "CONSULTAS_SLOTS_BACKEND", "python")
+    if backend not in BACKENDS_SLOTS:
+        raise ImproperlyConfigured(
+            f"CONSULTAS_SLOTS_BACKEND inválido: {backend!r}. Use um de: {', '.join(BACKENDS_SLOTS)}."
+        )
+    return backend
+
+
+def _janela_busca(dias_a_frente: int):
+    """Retorna (agora, hoje, period_start, period_end) para um horizonte de `dias_a_frente` dias."""
     tz = timezone.get_current_timezone()
-    hoje_date = timezone.localtime(timezone.now(), tz).date()
+    agora = timezone.localtime(timezone.now(), tz)
+    hoje_date = agora.date()
     data_fim_busca = hoje_date + timedelta(days=dias_a_frente)
 
     # Periodo total para buscar consultas/exceções (da meia-noite de hoje até fim do último dia)
     period_start = _make_aware(datetime.combine(hoje_date, _time.min))
     period_end = _make_aware(datetime.combine(data_fim_busca, _time.max))
+    return agora, hoje_date, period_start, period_end
 
-    # Horários recorrentes do médico
-    horarios_recorrentes = HorarioTrabalho.objects.filter(medico=medico)
 
-    # Exceções que intersectam o período de interesse
-    excecoes = ExcecaoHorario.objects.filter(
-        medico=medico,
-        data_fim__gte=period_start,
-        data_inicio__lte=period_end
-    )
+def _slots_para_dict(agenda: AgendaMedico, hoje_date: _date, dias_a_frente: int, agora: datetime):
+    return {
+        dia.isoformat(): [slot.isoformat() for slot in slots]
+        for dia, slots in iterar_slots(agenda, hoje_date, dias_a_frente, agora)
+    }
 
-    # Consultas existentes no período (apenas status que ocupam)
-    consultas_agendadas = Consulta.objects.filter(
-        medico=medico,
-        status__in=['agendada', 'confirmada'],
-        data_hora_inicio__lte=period_end,
-        data_hora_fim__gte=period_start
-    )
 
-    # Construir lista de intervalos ocupados (aware)
-    intervalos_ocupados = []
+def calcular_slots_disponiveis(medico_id: int, dias_a_frente: int = 7, chave_reserva=None) -> Dict[str, List[str]]:
+    """
+    Retorna um dicionário { 'YYYY-MM-DD': ['ISO_SLOT1', 'ISO_SLOT2', ...'], ... }
+    para os próximos `dias_a_frente` dias (a partir de hoje).
+    A reserva `chave_reserva` (a do próprio formulário) não ocupa o slot.
+    """
+    if _backend_slots() == "postgres":
+        from .slots_sql import calcular_slots_lote_sql
 
-    for exc in excecoes.filter(esta_bloqueado=True):
-        inicio_ex = _make_aware(exc.data_inicio)
-        fim_ex = _make_aware(exc.data_fim)
-        intervalos_ocupados.append((inicio_ex, fim_ex))
+        return calcular_slots_lote_sql([medico_id], dias_a_frente=dias_a_frente, chave_reserva=chave_reserva)[
+            int(medico_id)
+        ]
 
-    for cons in consultas_agendadas:
-        inicio_cons = _make_aware(cons.data_hora_inicio)
-        if cons.data_hora_fim:
-            fim_cons = _make_aware(cons.data_hora_fim)
-        else:
-            fim_cons = inicio_cons + DURACAO_CONSULTA
-        intervalos_ocupados.append((inicio_cons, fim_cons))
+    agora, hoje_date, period_start, period_end = _janela_busca(dias_a_frente)
+    agenda = carregar_agendas([medico_id], period_start, period_end, chave_reserva=chave_reserva)[int(medico_id)]
+    return _slots_para_dict(agenda, hoje_date, dias_a_frente, agora)
 
-    slots_disponiveis = {}
 
-    for i in range(dias_a_frente):
-        data_atual = hoje_date + timedelta(days=i)
-        model_day = _day_to_model_day(data_atual)
+def _resolver_medicos(medico_ids=None, especialidade_id: int = None) -> List[int]:
+    """Ids dos médicos pedidos explicitamente e/ou da especialidade (lista vazia se nenhum filtro)."""
+    if especialidade_id is not None:
+        medicos = Medico.objects.filter(especialidade_id=especialidade_id)
+        if medico_ids is not None:
+            medicos = medicos.filter(pk__in=medico_ids)
+        return list(medicos.order_by("pk").values_list("pk", flat=True))
+    return list(medico_ids or [])
 
-        # horários recorrentes desse dia (ex.: segunda, terça...)
-        horarios_dia = horarios_recorrentes.filter(dia_semana=model_day)
 
-        # exceções do tipo disponibilidade extra (esta_bloqueado=False) que ocorram no dia
-        extras_dia = excecoes.filter(
-            esta_bloqueado=False,
-            data_inicio__date__lte=data_atual,
-            data_fim__date__gte=data_atual
-        )
+def calcular_slots_disponiveis_lote(
+    medico_ids=None, especialidade_id: int = None, dias_a_frente: int = 7
+) -> Dict[int, Dict[str, List[str]]]:
+    """
+    Versão em lote de `calcular_slots_disponiveis`: retorna { medico_id: {dia: [slots]} }
+    para uma lista de médicos e/ou todos os médicos de uma especialidade.
+    Usa o mesmo número de queries para 1 ou 100 médicos.
+    """
+    if _backend_slots() == "postgres":
+        from .slots_sql import calcular_slots_lote_sql
 
-        # construir períodos de trabalho (lista de tuplas aware)
-        periodos_trabalho = []
-        for h in horarios_dia:
-            inicio_naive = datetime.combine(data_atual, h.hora_inicio)
-            fim_naive = datetime.combine(data_atual, h.hora_fim)
-            inicio = _make_aware(inicio_naive)
-            fim = _make_aware(fim_naive)
-            # pular se fim <= inicio por configuração inválida
-            if fim <= inicio:
-                continue
-            periodos_trabalho.append((inicio, fim))
-
-        for e in extras_dia:
-            # exceções já são datetimes (possivelmente com tz)
-            inicio_e = _make_aware(e.data_inicio)
-            fim_e = _make_aware(e.data_fim)
-            if fim_e <= inicio_e:
-                continue
-            periodos_trabalho.append((inicio_e, fim_e))
-
-        if not periodos_trabalho:
-            continue
+        return calcular_slots_lote_sql(medico_ids, especialidade_id, dias_a_frente)
 
-        # ordenar e (opcional) mesclar periodos para evitar sobreposição duplicada
-        periodos_trabalho.sort(key=lambda x: x[0])
+    medico_ids = _resolver_medicos(medico_ids, especialidade_id)
+    agora, hoje_date, period_start, period_end = _janela_busca(dias_a_frente)
+    agendas = carregar_agendas(medico_ids, period_start, period_end)
+    return {
+        medico_id: _slots_para_dict(agenda, hoje_date, dias_a_frente, agora)
+        for medico_id, agenda in agendas.items()
+    }
 
-        slots_dia = []
-        now = timezone.localtime(timezone.now(), tz)
 
-        for inicio_periodo, fim_periodo in periodos_trabalho:
-            # se o período começa antes do 'now' no dia atual, iniciamos do próximo slot válido
-            slot_inicio = inicio_periodo
-            if data_atual == hoje_date and slot_inicio < now:
-                # avançar para o próximo slot de 30min a partir de now
-                mins = (now.minute // SLOT_MINUTOS) * SLOT_MINUTOS
-                proximo = now.replace(minute=mins, second=0, microsecond=0)
-                if proximo < now:
-                    proximo = proximo + timedelta(minutes=SLOT_MINUTOS)
-                slot_inicio = max(slot_inicio, proximo)
+def iterar_slots_disponiveis(medico_id: int, data_inicial: _date, data_final: _date, dias_por_lote: int = 14):
+    """
+    Gera `(data, [slots aware])` de `data_inicial` até `data_final` (inclusive) para horizontes longos.
+    A agenda é carregada em lotes de `dias_por_lote` dias, só quando o consumidor avança até eles.
+    """
+    agora = timezone.localtime(timezone.now())
+    data = max(data_inicial, agora.date())
+    while data <= data_final:
+        dias = min(dias_por_lote, (data_final - data).days + 1)
+        inicio_lote = _make_aware(datetime.combine(data, _time.min))
+        fim_lote = _make_aware(datetime.combine(data + timedelta(days=dias), _time.min))
+        agenda = carregar_agendas([medico_id], inicio_lote, fim_lote)[int(medico_id)]
+        yield from iterar_slots(agenda, data, dias, agora)
+        data = data + timedelta(days=dias)
+
+
+def slots_do_dia(medico_id: int, data: _date) -> List[datetime]:
+    """Slots livres (aware, no fuso corrente) de um único dia, carregando só os horários daquele dia da semana."""
+    inicio_dia = _make_aware(datetime.combine(data, _time.min))
+    fim_dia = _make_aware(datetime.combine(data + timedelta(days=1), _time.min))
+    agenda = carregar_agendas([medico_id], inicio_dia, fim_dia, dias_semana=[_day_to_model_day(data)])[int(medico_id)]
+    agora = timezone.localtime(timezone.now())
+    for _, slots in iterar_slots(agenda, data, 1, agora):
+        return slots
+    return []
+
+
+def _fluxo_slots(agenda: AgendaMedico, data_inicial: _date, dias: int, agora: datetime):
+    for _, slots in iterar_slots(agenda, data_inicial, dias, agora):
+        for slot in slots:
+            yield slot, agenda.medico_id
+
+
+def proximos_slots_livres(
+    quantidade: int = 5,
+    medico_ids=None,
+    especialidade_id: int = None,
+    apos: datetime = None,
+    max_dias: int = PROXIMOS_MAX_DIAS,
+) -> List[Tuple[int, datetime]]:
+    """
+    Retorna os `quantidade` primeiros slots livres [(medico_id, inicio), ...] entre os médicos
+    informados (ou da especialidade), a partir de `apos` (padrão: agora).
 
-            # gerar slots
-            while slot_inicio + DURACAO_CONSULTA <= fim_periodo:
-                slot_fim = slot_inicio + DURACAO_CONSULTA
+    As agendas são carregadas em janelas de PROXIMOS_JANELA_DIAS dias para todos os médicos de uma
+    vez; os slots de cada médico são gerados de forma preguiçosa e intercalados em ordem de horário
+    com heapq.merge, parando assim que `quantidade` slots são encontrados.
+    """
+    medico_ids = _resolver_medicos(medico_ids, especialidade_id)
+    if not medico_ids or quantidade <= 0:
+        return []
 
-                # verificar conflito com intervalos ocupados
-                livre = True
-                for ocupado_inicio, ocupado_fim in intervalos_ocupados:
-                    # se intersecta -> não livre
-                    if max(slot_inicio, ocupado_inicio) < min(slot_fim, ocupado_fim):
-                        livre = False
-                        break
+    agora = timezone.localtime(timezone.now())
+    apos = max(_make_aware(apos), agora) if apos else agora
+    data = apos.date()
+    limite = data + timedelta(days=max_dias)
 
-                if livre:
-                    # armazenar ISO (aware) — bom para JSON/frontend
-                    slots_dia.append(slot_inicio.isoformat())
+    encontrados = []
+    while data < limite and len(encontrados) < quantidade:
+        dias = min(PROXIMOS_JANELA_DIAS, (limite - data).days)
+        inicio_janela = _make_aware(datetime.combine(data, _time.min))
+        fim_janela = _make_aware(datetime.combine(data + timedelta(days=dias), _time.min))
+        agendas = carregar_agendas(medico_ids, inicio_janela, fim_janela)
 
-                slot_inicio = slot_inicio + DURACAO_CONSULTA
+        fluxos = [_fluxo_slots(agenda, data, dias, apos) for agenda in agendas.values()]
+        for slot, medico_id in heapq.merge(*fluxos):
+            encontrados.append((medico_id, slot))
+            if len(encontrados) == quantidade:
+                break
 
-        if slots_dia:
-            slots_disponiveis[data_atual.isoformat()] = slots_dia
+        data = data + timedelta(days=dias)
 
-    return slots_disponiveis
+    return encontrados
 
 
-def checar_conflito_consulta(medico_id: int, inicio: datetime, fim: datetime, consulta_id: int = None) -> bool:
+def checar_conflito_consulta(
+    medico_id: int, inicio: datetime, fim: datetime, consulta_id: int = None, chave_reserva=None
+) -> bool:
     """
-    Retorna True se houver conflito (consulta / bloqueio / início no passado), False se livre.
+    Retorna True se houver conflito (consulta / bloqueio / reserva / feriado / início no passado), False se livre.
     `inicio` e `fim` podem ser naive ou aware — serão normalizados.
+    Consultas, bloqueios e reservas de slot são verificados numa única query; a de consultas usa o
+    índice GiST da constraint `consulta_sem_sobreposicao`. A reserva `chave_reserva` (a do próprio
+    formulário) não conta como conflito.
     """
     inicio = _make_aware(inicio)
     fim = _make_aware(fim)
 
+    # início no passado
+    if inicio < timezone.now():
+        return True
+
+    # clínica fechada (feriado/recesso)
+    if calendario_clinica.fechado(inicio, fim):
+        return True
+
     # conflito com outras consultas
-    qs = Consulta.objects.filter(
+    consultas = Consulta.objects.filter(
         medico_id=medico_id,
-        status__in=['agendada', 'confirmada'],
-        data_hora_inicio__lt=fim,
-        data_hora_fim__gt=inicio
+        status__in=STATUS_OCUPANTES,
+        periodo__overlap=(inicio, fim),
     )
     if consulta_id:
-        qs = qs.exclude(pk=consulta_id)
-    if qs.exists():
-        return True
+        consultas = consultas.exclude(pk=consulta_id)
 
     # conflito com bloqueios/exceções
     bloqueios = ExcecaoHorario.objects.filter(
@@ -188,11 +400,19 @@ def checar_conflito_consulta(medico_id: int, inicio: datetime, fim: datetime, co
         data_inicio__lt=fim,
         data_fim__gt=inicio
     )
-    if bloqueios.exists():
-        return True
 
-    # início no passado
-    if inicio < timezone.now():
-        return True
+    # slot reservado por outro formulário de agendamento ainda aberto
+    reservas = ReservaSlot.objects.filter(
+        medico_id=medico_id,
+        expira_em__gt=timezone.now(),
+        data_hora_inicio__lt=fim,
+        data_hora_fim__gt=inicio,
+    )
+    if chave_reserva:
+        reservas = reservas.exclude(chave=chave_reserva)
 
-    return False
+    return (
+        Medico.objects.filter(pk=medico_id)
+        .filter(Q(Exists(consultas)) | Q(Exists(bloqueios)) | Q(Exists(reservas)))
+        .exists()
+    )
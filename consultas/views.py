@@ -1,3 +1,6 @@
+import re
+import uuid
+
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin, AccessMixin
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, View
 from django.urls import reverse_lazy
@@ -5,18 +8,35 @@ from django.contrib import messages
 from datetime import datetime, timedelta, time
 from django.shortcuts import redirect, render, get_object_or_404
 from django import forms
-from django.views.generic import TemplateView
+from django.views.generic import FormView, TemplateView
 from django.http import JsonResponse
-from .utils import calcular_slots_disponiveis
+from .utils import calcular_slots_disponiveis_lote, iterar_slots_disponiveis, proximos_slots_livres, slots_do_dia
+from .cache import obter_slots_disponiveis
+from .agendamento import MENSAGEM_CONFLITO, _conflito_de_agenda, agendar_consulta, agendar_serie, consulta_da_submissao
+from .impacto import consultas_orfas
+from .remarcacao import aplicar_remarcacoes, consultas_afetadas, propor_remarcacoes
+from .reservas import reservar_slot
+from .paginacao import CursorInvalido, paginar_consultas
+from .exportacao import exportar_consultas_csv
 from .models import Consulta, HorarioTrabalho, ExcecaoHorario
-from .forms import ConsultaForm, HorarioTrabalhoForm, ExcecaoHorarioForm, ConsultaEdicaoForm
+from .forms import (
+    ConsultaEdicaoForm,
+    ConsultaFilterForm,
+    ConsultaForm,
+    ConsultaSerieForm,
+    ExcecaoHorarioForm,
+    HorarioTrabalhoForm,
+)
+from core.forms import normalize_cpf
 from core.models import Medico, Usuario, Paciente
 from django.views import View
 from django.shortcuts import get_object_or_404
 from .utils import SLOT_MINUTOS
 from django.db.models import Q
-from django.utils.dateparse import parse_datetime 
-from django.core.exceptions import PermissionDenied
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 
@@ -46,6 +66,22 @@ class AdminOrAtendenteRequiredMixin(UserPassesTestMixin):
             self.request.user.is_superuser or self.request.user.tipo == "admin" or self.request.user.tipo == "atendente"
         )
 
+class AgendamentoSemConflitoMixin:
+    """
+    Salva a consulta dentro de um savepoint. Se outro agendamento simultâneo ocupou o horário
+    depois da validação do form, a constraint do banco recusa a gravação e o erro volta para o form.
+    """
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                return super().form_valid(form)
+        except IntegrityError as erro:
+            # só as constraints de horário viram mensagem; outras violações são erros de verdade
+            if not _conflito_de_agenda(erro):
+                raise
+            form.add_error(None, MENSAGEM_CONFLITO)
+            return self.form_invalid(form)
+
 class MedicoAgendaJsonView(View):
     def get(self, request, *args, **kwargs):
         medico_id = kwargs.get('medico_id')
@@ -54,12 +90,202 @@ class MedicoAgendaJsonView(View):
             return JsonResponse({"erro": "ID do médico não fornecido."}, status=400)
         
         try:
-            slots_disponiveis = calcular_slots_disponiveis(medico_id)
+            slots_disponiveis = obter_slots_disponiveis(medico_id)
             return JsonResponse(slots_disponiveis)
         
         except Exception as e:
             return JsonResponse({"erro": f"Ocorreu um erro no cálculo da agenda: {e}"}, status=500)
 
+class MedicoAgendaPaginadaJsonView(View):
+    """
+    Agenda de um médico em páginas, para horizontes longos.
+    GET ?dias=180 (horizonte a partir de hoje) ou ?ate=YYYY-MM-DD, &pagina=7 (dias com horário por página)
+    e &cursor=YYYY-MM-DD (valor de "cursor" devolvido pela página anterior).
+    """
+    MAX_DIAS = 366
+    MAX_PAGINA = 31
+
+    def get(self, request, *args, **kwargs):
+        medico_id = kwargs.get('medico_id')
+        hoje = timezone.localdate()
+
+        try:
+            pagina = int(request.GET.get('pagina', 7))
+            dias = int(request.GET.get('dias', 7))
+            cursor = self._parse_data(request.GET.get('cursor')) or hoje
+            ate = self._parse_data(request.GET.get('ate')) or hoje + timedelta(days=dias - 1)
+        except ValueError:
+            return JsonResponse({"erro": "Parâmetros inválidos."}, status=400)
+
+        if not 1 <= pagina <= self.MAX_PAGINA:
+            return JsonResponse({"erro": f"'pagina' deve estar entre 1 e {self.MAX_PAGINA}."}, status=400)
+        if not 1 <= dias <= self.MAX_DIAS or (ate - hoje).days >= self.MAX_DIAS:
+            return JsonResponse({"erro": f"O horizonte máximo é de {self.MAX_DIAS} dias."}, status=400)
+
+        try:
+            dias_pagina = {}
+            proximo_cursor = None
+            for dia, slots in iterar_slots_disponiveis(medico_id, cursor, ate):
+                dias_pagina[dia.isoformat()] = [slot.isoformat() for slot in slots]
+                if len(dias_pagina) == pagina:
+                    proximo = dia + timedelta(days=1)
+                    proximo_cursor = proximo.isoformat() if proximo <= ate else None
+                    break
+
+            return JsonResponse({"dias": dias_pagina, "cursor": proximo_cursor, "ate": ate.isoformat()})
+
+        except Exception as e:
+            return JsonResponse({"erro": f"Ocorreu um erro no cálculo da agenda: {e}"}, status=500)
+
+    def _parse_data(self, valor):
+        if not valor:
+            return None
+        data = parse_date(valor)
+        if not data:
+            raise ValueError(valor)
+        return data
+
+class AgendaLoteJsonView(View):
+    """
+    Agenda de vários médicos em uma única chamada.
+    GET ?medicos=1,2,3 e/ou ?especialidade=<id>, opcionalmente &dias=N.
+    """
+    MAX_DIAS = 31
+
+    def get(self, request, *args, **kwargs):
+        medicos_param = request.GET.get('medicos')
+        especialidade_id = request.GET.get('especialidade')
+
+        if not medicos_param and not especialidade_id:
+            return JsonResponse({"erro": "Informe 'medicos' ou 'especialidade'."}, status=400)
+
+        try:
+            medico_ids = [int(m) for m in medicos_param.split(',') if m.strip()] if medicos_param else None
+            especialidade_id = int(especialidade_id) if especialidade_id else None
+            dias = int(request.GET.get('dias', 7))
+        except ValueError:
+            return JsonResponse({"erro": "Parâmetros inválidos."}, status=400)
+
+        if not 1 <= dias <= self.MAX_DIAS:
+            return JsonResponse({"erro": f"'dias' deve estar entre 1 e {self.MAX_DIAS}."}, status=400)
+
+        try:
+            slots_por_medico = calcular_slots_disponiveis_lote(
+                medico_ids=medico_ids, especialidade_id=especialidade_id, dias_a_frente=dias
+            )
+            return JsonResponse({str(medico_id): slots for medico_id, slots in slots_por_medico.items()})
+
+        except Exception as e:
+            return JsonResponse({"erro": f"Ocorreu um erro no cálculo da agenda: {e}"}, status=500)
+
+class PacienteAutocompleteJsonView(LoginRequiredMixin, AdminOrAtendenteRequiredMixin, View):
+    """
+    Busca de pacientes do formulário de agendamento.
+    GET ?q=<início do nome ou dígitos do CPF>&pagina=N, POR_PAGINA resultados por página.
+    Nome: prefixo sem diferenciar maiúsculas (índice usuario_nome_prefixo_idx); CPF: prefixo de
+    `cpf_digitos` (índice usuario_cpf_digitos_idx), que acha também CPFs gravados com pontuação.
+    Sem COUNT: busca uma linha a mais para saber se há outra página.
+    """
+    POR_PAGINA = 20
+    MIN_CARACTERES = 2
+
+    def get(self, request, *args, **kwargs):
+        termo = request.GET.get('q', '').strip()
+        try:
+            pagina = int(request.GET.get('pagina', 1))
+        except ValueError:
+            return JsonResponse({"erro": "Parâmetros inválidos."}, status=400)
+        if pagina < 1:
+            return JsonResponse({"erro": "'pagina' deve ser maior que zero."}, status=400)
+
+        if len(termo) < self.MIN_CARACTERES:
+            return JsonResponse({"resultados": [], "pagina": pagina, "tem_mais": False})
+
+        digitos = normalize_cpf(termo)
+        if digitos and not re.search(r'[^\d.\-\s]', termo):
+            pacientes = Paciente.objects.filter(usuario__cpf_digitos__startswith=digitos).order_by(
+                'usuario__cpf_digitos', 'pk'
+            )
+        else:
+            pacientes = Paciente.objects.filter(usuario__nome_completo__istartswith=termo).order_by(
+                'usuario__nome_completo', 'pk'
+            )
+
+        inicio = (pagina - 1) * self.POR_PAGINA
+        linhas = list(
+            pacientes.values_list('pk', 'usuario__nome_completo', 'usuario__cpf')[inicio:inicio + self.POR_PAGINA + 1]
+        )
+        return JsonResponse({
+            "resultados": [
+                {"id": pk, "nome": nome, "cpf": cpf} for pk, nome, cpf in linhas[:self.POR_PAGINA]
+            ],
+            "pagina": pagina,
+            "tem_mais": len(linhas) > self.POR_PAGINA,
+        })
+
+
+class ProximosSlotsJsonView(View):
+    """
+    Primeiros horários livres entre vários médicos.
+    GET ?especialidade=<id> e/ou ?medicos=1,2,3, opcionalmente &n=5 e
+    &apos=YYYY-MM-DD (ou data/hora ISO) ou &dias_apos=N (ex.: retorno em N dias).
+    """
+    MAX_SLOTS = 50
+    MAX_DIAS_APOS = 730
+
+    def get(self, request, *args, **kwargs):
+        medicos_param = request.GET.get('medicos')
+        especialidade_id = request.GET.get('especialidade')
+
+        if not medicos_param and not especialidade_id:
+            return JsonResponse({"erro": "Informe 'medicos' ou 'especialidade'."}, status=400)
+
+        try:
+            medico_ids = [int(m) for m in medicos_param.split(',') if m.strip()] if medicos_param else None
+            especialidade_id = int(especialidade_id) if especialidade_id else None
+            quantidade = int(request.GET.get('n', 5))
+            apos = self._parse_apos(request.GET.get('apos'), request.GET.get('dias_apos'))
+        except ValueError:
+            return JsonResponse({"erro": "Parâmetros inválidos."}, status=400)
+
+        if not 1 <= quantidade <= self.MAX_SLOTS:
+            return JsonResponse({"erro": f"'n' deve estar entre 1 e {self.MAX_SLOTS}."}, status=400)
+
+        try:
+            encontrados = proximos_slots_livres(
+                quantidade, medico_ids=medico_ids, especialidade_id=especialidade_id, apos=apos
+            )
+            nomes = dict(
+                Medico.objects.filter(pk__in={medico_id for medico_id, _ in encontrados})
+                .values_list('pk', 'usuario__nome_completo')
+            )
+            return JsonResponse({
+                "slots": [
+                    {"medico": medico_id, "medico_nome": nomes.get(medico_id), "inicio": slot.isoformat()}
+                    for medico_id, slot in encontrados
+                ]
+            })
+
+        except Exception as e:
+            return JsonResponse({"erro": f"Ocorreu um erro na busca de horários: {e}"}, status=500)
+
+    def _parse_apos(self, apos_str, dias_apos):
+        if dias_apos:
+            dias = int(dias_apos)
+            # sem limite, um N enorme estoura a data (OverflowError) em vez de virar um 400
+            if not 0 <= dias <= self.MAX_DIAS_APOS:
+                raise ValueError(dias_apos)
+            return datetime.combine(timezone.localdate() + timedelta(days=dias), time.min)
+        if not apos_str:
+            return None
+        dt = parse_datetime(apos_str)
+        if dt:
+            return dt
+        data = parse_date(apos_str)
+        if not data:
+            raise ValueError(apos_str)
+        return datetime.combine(data, time.min)
+
 class GerenciarAgendaView(LoginRequiredMixin, AdminOrMedicoRequiredMixin, View):
     template_name = 'templates_consulta/gerenciar_agenda.html'
     DURACAO_CONSULTA = 30
@@ -129,7 +355,22 @@ class HorarioTrabalhoUpdateView(LoginRequiredMixin, AdminOrMedicoRequiredMixin,
         context['titulo'] = 'Editar Horário Recorrente'
         return context
 
+    @staticmethod
+    def _impacto(horario):
+        """Identifica os valores cujo impacto foi mostrado e confirmado."""
+        return f"{horario.dia_semana}|{horario.hora_inicio:%H:%M}|{horario.hora_fim:%H:%M}"
+
     def form_valid(self, form):
+        # antes de salvar, mostra as consultas futuras que ficariam fora do expediente;
+        # a confirmação só vale para os valores mostrados: se o formulário mudou, checa de novo
+        impacto = self._impacto(form.instance)
+        if self.request.POST.get('confirmar_impacto') != impacto:
+            atual = self.model.objects.get(pk=self.object.pk)
+            orfas = list(consultas_orfas(atual, form.instance))
+            if orfas:
+                return self.render_to_response(
+                    self.get_context_data(form=form, consultas_orfas=orfas, impacto=impacto)
+                )
         messages.success(self.request, "Horário recorrente atualizado com sucesso.")
         return super().form_valid(form)
 
@@ -141,6 +382,11 @@ class HorarioTrabalhoDeleteView(LoginRequiredMixin, AdminOrMedicoRequiredMixin,
     def get_queryset(self):
         return self.model.objects.filter(medico__usuario=self.request.user)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['consultas_orfas'] = consultas_orfas(self.object)
+        return context
+
     def delete(self, request, *args, **kwargs):
         messages.success(request, "Horário recorrente excluído com sucesso.")
         return super().delete(request, *args, **kwargs)
@@ -158,13 +404,64 @@ class ExcecaoHorarioCreateView(LoginRequiredMixin, AdminOrMedicoRequiredMixin, C
             return redirect(reverse_lazy('home'))
         form.instance.medico = medico_instance
         messages.success(self.request, "Exceção de horário adicionada com sucesso.")
-        return super().form_valid(form)
+        resposta = super().form_valid(form)
+        if self.object.esta_bloqueado and consultas_afetadas(self.object).exists():
+            messages.warning(
+                self.request, "Há consultas agendadas no período bloqueado. Revise a remarcação proposta."
+            )
+            return redirect('remarcar_consultas', pk=self.object.pk)
+        return resposta
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['titulo'] = 'Adicionar Ausência ou Horário Extra'
         return context
 
+class RemarcarConsultasView(LoginRequiredMixin, AdminOrMedicoRequiredMixin, View):
+    """Prévia (GET) e aplicação (POST) da remarcação das consultas atingidas por um bloqueio."""
+    template_name = 'templates_consulta/remarcar_consultas.html'
+
+    def get_excecao(self):
+        excecoes = ExcecaoHorario.objects.select_related('medico__usuario').filter(esta_bloqueado=True)
+        if not (self.request.user.tipo == "admin" or self.request.user.is_superuser):
+            excecoes = excecoes.filter(medico__usuario=self.request.user)
+        return get_object_or_404(excecoes, pk=self.kwargs['pk'])
+
+    def get(self, request, *args, **kwargs):
+        excecao = self.get_excecao()
+        return render(request, self.template_name, {
+            'excecao': excecao,
+            'propostas': propor_remarcacoes(excecao),
+        })
+
+    def post(self, request, *args, **kwargs):
+        excecao = self.get_excecao()
+        campos = {
+            campo.removeprefix('consulta_'): valor
+            for campo, valor in request.POST.items()
+            if campo.startswith('consulta_')
+        }
+        if not all(chave.isdigit() for chave in campos):
+            # POST adulterado: volta para a prévia em vez de estourar no int()
+            messages.error(request, "Formulário de remarcação inválido. Revise as remarcações propostas.")
+            return render(request, self.template_name, {
+                'excecao': excecao,
+                'propostas': propor_remarcacoes(excecao),
+            }, status=400)
+        prevista = {int(chave): (valor or None) for chave, valor in campos.items()}
+        try:
+            movidas = aplicar_remarcacoes(excecao, prevista)
+        except ValidationError as erro:
+            messages.error(request, erro.messages[0])
+            return redirect('remarcar_consultas', pk=excecao.pk)
+
+        messages.success(request, f"{len(movidas)} consulta(s) remarcada(s) com sucesso.")
+        if len(movidas) < len(prevista):
+            messages.warning(
+                request, "Algumas consultas ficaram sem horário disponível e precisam ser remarcadas manualmente."
+            )
+        return redirect('gerenciar_agenda')
+
 class ExcecaoHorarioUpdateView(LoginRequiredMixin, AdminOrMedicoRequiredMixin, UpdateView):
     model = ExcecaoHorario
     form_class = ExcecaoHorarioForm
@@ -201,6 +498,17 @@ class ConsultaListView(LoginRequiredMixin, AdminOrAtendenteRequiredMixin, ListVi
     context_object_name = "consultas"
     paginate_by = 10  # itens por página
 
+    def paginate_queryset(self, queryset, page_size):
+        # paginação por cursor (?apos= / ?antes=): páginas profundas custam o mesmo que a primeira
+        apos = self.request.GET.get("apos")
+        antes = self.request.GET.get("antes")
+        try:
+            pagina = paginar_consultas(queryset, page_size, apos=apos, antes=antes)
+        except CursorInvalido:
+            # cursor adulterado ou de outra versão: volta para a primeira página
+            pagina = paginar_consultas(queryset, page_size)
+        return (None, pagina, pagina.object_list, pagina.has_other_pages())
+
     def get_template_names(self):
         # mantém a lógica que usa template diferente para médicos
         if getattr(self.request.user, "tipo", None) == "medico":
@@ -229,14 +537,10 @@ class ConsultaListView(LoginRequiredMixin, AdminOrAtendenteRequiredMixin, ListVi
         else:
             return Consulta.objects.none()
 
-        # FILTRO OPCIONAL por médico via GET (ex.: ?medico=3)
-        medico_id = self.request.GET.get("medico")
-        if medico_id:
-            try:
-                # filtra por pk do médico (seguro contra valores inválidos)
-                qs = qs.filter(medico__pk=int(medico_id))
-            except (ValueError, TypeError):
-                pass
+        # FILTROS OPCIONAIS via GET (ex.: ?medico=3&status=agendada&data_inicio=2025-01-01)
+        self.form_filtro = ConsultaFilterForm(self.request.GET)
+        if self.form_filtro.is_valid():
+            qs = self.form_filtro.filtrar(qs)
 
         return qs
 
@@ -264,63 +568,35 @@ class ConsultaListView(LoginRequiredMixin, AdminOrAtendenteRequiredMixin, ListVi
 
         context["medicos"] = medicos_qs
         context["filtro_medico"] = self.request.GET.get("medico", "")
+        context["form_filtro"] = getattr(self, "form_filtro", ConsultaFilterForm())
 
-        return context
-        
-
-def gerar_horarios_disponiveis(medico, data):
-
-    dia_semana = data.weekday()
-
-    # 1. Buscar horário base do médico neste dia da semana
-    horarios_base = HorarioTrabalho.objects.filter(
-        medico=medico,
-        dia_semana=dia_semana
-    )
-
-    if not horarios_base.exists():
-        return []  # médico não trabalha neste dia
+        # filtros atuais sem o cursor: repassados para a navegação entre páginas e para a exportação
+        filtros = self.request.GET.copy()
+        filtros.pop("apos", None)
+        filtros.pop("antes", None)
+        context["filtros_query"] = filtros.urlencode()
 
-    # Lista final de horários
-    horarios = []
-
-    for h in horarios_base:
-        inicio = datetime.combine(data, h.hora_inicio)
-        fim = datetime.combine(data, h.hora_fim)
-
-        atual = inicio
-        while atual < fim:
-            horarios.append(atual)
-            atual += timedelta(minutes=30)  # slot de 30 minutos
-
-    # 2. Remover horários já ocupados
-    consultas = Consulta.objects.filter(
-        medico=medico,
-        data_hora_inicio__date=data
-    ).values_list("data_hora_inicio", flat=True)
+        return context
 
-    horarios = [h for h in horarios if h not in consultas]
 
-    # 3. Remover horários bloqueados por exceções
-    excecoes = ExcecaoHorario.objects.filter(
-        medico=medico,
-        esta_bloqueado=True,
-        data_inicio__date=data,
-    )
+class ConsultaExportView(ConsultaListView):
+    """CSV de todas as consultas da listagem, com os mesmos filtros e permissões, em streaming."""
 
-    for ex in excecoes:
-        horarios = [
-            h for h in horarios
-            if not (ex.data_inicio <= h <= ex.data_fim)
-        ]
+    def get(self, request, *args, **kwargs):
+        nome = f"consultas_{timezone.localdate():%Y%m%d}.csv"
+        return exportar_consultas_csv(self.get_queryset(), nome_arquivo=nome)
+        
 
-    return horarios
+def gerar_horarios_disponiveis(medico, data):
+    """Slots livres do médico em `data`, calculados pelo mesmo motor de `calcular_slots_disponiveis`."""
+    return slots_do_dia(medico.pk, data)
 
 class ConsultaDeleteView(AdminRequiredMixin, DeleteView):
     model = Consulta
     template_name = "templates_consulta/confirmar_exclusao.html"
     success_url = reverse_lazy("listar_consultas")
 
+    # exclusão definitiva (ex.: registro lançado por engano); o fluxo normal é `cancelar_consulta`
     def delete(self, request, *args, **kwargs):
         messages.success(request, "Consulta excluída com sucesso!")
         return super().delete(request, *args, **kwargs)
@@ -331,6 +607,51 @@ class ConsultaCreateByMedicoView(AdminOrAtendenteRequiredMixin, CreateView):
     template_name = "templates_consulta/form_consulta.html"
     success_url = reverse_lazy("listar_consultas")
 
+    def get(self, request, *args, **kwargs):
+        # segura o slot escolhido enquanto o formulário está aberto; troca de slot libera o anterior
+        self.reserva = None
+        medico_id = kwargs.get('medico_id')
+        inicio = parse_datetime(request.GET.get('slot') or '')
+        if medico_id and inicio:
+            anterior = request.session.get('reserva_slot')
+            self.reserva = reservar_slot(
+                int(medico_id), inicio, substituir=uuid.UUID(anterior) if anterior else None
+            )
+            if self.reserva is None:
+                request.session.pop('reserva_slot', None)
+                messages.warning(
+                    request,
+                    "Este horário já foi ocupado ou está reservado por outro agendamento em andamento. "
+                    "Escolha outro horário.",
+                )
+            else:
+                request.session['reserva_slot'] = str(self.reserva.chave)
+        return super().get(request, *args, **kwargs)
+
+    def post(self, request, *args, **kwargs):
+        # reenvio de um formulário já processado: devolve o resultado original sem validar de novo
+        try:
+            chave = uuid.UUID(request.POST.get('chave_idempotencia', ''))
+        except ValueError:
+            chave = None
+        if consulta_da_submissao(chave) is not None:
+            messages.info(request, "Este agendamento já foi registrado.")
+            return redirect(self.success_url)
+        return super().post(request, *args, **kwargs)
+
+    def form_valid(self, form):
+        try:
+            self.object, criada = agendar_consulta(form, chave=form.cleaned_data.get('chave_idempotencia'))
+        except ValidationError as erro:
+            form.add_error(None, erro)
+            return self.form_invalid(form)
+        self.request.session.pop('reserva_slot', None)
+        if criada:
+            messages.success(self.request, "Consulta agendada com sucesso!")
+        else:
+            messages.info(self.request, "Este agendamento já foi registrado.")
+        return redirect(self.get_success_url())
+
     def get_initial(self):
         # Este método está OK para preencher o form.instance inicialmente.
         # Ele só lida com dados do GET.
@@ -339,6 +660,10 @@ class ConsultaCreateByMedicoView(AdminOrAtendenteRequiredMixin, CreateView):
         if medico_id:
             medico = get_object_or_404(Medico, pk=medico_id)
             initial['medico'] = medico
+        # a chave do formulário é a da reserva do slot
+        reserva = getattr(self, 'reserva', None)
+        if reserva is not None:
+            initial['chave_idempotencia'] = reserva.chave
         # slot na querystring (ex: ?slot=2025-12-10T10:00:00-03:00)
         slot = self.request.GET.get('slot')
         if slot:
@@ -359,6 +684,7 @@ class ConsultaCreateByMedicoView(AdminOrAtendenteRequiredMixin, CreateView):
         # Variáveis para o Card de Confirmação Visual
         context['medico_nome'] = None
         context['horario_selecionado'] = None
+        context['reserva'] = getattr(self, 'reserva', None)
         context['paciente_nome_inicial'] = "" # Variável para preencher o campo de busca de texto
 
         # Tenta obter o ID do médico: 1. URL kwargs, 2. GET (acesso inicial), 3. POST (erro de form)
@@ -370,7 +696,11 @@ class ConsultaCreateByMedicoView(AdminOrAtendenteRequiredMixin, CreateView):
                 context['medico_atual'] = medico
                 # Preenche o nome do médico
                 context['medico_nome'] = medico.usuario.nome_completo
-                context['slots_disponiveis'] = calcular_slots_disponiveis(medico.pk, dias_a_frente=14)
+                # o slot reservado por este formulário aparece livre para ele
+                reserva = context['reserva']
+                context['slots_disponiveis'] = obter_slots_disponiveis(
+                    medico.pk, dias_a_frente=14, chave_reserva=reserva.chave if reserva else None
+                )
             except Medico.DoesNotExist:
                 context['slots_disponiveis'] = {}
                 context['medico_atual'] = None
@@ -414,6 +744,74 @@ class ConsultaCreateByMedicoView(AdminOrAtendenteRequiredMixin, CreateView):
         
         return context
 
+class ConsultaSerieCreateView(AdminOrAtendenteRequiredMixin, FormView):
+    """Agenda uma série de sessões (semanal ou a cada N dias) de uma vez; informa as datas que falharam."""
+    form_class = ConsultaSerieForm
+    template_name = "templates_consulta/form_serie_consultas.html"
+    success_url = reverse_lazy("listar_consultas")
+
+    def dispatch(self, request, *args, **kwargs):
+        self.medico = get_object_or_404(Medico.objects.select_related("usuario"), pk=kwargs["medico_id"])
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_initial(self):
+        initial = super().get_initial()
+        slot = self.request.GET.get('slot')
+        if slot:
+            initial['data_hora_inicio'] = parse_datetime(slot)
+        return initial
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['medico_atual'] = self.medico
+        context['medico_nome'] = self.medico.usuario.nome_completo
+        slot_str = self.request.GET.get('slot') or self.request.POST.get('data_hora_inicio') or ''
+        context['horario_selecionado'] = parse_datetime(slot_str)
+        # nome do paciente já escolhido, para a busca não voltar vazia quando o form tem erros
+        paciente_id = self.request.POST.get('paciente')
+        if paciente_id and paciente_id.isdigit():
+            context['paciente_nome_inicial'] = (
+                Usuario.objects.filter(paciente__pk=paciente_id).values_list('nome_completo', flat=True).first()
+            )
+        return context
+
+    def _reserva_da_sessao(self):
+        # slot reservado ao abrir o agendamento avulso, de onde o usuário veio para a série
+        try:
+            return uuid.UUID(self.request.session.get('reserva_slot') or '')
+        except ValueError:
+            return None
+
+    def form_valid(self, form):
+        dados = form.cleaned_data
+        try:
+            criadas, falhas = agendar_serie(
+                medico_id=self.medico.pk,
+                paciente_id=dados['paciente'].pk,
+                primeiro_inicio=dados['data_hora_inicio'],
+                intervalo_dias=dados['intervalo_dias'],
+                ocorrencias=dados['ocorrencias'],
+                retorno=dados['retorno'],
+                sintomas=dados['sintomas'] or None,
+                chave_reserva=self._reserva_da_sessao(),
+            )
+        except ValidationError as erro:
+            form.add_error(None, erro)
+            return self.form_invalid(form)
+
+        if not criadas:
+            form.add_error(None, "Nenhuma sessão pôde ser agendada: todas as datas estão indisponíveis.")
+            for inicio, motivo in falhas:
+                form.add_error(None, f"{timezone.localtime(inicio):%d/%m/%Y %H:%M}: {motivo}.")
+            return self.form_invalid(form)
+
+        self.request.session.pop('reserva_slot', None)
+        messages.success(self.request, f"{len(criadas)} sessões agendadas com sucesso!")
+        if falhas:
+            datas = "; ".join(f"{timezone.localtime(inicio):%d/%m/%Y %H:%M} ({motivo})" for inicio, motivo in falhas)
+            messages.warning(self.request, f"Não foi possível agendar: {datas}.")
+        return super().form_valid(form)
+
 class HorariosDisponiveisAjaxView(AdminRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         medico_id = request.GET.get('medico')
@@ -447,7 +845,7 @@ class MedicoSlotsView(AdminRequiredMixin, TemplateView):
 
         medico = get_object_or_404(Medico, pk=int(medico_id))
         context['medico'] = medico
-        context['slots_disponiveis'] = calcular_slots_disponiveis(medico.pk, dias_a_frente=14)
+        context['slots_disponiveis'] = obter_slots_disponiveis(medico.pk, dias_a_frente=14)
         return context
 
 @require_POST
@@ -460,24 +858,57 @@ def marcar_concluida(request, pk):
         raise PermissionDenied("Você não tem permissão para concluir esta consulta.")
     
     # --- Lógica da Ação ---
-    if consulta.status == 'agendada':
+    if consulta.pode_mudar_para('concluida'):
         consulta.status = 'concluida'
         consulta.save()
         messages.success(request, f"Consulta de {consulta.paciente.usuario.nome_completo} concluída.")
     else:
          messages.warning(request, f"A consulta não pode ser concluída (status: {consulta.get_status_display()}).")
          
-    return redirect('lista_consultas')
+    return redirect('listar_consultas')
+
+@require_POST
+@login_required
+def cancelar_consulta(request, pk):
+    """
+    Muda o status para 'cancelada' em vez de excluir a consulta: o histórico é mantido e o horário
+    volta a ficar livre (canceladas não ocupam a agenda nem entram nos índices parciais).
+    Podem cancelar admin/atendente, o médico da consulta e o próprio paciente.
+    """
+    consulta = get_object_or_404(Consulta.objects.select_related("medico__usuario", "paciente__usuario"), pk=pk)
+
+    user = request.user
+    if not (
+        user.is_superuser
+        or user.tipo in ("admin", "atendente")
+        or user == consulta.medico.usuario
+        or user == consulta.paciente.usuario
+    ):
+        raise PermissionDenied("Você não tem permissão para cancelar esta consulta.")
+
+    if consulta.pode_mudar_para('cancelada') and consulta.status != 'cancelada':
+        consulta.status = 'cancelada'
+        # save() dispara os signals: cache da agenda e slots materializados são atualizados
+        consulta.save(update_fields=['status'])
+        messages.success(request, f"Consulta de {consulta.paciente.usuario.nome_completo} cancelada.")
+    else:
+        messages.warning(request, f"A consulta não pode ser cancelada (status: {consulta.get_status_display()}).")
+
+    if user.tipo == "paciente":
+        return redirect('minhas_consultas_paciente')
+    return redirect('listar_consultas')
 
-class ConsultaUpdateView(AdminRequiredMixin, UpdateView):
+class ConsultaUpdateView(AdminRequiredMixin, AgendamentoSemConflitoMixin, UpdateView):
     model = Consulta
     form_class = ConsultaForm
     template_name = "templates_consulta/form_consulta.html"
     success_url = reverse_lazy("listar_consultas")
 
     def form_valid(self, form):
-        messages.success(self.request, "Consulta atualizada com sucesso!")
-        return super().form_valid(form)
+        resposta = super().form_valid(form)
+        if not form.errors:
+            messages.success(self.request, "Consulta atualizada com sucesso!")
+        return resposta
 
 class ConsultaEditarView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = Consulta
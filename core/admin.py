@@ -1,8 +1,49 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
 from django.contrib.auth.admin import UserAdmin
+from django.template.response import TemplateResponse
+from django.urls import path
+from .forms import ImportacaoUsuariosForm
+from .importacao import importar_usuarios
 from .models import Usuario, Medico, Paciente, Atendente, Especialidade
 
 
+class ImportacaoCsvAdminMixin:
+    """Adiciona à listagem do admin o botão "Importar CSV" (core.importacao) para o tipo de usuário do perfil."""
+
+    change_list_template = "admin/core/change_list_importacao.html"
+    tipo_importacao = None
+
+    def get_urls(self):
+        urls = [
+            path(
+                "importar/",
+                self.admin_site.admin_view(self.importar_csv),
+                name=f"{self.opts.app_label}_{self.opts.model_name}_importar",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def importar_csv(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        resultado = None
+        form = ImportacaoUsuariosForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            resultado = importar_usuarios(self.tipo_importacao, form.conteudo)
+            self.message_user(request, f"{resultado.criados} usuários importados.", messages.SUCCESS)
+            if resultado.erros:
+                self.message_user(request, f"{len(resultado.erros)} linhas recusadas.", messages.WARNING)
+        contexto = {
+            **self.admin_site.each_context(request),
+            "opts": self.opts,
+            "title": f"Importar {self.opts.verbose_name_plural}",
+            "form": form,
+            "resultado": resultado,
+        }
+        return TemplateResponse(request, "admin/core/importar_usuarios.html", contexto)
+
+
 @admin.register(Usuario)
 class UsuarioAdmin(UserAdmin):
     model = Usuario
@@ -47,7 +88,8 @@ class UsuarioAdmin(UserAdmin):
 
 
 @admin.register(Medico)
-class MedicoAdmin(admin.ModelAdmin):
+class MedicoAdmin(ImportacaoCsvAdminMixin, admin.ModelAdmin):
+    tipo_importacao = "medico"
     list_display = ("get_nome", "get_cpf", "crm", "get_especialidade")
     search_fields = ("usuario__nome_completo", "usuario__cpf", "crm", "especialidade__nome")
     list_filter = ["especialidade__nome"]
@@ -69,7 +111,8 @@ class MedicoAdmin(admin.ModelAdmin):
 
 
 @admin.register(Paciente)
-class PacienteAdmin(admin.ModelAdmin):
+class PacienteAdmin(ImportacaoCsvAdminMixin, admin.ModelAdmin):
+    tipo_importacao = "paciente"
     list_display = ("get_nome", "get_cpf", "peso", "altura", "get_telefone", "get_email")
     search_fields = ("usuario__nome_completo", "usuario__cpf", "usuario__telefone", "usuario__email")
 
@@ -97,7 +140,8 @@ class PacienteAdmin(admin.ModelAdmin):
 
 
 @admin.register(Atendente)
-class AtendenteAdmin(admin.ModelAdmin):
+class AtendenteAdmin(ImportacaoCsvAdminMixin, admin.ModelAdmin):
+    tipo_importacao = "atendente"
     list_display = ("get_nome", "get_cpf", "get_data_nascimento", "get_endereco")
     search_fields = ("usuario__nome_completo", "usuario__cpf")
 
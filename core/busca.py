@@ -0,0 +1,53 @@
+# busca.py
+"""
+Busca de usuários por nome e CPF nas listagens (médicos, atendentes, pacientes).
+
+O nome é buscado em `Usuario.nome_busca` (nome sem acentos e em minúsculas, mantido no save):
+trechos do nome (LIKE '%termo%') e nomes parecidos (`%` do pg_trgm, tolera erros de digitação)
+usam o mesmo índice GIN de trigramas, e os resultados vêm ordenados pela similaridade. O CPF é
+buscado pelo prefixo de `Usuario.cpf_digitos` (só os dígitos), com índice de prefixo.
+"""
+import re
+import unicodedata
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import Q
+
+
+def normalizar_busca(texto: str) -> str:
+    """Minúsculas, sem acentos e com espaços simples: 'José  da SILVA' -> 'jose da silva'."""
+    if not texto:
+        return ""
+    decomposto = unicodedata.normalize("NFKD", texto)
+    sem_acentos = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return " ".join(sem_acentos.lower().split())
+
+
+def digitos_cpf(texto: str) -> str:
+    return re.sub(r"\D", "", texto or "")
+
+
+def buscar_por_nome(queryset, termo: str, campo_usuario: str = "usuario"):
+    """
+    Filtra `queryset` pelo nome do usuário (em `campo_usuario`; "" quando o queryset já é de Usuario)
+    e ordena pela similaridade com o termo, mais parecidos primeiro.
+    """
+    termo = normalizar_busca(termo)
+    if not termo:
+        return queryset
+    prefixo = f"{campo_usuario}__" if campo_usuario else ""
+    campo = f"{prefixo}nome_busca"
+    return (
+        queryset.filter(Q(**{f"{campo}__contains": termo}) | Q(**{f"{campo}__trigram_similar": termo}))
+        .annotate(similaridade=TrigramSimilarity(campo, termo))
+        .order_by("-similaridade", f"{prefixo}nome_completo")
+    )
+
+
+def buscar_por_cpf(queryset, termo: str, campo_usuario: str = "usuario"):
+    """Filtra `queryset` pelo início do CPF (só os dígitos do termo são considerados)."""
+    digitos = digitos_cpf(termo)
+    if not digitos:
+        return queryset
+    prefixo = f"{campo_usuario}__" if campo_usuario else ""
+    return queryset.filter(**{f"{prefixo}cpf_digitos__startswith": digitos})
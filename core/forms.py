@@ -1,6 +1,8 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth import get_user_model
+from .busca import buscar_por_cpf, buscar_por_nome
 from .models import Medico, Paciente, Atendente, Especialidade
 import re
 
@@ -292,3 +294,39 @@ class UsuarioFilterForm(forms.Form):
         label="Buscar por CPF",
         widget=forms.TextInput(attrs={"placeholder": "000.000.000-00"}),
     )
+
+    def filtrar(self, queryset, campo_usuario="usuario"):
+        """
+        Aplica a busca por nome (sem acento, por trechos ou nomes parecidos, ordenada pela
+        similaridade) e por início do CPF. Deve ser chamado com o formulário já validado.
+        """
+        queryset = buscar_por_nome(queryset, self.cleaned_data.get("nome"), campo_usuario)
+        return buscar_por_cpf(queryset, self.cleaned_data.get("cpf"), campo_usuario)
+
+
+class ImportacaoUsuariosForm(forms.Form):
+    arquivo = forms.FileField(
+        label="Arquivo CSV",
+        help_text="Separado por ';' ou ',', com cabeçalho. Colunas: as do cadastro (nome_completo, email, cpf, "
+        "data_nascimento, telefone, endereco...) e, opcionalmente, senha. Arquivos grandes: comando importar_usuarios.",
+    )
+
+    def clean_arquivo(self):
+        from .importacao import ArquivoInvalido, decodificar_csv  # importacao usa os formulários deste módulo
+
+        arquivo = self.cleaned_data["arquivo"]
+        if not arquivo.name.lower().endswith(".csv"):
+            raise forms.ValidationError("Envie um arquivo .csv.")
+        try:
+            self.conteudo = decodificar_csv(arquivo.read())
+        except ArquivoInvalido as erro:
+            raise forms.ValidationError(str(erro))
+        # a importação roda dentro da requisição: arquivos grandes vão pelo comando
+        linhas = sum(1 for linha in self.conteudo.splitlines() if linha.strip()) - 1
+        limite = settings.IMPORTACAO_ADMIN_MAX_LINHAS
+        if linhas > limite:
+            raise forms.ValidationError(
+                f"O arquivo tem {linhas} linhas; pelo admin o limite é {limite}. Para arquivos maiores use "
+                "o comando: python manage.py importar_usuarios <arquivo> --tipo <tipo>"
+            )
+        return arquivo
@@ -0,0 +1,279 @@
+# importacao.py
+"""
+Importação em massa de pacientes, médicos e atendentes a partir de CSV.
+
+Cada linha é validada pelo mesmo formulário do cadastro manual (PacienteForm, MedicoForm,
+AtendenteForm) e o CPF é normalizado (`normalize_cpf`) e conferido pelos dígitos verificadores.
+Linhas com erro não interrompem a importação: vão para o relatório com o número da linha.
+
+O que tornava o cadastro um a um lento era o hash da senha (PBKDF2, centenas de milissegundos
+por usuário) e os INSERTs individuais. Aqui os hashes são calculados num pool de processos e
+as linhas válidas são gravadas em lotes com `bulk_create` (usuários e perfis, um INSERT de cada
+por lote). Como o bulk_create não chama `Usuario.save()`, as colunas de busca (`nome_busca`,
+`cpf_digitos`) são preenchidas aqui.
+
+Se um lote esbarra na unicidade (CPF cadastrado em paralelo), ele é regravado linha a linha, em
+savepoints, para apontar só as linhas em conflito.
+"""
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+
+from .busca import digitos_cpf, normalizar_busca
+from .forms import AtendenteForm, MedicoForm, PacienteForm, normalize_cpf, validar_cpf
+from .models import Atendente, Especialidade, Medico, Paciente, Usuario
+
+IMPORTACAO_LOTE = 1000
+
+# mesma senha inicial do cadastro manual, usada quando o CSV não traz a coluna "senha"
+SENHA_PADRAO = "123456"
+
+# abaixo disso o custo de subir o pool supera o ganho: os hashes são feitos no próprio processo
+MINIMO_PARA_POOL = 50
+
+FORMULARIOS = {
+    "paciente": PacienteForm,
+    "medico": MedicoForm,
+    "atendente": AtendenteForm,
+}
+PERFIS = {
+    "paciente": Paciente,
+    "medico": Medico,
+    "atendente": Atendente,
+}
+
+FORMATOS_DATA = ["%Y-%m-%d", "%d/%m/%Y"]
+
+# o Excel em português salva "CSV" em cp1252 quando não se escolhe "CSV UTF-8"
+CODIFICACOES = ["utf-8-sig", "cp1252"]
+
+
+class ArquivoInvalido(ValueError):
+    pass
+
+
+class ResultadoImportacao:
+    """Quantos usuários foram criados e os erros por linha do arquivo (a linha 1 é o cabeçalho)."""
+
+    def __init__(self):
+        self.criados = 0
+        self.erros = []  # (número da linha, mensagem)
+
+    def adicionar_erro(self, linha: int, mensagem: str) -> None:
+        self.erros.append((linha, mensagem))
+
+    def escrever_relatorio(self, destino) -> None:
+        escritor = csv.writer(destino, delimiter=";")
+        escritor.writerow(["linha", "erro"])
+        escritor.writerows(self.erros)
+
+
+def decodificar_csv(conteudo: bytes) -> str:
+    """Texto do arquivo em UTF-8 (com ou sem BOM) ou cp1252; ArquivoInvalido se não for nenhum dos dois."""
+    for codificacao in CODIFICACOES:
+        try:
+            return conteudo.decode(codificacao)
+        except UnicodeDecodeError:
+            continue
+    raise ArquivoInvalido("Não foi possível ler o arquivo: salve-o como CSV em UTF-8.")
+
+
+def ler_csv(arquivo):
+    """
+    Linhas do CSV como dicionários, com cabeçalhos em minúsculas. `arquivo` é texto ou binário
+    (upload do admin); aceita ";" (o padrão do Excel em português) ou "," e o BOM do UTF-8.
+    """
+    if isinstance(arquivo, (bytes, bytearray)):
+        arquivo = decodificar_csv(arquivo)
+    if isinstance(arquivo, str):
+        arquivo = io.StringIO(arquivo)
+    amostra = arquivo.read(4096)
+    arquivo.seek(0)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=";,")
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.DictReader(arquivo, dialect=dialeto)
+    leitor.fieldnames = [(nome or "").strip().lstrip("\ufeff").lower() for nome in leitor.fieldnames or []]
+    return leitor
+
+
+def _data_iso(valor: str) -> str:
+    # os formulários seguem o locale do projeto (mm/dd/aaaa); a planilha vem em dd/mm/aaaa
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(valor.strip(), formato).date().isoformat()
+        except ValueError:
+            continue
+    return valor
+
+
+def _iniciar_processo():
+    # com "spawn" o processo filho começa sem o Django carregado
+    import django
+
+    django.setup()
+
+
+def _gerar_hash(senha: str) -> str:
+    return make_password(senha)
+
+
+def abrir_pool(processos: int, total: int):
+    """Pool de processos para os hashes, ou um contexto vazio (None) quando não compensa."""
+    if processos == 1 or total < MINIMO_PARA_POOL:
+        return nullcontext(None)
+    return ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_processo)
+
+
+def gerar_hashes(senhas, pool=None, processos: int = 1):
+    """Hashes das senhas, na mesma ordem; em paralelo se houver `pool`."""
+    senhas = list(senhas)
+    if pool is None:
+        return [make_password(senha) for senha in senhas]
+    return list(pool.map(_gerar_hash, senhas, chunksize=max(1, len(senhas) // (processos * 4))))
+
+
+def _validar_linha(tipo, dados, especialidades):
+    """(cleaned_data, None) se a linha é válida, ou (None, mensagem de erro)."""
+    dados = {campo: (valor or "").strip() for campo, valor in dados.items() if campo}
+    cpf = normalize_cpf(dados.get("cpf", ""))
+    if not validar_cpf(cpf):
+        return None, "CPF inválido."
+    dados["cpf"] = cpf
+    if dados.get("data_nascimento"):
+        dados["data_nascimento"] = _data_iso(dados["data_nascimento"])
+    if tipo == "medico":
+        # a planilha traz o nome da especialidade; o formulário espera o id
+        nome = dados.get("especialidade", "").lower()
+        if nome and nome not in especialidades:
+            return None, f"Especialidade não cadastrada: {dados['especialidade']}."
+        dados["especialidade"] = especialidades.get(nome, "")
+
+    form = FORMULARIOS[tipo](dados)
+    if not form.is_valid():
+        mensagens = [f"{campo}: {' '.join(erros)}" for campo, erros in form.errors.items()]
+        return None, "; ".join(mensagens)
+    return form.cleaned_data, None
+
+
+def _novo_usuario(tipo, dados, hash_senha):
+    cpf = dados["cpf"]
+    return Usuario(
+        username=cpf,
+        cpf=cpf,
+        nome_completo=dados["nome_completo"],
+        email=dados["email"],
+        telefone=dados.get("telefone", ""),
+        data_nascimento=dados.get("data_nascimento"),
+        endereco=dados.get("endereco", ""),
+        tipo=tipo,
+        password=hash_senha,
+        nome_busca=normalizar_busca(dados["nome_completo"]),
+        cpf_digitos=digitos_cpf(cpf),
+    )
+
+
+def _novo_perfil(tipo, usuario, dados):
+    if tipo == "paciente":
+        return Paciente(usuario=usuario, peso=dados.get("peso"), altura=dados.get("altura"))
+    if tipo == "medico":
+        return Medico(usuario=usuario, crm=dados["crm"], especialidade=dados["especialidade"])
+    return Atendente(usuario=usuario)
+
+
+def _gravar_lote(tipo, lote, resultado):
+    """Grava [(linha, dados, hash)] com um bulk_create de usuários e um de perfis."""
+    try:
+        with transaction.atomic():
+            usuarios = Usuario.objects.bulk_create(
+                [_novo_usuario(tipo, dados, hash_senha) for _, dados, hash_senha in lote]
+            )
+            PERFIS[tipo].objects.bulk_create(
+                [_novo_perfil(tipo, usuario, dados) for usuario, (_, dados, _) in zip(usuarios, lote)]
+            )
+        resultado.criados += len(lote)
+    except IntegrityError:
+        # alguém cadastrou um desses CPFs (ou CRMs) depois da checagem: separa as linhas em conflito
+        for linha, dados, hash_senha in lote:
+            try:
+                with transaction.atomic():
+                    usuario = _novo_usuario(tipo, dados, hash_senha)
+                    usuario.save()
+                    _novo_perfil(tipo, usuario, dados).save()
+                resultado.criados += 1
+            except IntegrityError:
+                resultado.adicionar_erro(linha, "CPF ou CRM já cadastrado.")
+
+
+def importar_usuarios(tipo: str, arquivo, lote: int = IMPORTACAO_LOTE, processos: int = None) -> ResultadoImportacao:
+    """
+    Importa os usuários de `tipo` ("paciente", "medico" ou "atendente") do CSV `arquivo`.
+    Colunas: as do formulário de cadastro do tipo (nome_completo, email, cpf, data_nascimento,
+    telefone, endereco; peso/altura ou crm/especialidade) e, opcionalmente, senha.
+    """
+    if tipo not in FORMULARIOS:
+        raise ValueError(f"Tipo de usuário inválido para importação: {tipo}")
+
+    resultado = ResultadoImportacao()
+    especialidades = {}
+    if tipo == "medico":
+        especialidades = {nome.lower(): pk for pk, nome in Especialidade.objects.values_list("pk", "nome")}
+
+    validas = []  # (linha, dados, senha)
+    cpfs_no_arquivo, crms_no_arquivo = set(), set()
+    for numero, linha in enumerate(ler_csv(arquivo), start=2):
+        dados, erro = _validar_linha(tipo, linha, especialidades)
+        if erro:
+            resultado.adicionar_erro(numero, erro)
+        elif dados["cpf"] in cpfs_no_arquivo:
+            resultado.adicionar_erro(numero, "CPF repetido no arquivo.")
+        elif tipo == "medico" and dados["crm"] in crms_no_arquivo:
+            resultado.adicionar_erro(numero, "CRM repetido no arquivo.")
+        else:
+            cpfs_no_arquivo.add(dados["cpf"])
+            if tipo == "medico":
+                crms_no_arquivo.add(dados["crm"])
+            validas.append((numero, dados, (linha.get("senha") or "").strip() or SENHA_PADRAO))
+
+    processos = processos or os.cpu_count() or 1
+    with abrir_pool(processos, len(validas)) as pool:
+        for inicio in range(0, len(validas), lote):
+            _importar_lote(tipo, validas[inicio:inicio + lote], resultado, pool, processos)
+
+    resultado.erros.sort()
+    return resultado
+
+
+def _importar_lote(tipo, pedaco, resultado, pool, processos):
+    """Descarta as linhas cujo CPF/CRM já está no banco, gera os hashes e grava o restante."""
+    # um SELECT por lote para os CPFs (e CRMs) que já existem no banco
+    cpfs = [dados["cpf"] for _, dados, _ in pedaco]
+    # cpf_digitos: contas antigas podem ter o CPF gravado com pontuação
+    existentes = set(Usuario.objects.filter(cpf_digitos__in=cpfs).values_list("cpf_digitos", flat=True))
+    existentes |= set(Usuario.objects.filter(username__in=cpfs).values_list("username", flat=True))
+    crms_existentes = set()
+    if tipo == "medico":
+        crms = [dados["crm"] for _, dados, _ in pedaco]
+        crms_existentes = set(Medico.objects.filter(crm__in=crms).values_list("crm", flat=True))
+
+    novos = []
+    for numero, dados, senha in pedaco:
+        if dados["cpf"] in existentes:
+            resultado.adicionar_erro(numero, "Já existe uma conta cadastrada com este CPF.")
+        elif tipo == "medico" and dados["crm"] in crms_existentes:
+            resultado.adicionar_erro(numero, "Já existe um médico cadastrado com este CRM.")
+        else:
+            novos.append((numero, dados, senha))
+    if not novos:
+        return
+
+    hashes = gerar_hashes([senha for _, _, senha in novos], pool=pool, processos=processos)
+    com_hash = [(numero, dados, hash_senha) for (numero, dados, _), hash_senha in zip(novos, hashes)]
+    _gravar_lote(tipo, com_hash, resultado)
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importacao import FORMULARIOS, IMPORTACAO_LOTE, ArquivoInvalido, importar_usuarios
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa pacientes, médicos ou atendentes de um CSV (separado por ';' ou ','), validando cada linha "
+        "como no cadastro manual. As senhas são geradas em paralelo e as linhas gravadas em lotes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("arquivo", help="CSV com cabeçalho (nome_completo, email, cpf, data_nascimento, ...).")
+        parser.add_argument("--tipo", choices=sorted(FORMULARIOS), required=True, help="Tipo dos usuários do arquivo.")
+        parser.add_argument(
+            "--lote", type=int, default=IMPORTACAO_LOTE, help=f"Linhas por INSERT (padrão: {IMPORTACAO_LOTE})."
+        )
+        parser.add_argument("--processos", type=int, help="Processos para gerar as senhas (padrão: número de CPUs).")
+        parser.add_argument("--erros", help="Arquivo CSV com as linhas recusadas e o motivo.")
+
+    def handle(self, *args, **options):
+        if options["lote"] < 1:
+            raise CommandError("--lote deve ser positivo.")
+        inicio = time.perf_counter()
+        try:
+            with open(options["arquivo"], "rb") as arquivo:
+                # bytes: UTF-8 ou cp1252 (CSV do Excel), como no upload do admin
+                resultado = importar_usuarios(
+                    options["tipo"], arquivo.read(), lote=options["lote"], processos=options["processos"]
+                )
+        except OSError as erro:
+            raise CommandError(f"Não foi possível ler {options['arquivo']}: {erro}")
+        except ArquivoInvalido as erro:
+            raise CommandError(str(erro))
+
+        duracao = time.perf_counter() - inicio
+        self.stdout.write(
+            self.style.SUCCESS(f"{resultado.criados} usuários importados em {duracao:.1f}s.")
+        )
+        if resultado.erros:
+            self.stdout.write(self.style.WARNING(f"{len(resultado.erros)} linhas recusadas."))
+            for linha, mensagem in resultado.erros[:20]:
+                self.stdout.write(f"  linha {linha}: {mensagem}")
+            if options["erros"]:
+                with open(options["erros"], "w", encoding="utf-8", newline="") as destino:
+                    resultado.escrever_relatorio(destino)
+                self.stdout.write(f"Relatório de erros gravado em {options['erros']}.")
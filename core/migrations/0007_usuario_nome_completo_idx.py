@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0006_usuario_foto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['nome_completo'], name='usuario_nome_completo_idx'),
+        ),
+    ]
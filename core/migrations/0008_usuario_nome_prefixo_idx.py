@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:07
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0007_usuario_nome_completo_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('nome_completo'), name='text_pattern_ops'), name='usuario_nome_prefixo_idx'),
+        ),
+    ]
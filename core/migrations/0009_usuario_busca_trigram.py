@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-18 17:09
+
+import re
+import unicodedata
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+LOTE = 2000
+
+
+# cópias de core.busca na data desta migração: a migração não pode mudar junto com o código da aplicação
+def normalizar_busca(texto):
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', texto)
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.lower().split())
+
+
+def digitos_cpf(texto):
+    return re.sub(r'\D', '', texto or '')
+
+
+def preencher_colunas_busca(apps, schema_editor):
+    Usuario = apps.get_model('core', 'Usuario')
+    lote = []
+    for usuario in Usuario.objects.only('pk', 'nome_completo', 'cpf').iterator(chunk_size=LOTE):
+        usuario.nome_busca = normalizar_busca(usuario.nome_completo)
+        usuario.cpf_digitos = digitos_cpf(usuario.cpf)
+        lote.append(usuario)
+        if len(lote) == LOTE:
+            Usuario.objects.bulk_update(lote, ['nome_busca', 'cpf_digitos'])
+            lote = []
+    Usuario.objects.bulk_update(lote, ['nome_busca', 'cpf_digitos'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0008_usuario_nome_prefixo_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='usuario',
+            name='cpf_digitos',
+            field=models.CharField(default='', editable=False, max_length=14),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='nome_busca',
+            field=models.CharField(default='', editable=False, max_length=150),
+        ),
+        # preenchidas antes de criar os índices: um build só, em vez de manter o índice a cada UPDATE
+        migrations.RunPython(preencher_colunas_busca, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['nome_busca'], name='usuario_nome_busca_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['cpf_digitos'], name='usuario_cpf_digitos_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
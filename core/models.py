@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+
+from .busca import digitos_cpf, normalizar_busca
 from django.conf import settings
 
 class Usuario(AbstractUser):
@@ -18,9 +22,39 @@ class Usuario(AbstractUser):
     ]
     tipo = models.CharField(max_length=20, choices=TIPO_USUARIO)
 
+    # colunas de busca (core.busca), preenchidas no save a partir de nome_completo e cpf
+    nome_busca = models.CharField(max_length=150, editable=False, default="")
+    cpf_digitos = models.CharField(max_length=14, editable=False, default="")
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # listagens de médicos, atendentes e pacientes ordenadas por nome
+            models.Index(fields=["nome_completo"], name="usuario_nome_completo_idx"),
+            # busca por início do nome sem diferenciar maiúsculas (nome_completo__istartswith);
+            # o prefixo do CPF já usa o índice *_like criado pelo unique=True
+            models.Index(OpClass(Upper("nome_completo"), name="text_pattern_ops"), name="usuario_nome_prefixo_idx"),
+            # trechos e nomes parecidos, sem acento (LIKE '%...%' e o operador % do pg_trgm)
+            GinIndex(fields=["nome_busca"], opclasses=["gin_trgm_ops"], name="usuario_nome_busca_trgm_idx"),
+            # início do CPF, só dígitos
+            models.Index(fields=["cpf_digitos"], opclasses=["varchar_pattern_ops"], name="usuario_cpf_digitos_idx"),
+        ]
+
     def __str__(self):
         return f"{self.nome_completo} ({self.get_tipo_display()})"
 
+    def save(self, *args, **kwargs):
+        self.nome_busca = normalizar_busca(self.nome_completo)
+        self.cpf_digitos = digitos_cpf(self.cpf)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            campos = set(update_fields)
+            if "nome_completo" in campos:
+                campos.add("nome_busca")
+            if "cpf" in campos:
+                campos.add("cpf_digitos")
+            kwargs["update_fields"] = campos
+        super().save(*args, **kwargs)
+
 
 class Especialidade(models.Model):
     nome = models.CharField(max_length=100, unique=True)
@@ -0,0 +1,157 @@
+import csv
+from io import StringIO
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse
+
+from .busca import buscar_por_nome, normalizar_busca
+from .importacao import importar_usuarios
+from .models import Especialidade, Medico, Paciente, Usuario
+
+
+def _criar_paciente(nome, cpf):
+    usuario = Usuario.objects.create_user(username=cpf, cpf=cpf, nome_completo=nome, tipo="paciente")
+    return Paciente.objects.create(usuario=usuario)
+
+
+def test_normalizar_busca_remove_acentos_e_espacos():
+    assert normalizar_busca("  José  da SILVA Conceição ") == "jose da silva conceicao"
+
+
+@pytest.mark.django_db
+def test_busca_de_pacientes_ignora_acentos_e_ordena_por_similaridade(client):
+    atendente = Usuario.objects.create_user(
+        username="atendente", cpf="33333333333", nome_completo="Atendente", tipo="atendente"
+    )
+    _criar_paciente("José da Silva", "123.456.789-01")
+    _criar_paciente("Maria José Souza", "12399988877")
+    _criar_paciente("Josefa Lima", "45678912300")
+    _criar_paciente("João Pereira", "98765432100")
+
+    client.force_login(atendente)
+    url = reverse("listar_pacientes")
+    nomes = [p.usuario.nome_completo for p in client.get(url, {"nome": "jose"}).context["pacientes"]]
+    assert set(nomes) == {"José da Silva", "Maria José Souza", "Josefa Lima"}
+    similaridades = [p.similaridade for p in client.get(url, {"nome": "jose"}).context["pacientes"]]
+    assert similaridades == sorted(similaridades, reverse=True)
+
+    # nome parecido (erro de digitação) também é encontrado
+    parecidos = client.get(url, {"nome": "jozé silva"}).context["pacientes"]
+    assert [p.usuario.nome_completo for p in parecidos][0] == "José da Silva"
+    # CPF pelo início, com ou sem pontuação
+    cpfs = [p.usuario.cpf for p in client.get(url, {"cpf": "123.4"}).context["pacientes"]]
+    assert cpfs == ["123.456.789-01"]
+
+    usuario = Usuario.objects.get(nome_completo="João Pereira")
+    usuario.nome_completo = "João José Pereira"
+    usuario.save(update_fields=["nome_completo"])
+    assert Usuario.objects.get(pk=usuario.pk).nome_busca == "joao jose pereira"
+
+
+@pytest.mark.django_db
+def test_busca_por_nome_usa_indice_de_trigramas():
+    Usuario.objects.bulk_create(
+        Usuario(
+            username=f"u{i}",
+            cpf=f"{i:011d}",
+            nome_completo=f"Paciente {i}",
+            nome_busca=f"paciente {i}",
+            cpf_digitos=f"{i:011d}",
+            tipo="paciente",
+        )
+        for i in range(5000)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        sql, params = buscar_por_nome(Usuario.objects.all(), "josé", campo_usuario="").query.sql_with_params()
+        cursor.execute(f"EXPLAIN {sql}", params)
+        plano = "\n".join(linha for (linha,) in cursor.fetchall())
+    assert "usuario_nome_busca_trgm_idx" in plano
+
+
+def _cpf_valido(base: int) -> str:
+    digitos = [int(d) for d in f"{base:09d}"]
+    for tamanho in (9, 10):
+        total = sum(d * (tamanho + 1 - i) for i, d in enumerate(digitos))
+        digitos.append((total * 10) % 11 % 10)
+    return "".join(map(str, digitos))
+
+
+@pytest.mark.django_db
+def test_importacao_de_pacientes_em_lotes_com_relatorio_por_linha(settings):
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    existente = _cpf_valido(999)
+    _criar_paciente("Já Cadastrado", f"{existente[:3]}.{existente[3:6]}.{existente[6:9]}-{existente[9:]}")
+
+    linhas = [["nome_completo", "email", "cpf", "data_nascimento", "peso", "senha"]]
+    for i in range(60):
+        cpf = _cpf_valido(1000 + i)
+        cpf_formatado = f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+        linhas.append([f"Paciente Importado {i}", f"p{i}@exemplo.com", cpf_formatado, "31/12/1990", "70.5", ""])
+    linhas.append(["CPF Errado", "x@exemplo.com", "123.456.789-00", "1990-01-01", "", ""])  # linha 62
+    linhas.append(["Repetido", "r@exemplo.com", _cpf_valido(1000), "1990-01-01", "", ""])  # linha 63
+    linhas.append(["Já Existe", "e@exemplo.com", existente, "1990-01-01", "", ""])  # linha 64
+    linhas.append(["Sem Email", "", _cpf_valido(2000), "1990-01-01", "", "segredo"])  # linha 65
+    arquivo = StringIO()
+    csv.writer(arquivo, delimiter=";").writerows(linhas)
+
+    resultado = importar_usuarios("paciente", arquivo.getvalue(), lote=25, processos=2)
+
+    assert resultado.criados == 60
+    assert [linha for linha, _ in resultado.erros] == [62, 63, 64, 65]
+    assert "CPF" in resultado.erros[2][1] and "email" in resultado.erros[3][1]
+    usuario = Usuario.objects.get(cpf=_cpf_valido(1007))
+    assert (usuario.tipo, usuario.nome_busca, usuario.cpf_digitos) == (
+        "paciente",
+        "paciente importado 7",
+        _cpf_valido(1007),
+    )
+    assert str(usuario.data_nascimento) == "1990-12-31" and usuario.check_password("123456")
+    assert Paciente.objects.filter(usuario__nome_completo__startswith="Paciente Importado").count() == 60
+
+
+@pytest.mark.django_db
+def test_importacao_de_medicos_pelo_comando_e_pelo_admin(client, settings, tmp_path):
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    Especialidade.objects.create(nome="Cardiologia")
+    arquivo = tmp_path / "medicos.csv"
+    arquivo.write_text(
+        "nome_completo,email,cpf,data_nascimento,crm,especialidade\n"
+        f"Ana Cardio,ana@exemplo.com,{_cpf_valido(1)},1980-05-01,CRM-1,cardiologia\n"
+        f"Bruno Orto,bruno@exemplo.com,{_cpf_valido(2)},1980-05-01,CRM-2,Ortopedia\n",
+        encoding="utf-8",
+    )
+    erros = tmp_path / "erros.csv"
+    call_command("importar_usuarios", str(arquivo), "--tipo", "medico", "--erros", str(erros), stdout=StringIO())
+    assert Medico.objects.get(crm="CRM-1").especialidade.nome == "Cardiologia"
+    assert "Especialidade não cadastrada: Ortopedia" in erros.read_text(encoding="utf-8")
+
+    admin = Usuario.objects.create_superuser(username="admin", cpf="00000000000", password="x", tipo="admin")
+    client.force_login(admin)
+    url = reverse("admin:core_medico_importar")
+    assert "Importar CSV" in client.get(reverse("admin:core_medico_changelist")).content.decode()
+    upload = SimpleUploadedFile("medicos.csv", arquivo.read_bytes(), content_type="text/csv")
+    resposta = client.post(url, {"arquivo": upload})
+    assert resposta.status_code == 200
+    # Ana já foi importada pelo comando; Bruno continua sem especialidade válida
+    assert [linha for linha, _ in resposta.context["resultado"].erros] == [2, 3]
+
+    # CSV salvo pelo Excel em cp1252
+    conteudo = (
+        "nome_completo;email;cpf;data_nascimento;crm;especialidade\n"
+        f"João Médico;joao@exemplo.com;{_cpf_valido(3)};01/05/1980;CRM-3;Cardiologia\n"
+    )
+    upload = SimpleUploadedFile("medicos.csv", conteudo.encode("cp1252"), content_type="text/csv")
+    assert client.post(url, {"arquivo": upload}).context["resultado"].criados == 1
+    assert Usuario.objects.get(cpf=_cpf_valido(3)).nome_completo == "João Médico"
+
+    # acima do limite do admin o arquivo é recusado, sem importar nada
+    settings.IMPORTACAO_ADMIN_MAX_LINHAS = 1
+    upload = SimpleUploadedFile("medicos.csv", arquivo.read_bytes(), content_type="text/csv")
+    resposta = client.post(url, {"arquivo": upload})
+    assert resposta.context["resultado"] is None
+    assert "importar_usuarios" in resposta.context["form"].errors["arquivo"][0]
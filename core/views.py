@@ -20,7 +20,6 @@ from django.views.generic import ListView, DeleteView
 from django.urls import reverse_lazy
 from django.contrib.auth.views import PasswordChangeView
 from django.views import View
-from django.db.models import Q
 from django.contrib.auth import update_session_auth_hash
 import os
 from django.utils.text import get_valid_filename
@@ -287,9 +286,7 @@ class MedicoListView(AdminOrAtendenteRequiredMixin, ListView):
         queryset = super().get_queryset().select_related("usuario", "especialidade").order_by("usuario__nome_completo")
         self.form = UsuarioFilterForm(self.request.GET)
         if self.form.is_valid():
-            nome_query = self.form.cleaned_data.get("nome")
-            if nome_query:
-                queryset = queryset.filter(Q(usuario__nome_completo__icontains=nome_query))
+            queryset = self.form.filtrar(queryset)
             especialidade_obj = self.form.cleaned_data.get("especialidade")
             if especialidade_obj:
                 queryset = queryset.filter(especialidade=especialidade_obj)
@@ -321,9 +318,7 @@ class AtendenteListView(AdminRequiredMixin, ListView):
         queryset = super().get_queryset().select_related("usuario").order_by("usuario__nome_completo")
         self.form = UsuarioFilterForm(self.request.GET)
         if self.form.is_valid():
-            nome_query = self.form.cleaned_data.get("nome")
-            if nome_query:
-                queryset = queryset.filter(Q(usuario__nome_completo__icontains=nome_query))
+            queryset = self.form.filtrar(queryset)
         return queryset
 
     def get_context_data(self, **kwargs):
@@ -351,13 +346,7 @@ class PacienteListView(AdminOrAtendenteRequiredMixin, ListView):
         queryset = super().get_queryset().select_related("usuario").order_by("usuario__nome_completo")
         self.form = UsuarioFilterForm(self.request.GET)
         if self.form.is_valid():
-            nome_query = self.form.cleaned_data.get("nome")
-            if nome_query:
-                queryset = queryset.filter(Q(usuario__nome_completo__icontains=nome_query))
-            cpf_query = self.form.cleaned_data.get("cpf")
-            if cpf_query:
-                cpf_limpo = "".join(filter(str.isdigit, cpf_query))
-                queryset = queryset.filter(usuario__cpf__icontains=cpf_limpo)
+            queryset = self.form.filtrar(queryset)
         return queryset
 
     def get_context_data(self, **kwargs):